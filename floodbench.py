@@ -0,0 +1,336 @@
+#!/usr/bin/env Python
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+'''
+A benchmark harness for the flood engines. Boards of several terrain types
+are generated from a fixed seed at a range of sizes and heights, flooded by
+each engine, and their wall time, peak memory and squares and cubes per
+second are written to JSON. Continuous mode never builds any cubes, so it
+is only measured in squares per second. A stored JSON file of earlier
+results may be passed as a baseline, in which case every run that regresses
+beyond a threshold is reported and the script exits with a non-zero status.
+'''
+
+from topographyfloodsim import ENGINE_PATHFINDING, ENGINE_PRIORITY_FLOOD, \
+    ENGINE_LEVEL_SWEEP, STORAGE_OBJECTS, STORAGE_COMPACT, MakeCartesianGrid, \
+    groom_grid, simulate_flood, flood_surface, flood_statistics
+from floodterrain import TERRAIN_TYPES, make_terrain
+
+# Board sizes, maximum heights and seed of the default benchmark suite
+DEFAULT_SIZES = (8, 32, 128, 512, 2000)
+DEFAULT_HEIGHTS = (10, 200)
+DEFAULT_SEED = 0
+# Timed runs of each case, of which the fastest is kept
+DEFAULT_REPEAT = 3
+# Relative slowdown or growth in memory reported as a regression
+DEFAULT_THRESHOLD = 0.25
+# Slowdowns shorter than this are timer noise rather than regressions
+MIN_REGRESSION_SECONDS = 0.005
+
+# Engine and storage of each benchmark mode, where an engine of None floods
+# the 2D grid in continuous mode, and the largest number of cubes each mode
+# is asked to flood
+BENCHMARK_MODES = {
+    'pathfinding': (ENGINE_PATHFINDING, STORAGE_OBJECTS),
+    'level_sweep': (ENGINE_LEVEL_SWEEP, STORAGE_COMPACT),
+    'priority_flood': (ENGINE_PRIORITY_FLOOD, STORAGE_COMPACT),
+    'continuous': (None, None),
+}
+MODE_CUBE_LIMITS = {
+    'pathfinding': 2*10**5,
+    'level_sweep': 5*10**6,
+    'priority_flood': 5*10**7,
+    'continuous': None,
+}
+
+
+def make_board(terrain, size, max_height, seed=DEFAULT_SEED):
+    """
+    Generates the square benchmark board of a terrain type, which is always
+    the same for the same arguments.
+
+    Parameters
+    ----------
+    terrain : str
+        One of floodterrain.TERRAIN_TYPES
+    size : int
+        Length and width of the board
+    max_height : int
+        Highest height of the board
+    seed : int, optional, defaults to DEFAULT_SEED
+        Seed of the board's randomness
+
+    Returns
+    -------
+    topo_grid : 2D arr/list of lists
+    """
+    return make_terrain(terrain, size, size, max_height,
+        f'{seed}-{terrain}-{size}-{max_height}')
+
+def flood_board(topo_grid, mode):
+    """
+    Floods a board the way full_simulation() does, without printing it.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        The board to flood
+    mode : str
+        One of BENCHMARK_MODES
+
+    Returns
+    -------
+    (total_flooding, max_water_level) : tuple
+    """
+    engine, storage = BENCHMARK_MODES[mode]
+    groomed_grid, max_height = groom_grid([list(row) for row in topo_grid])
+    if engine is None:
+        return flood_statistics(flood_surface(groomed_grid))
+    cube_grid = MakeCartesianGrid(groomed_grid, max_height, storage=storage)
+    return flood_statistics(simulate_flood(cube_grid.cubes, engine))
+
+def run_case(topo_grid, mode, repeat=DEFAULT_REPEAT, trace_memory=True):
+    """
+    Times the flooding of a board, keeping the fastest of repeated runs, and
+    measures its peak memory in one more run traced by tracemalloc. Runs
+    longer than a second are not repeated.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        The board to flood
+    mode : str
+        One of BENCHMARK_MODES
+    repeat : int, optional, defaults to DEFAULT_REPEAT
+        Largest number of timed runs
+    trace_memory : bool, optional, default True
+        Measure the peak memory, which makes large boards several times
+        slower to benchmark
+
+    Returns
+    -------
+    (seconds, peak_bytes, result) : tuple (float, int or None, tuple)
+        Fastest wall time, peak memory allocated while flooding, and the
+        statistics of the board
+    """
+    seconds = None
+    for run in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = flood_board(topo_grid, mode)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        if elapsed > 1:
+            break
+
+    if not trace_memory:
+        return seconds, None, result
+    tracemalloc.start()
+    try:
+        flood_board(topo_grid, mode)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_bytes, result
+
+def run_benchmarks(sizes=DEFAULT_SIZES, heights=DEFAULT_HEIGHTS,
+    terrains=tuple(TERRAIN_TYPES), modes=tuple(BENCHMARK_MODES),
+    repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED, trace_memory=True, log=None):
+    """
+    Runs every combination of size, height, terrain and mode, skipping the
+    combinations with more cubes than MODE_CUBE_LIMITS allows their mode.
+    Every mode is rated in squares per second, and the modes which build
+    cubes in cubes per second as well, which is None in continuous mode.
+
+    Parameters
+    ----------
+    sizes : sequence of int, optional, defaults to DEFAULT_SIZES
+        Lengths and widths of the square boards
+    heights : sequence of int, optional, defaults to DEFAULT_HEIGHTS
+        Maximum heights of the boards
+    terrains : sequence of str, optional, defaults to all TERRAIN_TYPES
+    modes : sequence of str, optional, defaults to all BENCHMARK_MODES
+    repeat : int, optional, defaults to DEFAULT_REPEAT
+        Largest number of timed runs of each case
+    seed : int, optional, defaults to DEFAULT_SEED
+        Seed of the boards
+    trace_memory : bool, optional, default True
+        Measure the peak memory of each case, see run_case()
+    log : file object, optional
+        Text stream receiving a line of progress per case
+
+    Returns
+    -------
+    results : list of dicts
+        One record per case, see the keys below
+    """
+    results = []
+    for terrain in terrains:
+        for size in sizes:
+            for max_height in heights:
+                topo_grid = None
+                for mode in modes:
+                    squares, cubes = size*size, size*size*max_height
+                    limit = MODE_CUBE_LIMITS[mode]
+                    if limit is not None and cubes > limit:
+                        continue
+                    if topo_grid is None:
+                        topo_grid = make_board(terrain, size, max_height, seed)
+                    seconds, peak_bytes, (total_flooding, max_water_level) = \
+                        run_case(topo_grid, mode, repeat, trace_memory)
+                    # Continuous mode floods the squares without any cubes
+                    if BENCHMARK_MODES[mode][0] is None:
+                        cubes = None
+                    record = {
+                        'name': f'{terrain}-{size}x{size}x{max_height}-{mode}',
+                        'terrain': terrain, 'length': size, 'width': size,
+                        'max_height': max_height, 'mode': mode,
+                        'squares': squares, 'cubes': cubes,
+                        'seconds': seconds, 'peak_bytes': peak_bytes,
+                        'squares_per_second': squares / seconds if seconds 
+                            else None,
+                        'cubes_per_second': cubes / seconds if seconds and 
+                            cubes is not None else None,
+                        'total_flooding': total_flooding,
+                        'max_water_level': max_water_level,
+                    }
+                    results.append(record)
+                    if log is not None:
+                        memory = '' if peak_bytes is None else \
+                            f"{peak_bytes/2**20:.1f} MiB, "
+                        unit = 'squares' if cubes is None else 'cubes'
+                        rate = record[unit + '_per_second'] or 0
+                        log.write(f"{record['name']}: {seconds:.4f}s, " +
+                            memory + f"{rate:,.0f} {unit}/s\n")
+    return results
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares benchmark results with those of a stored baseline. A case
+    regresses when it is slower or uses more memory than its baseline by
+    more than the threshold, or when its statistics differ from the
+    baseline's. Cases missing from the baseline are not compared.
+
+    Parameters
+    ----------
+    results : list of dicts
+        Records produced by run_benchmarks()
+    baseline : list of dicts
+        Earlier records of run_benchmarks()
+    threshold : float, optional, defaults to DEFAULT_THRESHOLD
+        Relative growth allowed in time and memory
+
+    Returns
+    -------
+    regressions : list of str
+        A description of every regression found
+    """
+    previous = {record['name']: record for record in baseline}
+    regressions = []
+    for record in results:
+        name = record['name']
+        if name not in previous:
+            continue
+        before = previous[name]
+        if (record['total_flooding'], record['max_water_level']) != \
+            (before['total_flooding'], before['max_water_level']):
+            regressions.append(f"{name}: statistics changed from " +
+                f"{before['total_flooding']}, {before['max_water_level']} " +
+                f"to {record['total_flooding']}, {record['max_water_level']}")
+        if record['seconds'] > before['seconds']*(1+threshold) and \
+            record['seconds']-before['seconds'] > MIN_REGRESSION_SECONDS:
+            regressions.append(f"{name}: {record['seconds']:.4f}s against " +
+                f"{before['seconds']:.4f}s")
+        if None not in (record['peak_bytes'], before['peak_bytes']) and \
+            record['peak_bytes'] > before['peak_bytes']*(1+threshold):
+            regressions.append(f"{name}: {record['peak_bytes']} bytes " +
+                f"against {before['peak_bytes']} bytes")
+    return regressions
+
+def benchmark_report(results):
+    """
+    Wraps benchmark results with a description of the interpreter and
+    machine which produced them, as written to JSON.
+
+    Parameters
+    ----------
+    results : list of dicts
+        Records produced by run_benchmarks()
+
+    Returns
+    -------
+    report : dict
+    """
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'results': results,
+    }
+
+"""
+The benchmark suite may be run from the command line, for example to store
+a baseline and later check a change against it:
+
+python floodbench.py --sizes 8 32 128 --output baseline.json
+python floodbench.py --sizes 8 32 128 --baseline baseline.json
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the flood \
+                        engines on generated boards')
+    parser.add_argument('--sizes', dest='sizes', metavar='size', type=int,
+                        nargs='+', default=DEFAULT_SIZES, help='lengths and \
+                        widths of the square boards')
+    parser.add_argument('--heights', dest='heights', metavar='height',
+                        type=int, nargs='+', default=DEFAULT_HEIGHTS,
+                        help='maximum heights of the boards')
+    parser.add_argument('--terrains', dest='terrains', metavar='terrain',
+                        nargs='+', choices=list(TERRAIN_TYPES),
+                        default=list(TERRAIN_TYPES), help='terrain types: ' +
+                        ', '.join(TERRAIN_TYPES))
+    parser.add_argument('--modes', dest='modes', metavar='mode', nargs='+',
+                        choices=list(BENCHMARK_MODES),
+                        default=list(BENCHMARK_MODES), help='flood modes: ' +
+                        ', '.join(BENCHMARK_MODES))
+    parser.add_argument('--repeat', dest='repeat', type=int,
+                        default=DEFAULT_REPEAT, help='timed runs of each case')
+    parser.add_argument('--seed', dest='seed', type=int, default=DEFAULT_SEED,
+                        help='seed of the generated boards')
+    parser.add_argument('--no-memory', dest='trace_memory',
+                        action='store_false', help='skip measuring the peak \
+                        memory of each case, which is slow on large boards')
+    parser.add_argument('-o', '--output', dest='output', metavar='file',
+                        default=None, help='JSON file receiving the results')
+    parser.add_argument('--baseline', dest='baseline', metavar='file',
+                        default=None, help='JSON file of earlier results to \
+                        compare against')
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        default=DEFAULT_THRESHOLD, help='relative slowdown \
+                        or growth in memory reported as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.heights, args.terrains,
+        args.modes, args.repeat, args.seed, args.trace_memory, log=sys.stderr)
+    report = benchmark_report(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(results,
+                json.load(baseline_file)['results'], args.threshold)
+        for regression in regressions:
+            print(f"Regression in {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,166 @@
+#!/usr/bin/env Python
+
+import json
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+'''
+A content-addressed cache of flood results, for boards which are simulated
+over and over again. Boards are keyed by a hash of their groomed 2D grid, so
+the same board always finds the same result however it was passed in.
+
+Flooding does not change when a board is rotated or mirrored, so the key is
+taken from whichever of the board's 8 rotations and mirror images sorts
+first, and all 8 of them share a single cache entry.
+'''
+
+# Default number of results kept in memory by a FloodCache
+DEFAULT_CACHE_ENTRIES = 1024
+
+
+def board_symmetries(topo_grid):
+    """
+    Produces the 8 rotations and mirror images of a 2D grid.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        A groomed 2d Python array
+
+    Returns
+    -------
+    symmetries : list of tuples of tuples
+        The grid, its 3 rotations, and the mirror images of all 4
+    """
+    rotation = tuple(tuple(row) for row in topo_grid)
+    symmetries = []
+    for quarter_turn in range(4):
+        symmetries.append(rotation)
+        symmetries.append(tuple(row[::-1] for row in rotation))
+        rotation = tuple(zip(*rotation[::-1]))
+    return symmetries
+
+def board_key(topo_grid):
+    """
+    Computes the cache key of a groomed 2D grid, which is shared by all of
+    its rotations and mirror images.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        A groomed 2d Python array
+
+    Returns
+    -------
+    key : str
+        Hex digest of the grid's canonical form
+    """
+    canonical = min(repr(symmetry) for symmetry in board_symmetries(topo_grid))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class FloodCache:
+    """
+    FloodCache stores the (total_flooding, max_water_level) results of boards
+    in two tiers: an in-process LRU tier holding a limited number of results,
+    and an optional SQLite file which survives restarts and is shared by
+    every process using the same path. Results found on disk are promoted to
+    the memory tier.
+
+    ...
+    Parameters
+    ----------
+    max_entries : int, optional, defaults to DEFAULT_CACHE_ENTRIES
+        Number of results kept in the memory tier
+    path : str, optional
+        Path of the SQLite file of the disk tier, or None for memory only
+
+    Attributes
+    ----------
+    hits : int
+        number of lookups answered from either tier
+    memory_hits : int
+        number of lookups answered from the memory tier
+    disk_hits : int
+        number of lookups answered from the disk tier
+    misses : int
+        number of lookups answered by neither tier
+
+    Methods
+    -------
+    get(topo_grid)
+        Cached result of a groomed grid, or None
+    put(topo_grid, result)
+        Stores the result of a groomed grid in both tiers
+    counters()
+        The hit and miss counters as a dict
+    close()
+        Closes the disk tier
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, path=None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = self.memory_hits = self.disk_hits = self.misses = 0
+        self.database = None
+        if path is not None:
+            self.database = sqlite3.connect(path)
+            self.database.execute('CREATE TABLE IF NOT EXISTS results ' +
+                '(key TEXT PRIMARY KEY, result TEXT NOT NULL)')
+            self.database.commit()
+
+    def get(self, topo_grid):
+        key = board_key(topo_grid)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.memory_hits += 1
+            return self.entries[key]
+
+        if self.database is not None:
+            row = self.database.execute(
+                'SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                result = tuple(json.loads(row[0]))
+                self.remember(key, result)
+                self.hits += 1
+                self.disk_hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def put(self, topo_grid, result):
+        key = board_key(topo_grid)
+        result = tuple(result)
+        self.remember(key, result)
+        if self.database is not None:
+            self.database.execute('INSERT OR REPLACE INTO results ' +
+                'VALUES (?, ?)', (key, json.dumps(result)))
+            self.database.commit()
+
+    def remember(self, key, result):
+        # Keep the memory tier to max_entries, dropping the least recent
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def counters(self):
+        return {'hits': self.hits, 'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits, 'misses': self.misses,
+            'entries': len(self.entries)}
+
+    def close(self):
+        if self.database is not None:
+            self.database.close()
+            self.database = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
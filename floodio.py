@@ -0,0 +1,725 @@
+#!/usr/bin/env Python
+
+import os
+import sys
+import ast
+import mmap
+import struct
+import zipfile
+from array import array
+
+# NumPy is optional, and only used to hand rasters to load_raster()'s callers
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+'''
+Reading and writing of height rasters stored on disk, for boards which are
+too large to be passed around as Python lists of lists. Binary rasters are
+memory mapped, so only the rows that are actually requested are ever read
+into memory, and only the Python standard libraries are required.
+
+The formats understood are .npy files, raw binary files described by an ESRI
+.hdr file next to them (as for .bil files), headerless raw files of a known
+shape and element type, ESRI ASCII grids (.asc) and binary 8 or 16-bit PGM
+images (.pgm). open_heights() picks the reader from the file's name. Several
+rasters may also be written together to a compressed .npz file, and
+load_raster() reads any of these formats back as a NumPy array.
+'''
+
+# Binary element types, as NumPy dtype strings, and their struct formats
+RASTER_DTYPES = {
+    'i1': 'b', 'u1': 'B', 'i2': 'h', 'u2': 'H', 'i4': 'i', 'u4': 'I',
+    'i8': 'q', 'u8': 'Q', 'f4': 'f', 'f8': 'd',
+}
+NPY_MAGIC = b'\x93NUMPY'
+PGM_MAGIC = b'P5'
+# Element types of the PIXELTYPE and NBITS of an ESRI .hdr file
+HDR_DTYPES = {
+    ('SIGNEDINT', 8): 'i1', ('SIGNEDINT', 16): 'i2', ('SIGNEDINT', 32): 'i4',
+    ('UNSIGNEDINT', 8): 'u1', ('UNSIGNEDINT', 16): 'u2', 
+    ('UNSIGNEDINT', 32): 'u4', ('FLOAT', 32): 'f4', ('FLOAT', 64): 'f8',
+}
+# Byte order of the machine, as a struct prefix
+NATIVE_BYTEORDER = '<' if sys.byteorder == 'little' else '>'
+
+
+class HeightRaster:
+    """
+    HeightRaster gives read access to a 2D grid of heights stored on disk as
+    a row-major binary array, such as a .npy file or a headerless raw file.
+    The file is memory mapped and rows are decoded on demand, so opening even
+    a 20k x 20k raster costs no memory until its rows are read.
+
+    ...
+    Parameters
+    ----------
+    path : str
+        Path of the raster file
+    length : int
+        Number of squares in each row (x axis)
+    width : int
+        Number of rows (y axis)
+    dtype : str, optional, default '<i2'
+        NumPy style element type, such as '<i2', '<f4' or '>u2'
+    offset : int, optional, default 0
+        Number of header bytes before the first row
+    nodata : int or float, optional
+        Height marking squares without data, as declared by the file
+
+    Attributes
+    ----------
+    length : int
+        the number of squares in each row
+    width : int
+        the number of rows
+    dtype : str
+        the element type of the raster
+    nodata : int or float or None
+        the height marking squares without data
+    floating : bool
+        True if the heights are floats
+
+    Methods
+    -------
+    row(y, start=0, stop=None)
+        Heights of the squares start to stop-1 of row y
+    window(x0, y0, x1, y1)
+        Flat list of the heights of a rectangle of the raster
+    flat()
+        Every height of the raster as one flat sequence indexed by y*length+x
+    rows()
+        Every row of the raster as a 2D array
+    close()
+        Releases the memory map
+    """
+
+    def __init__(self, path, length, width, dtype='<i2', offset=0, 
+        nodata=None):
+        byteorder, kind = parse_dtype(dtype)
+        self.path = path
+        self.length = length
+        self.width = width
+        self.dtype = dtype
+        self.offset = offset
+        self.itemsize = struct.calcsize(kind)
+        self.kind = kind
+        self.byteorder = byteorder
+        self.nodata = nodata
+        self.floating = kind in ('f', 'd')
+        self.views = []
+
+        expected = offset + length*width*self.itemsize
+        with open(path, 'rb') as raster_file:
+            if os.fstat(raster_file.fileno()).st_size < expected:
+                raise ValueError(f"Raster file '{path}' is smaller than " +
+                    f"{length}x{width} elements of type {dtype}")
+            self.map = mmap.mmap(raster_file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+    def row(self, y, start=0, stop=None):
+        if stop is None:
+            stop = self.length
+        position = self.offset + (y*self.length+start)*self.itemsize
+        return list(struct.unpack_from(
+            f'{self.byteorder}{stop-start}{self.kind}', self.map, position))
+
+    def window(self, x0, y0, x1, y1):
+        heights = []
+        for y in range(y0, y1):
+            heights.extend(self.row(y, x0, x1))
+        return heights
+
+    def flat(self):
+        stop = self.offset + self.length*self.width*self.itemsize
+        # Rasters in the machine's byte order are viewed in place, without
+        # copying or converting a single height until it is read
+        if self.itemsize == 1 or self.byteorder in ('=', NATIVE_BYTEORDER):
+            view = memoryview(self.map)[self.offset:stop].cast(self.kind)
+            self.views.append(view)
+            return view
+        heights = array(self.kind)
+        heights.frombytes(self.map[self.offset:stop])
+        heights.byteswap()
+        return heights
+
+    def rows(self):
+        return [self.row(y) for y in range(self.width)]
+
+    def close(self):
+        # Views of the map must be released before the map can be closed
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MemoryRaster:
+    """
+    MemoryRaster offers the interface of HeightRaster over heights which are
+    already held in memory as one flat array, such as those parsed from an
+    ESRI ASCII grid.
+
+    ...
+    Parameters
+    ----------
+    heights : array or list
+        Flat sequence of the heights, indexed by y*length+x
+    length : int
+        Number of squares in each row (x axis)
+    width : int
+        Number of rows (y axis)
+    nodata : int or float, optional
+        Height marking squares without data, as declared by the file
+
+    Attributes
+    ----------
+    length : int
+        the number of squares in each row
+    width : int
+        the number of rows
+    nodata : int or float or None
+        the height marking squares without data
+    floating : bool
+        True if the heights are floats
+
+    Methods
+    -------
+    row(y, start=0, stop=None)
+        Heights of the squares start to stop-1 of row y
+    window(x0, y0, x1, y1)
+        Flat list of the heights of a rectangle of the raster
+    flat()
+        The flat sequence of heights itself
+    rows()
+        Every row of the raster as a 2D array
+    close()
+        Does nothing, for symmetry with HeightRaster
+    """
+
+    def __init__(self, heights, length, width, nodata=None):
+        if len(heights) != length*width:
+            raise ValueError(f"{len(heights)} heights do not make a " +
+                f"{length}x{width} raster")
+        self.heights = heights
+        self.length = length
+        self.width = width
+        self.nodata = nodata
+        self.floating = getattr(heights, 'typecode', None) in ('f', 'd') or \
+            any(isinstance(height, float) for height in heights)
+
+    def row(self, y, start=0, stop=None):
+        if stop is None:
+            stop = self.length
+        return list(self.heights[y*self.length+start:y*self.length+stop])
+
+    def window(self, x0, y0, x1, y1):
+        heights = []
+        for y in range(y0, y1):
+            heights.extend(self.row(y, x0, x1))
+        return heights
+
+    def flat(self):
+        return self.heights
+
+    def rows(self):
+        return [self.row(y) for y in range(self.width)]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Raster classes, which the flood engines accept in place of a 2D grid
+RASTER_TYPES = (HeightRaster, MemoryRaster)
+
+def parse_dtype(dtype):
+    """
+    Splits a NumPy style dtype string such as '<i2' into the byte order and
+    element format understood by the struct module.
+
+    Parameters
+    ----------
+    dtype : str
+        NumPy style element type, with an optional '<', '>', '|' or '='
+        byte order prefix
+
+    Returns
+    -------
+    (byteorder, kind) : tuple (str, str)
+        struct byte order prefix and element format
+    """
+    byteorder = '<'
+    if dtype[:1] in ('<', '>', '|', '='):
+        byteorder = {'>': '>', '=': '='}.get(dtype[0], '<')
+        dtype = dtype[1:]
+    if dtype not in RASTER_DTYPES:
+        raise ValueError(f"Unsupported raster element type '{dtype}', " +
+            "expected one of " + ", ".join(RASTER_DTYPES))
+    return byteorder, RASTER_DTYPES[dtype]
+
+def read_npy_header(path):
+    """
+    Reads the header of a .npy file without loading its data.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .npy file
+
+    Returns
+    -------
+    (dtype, shape, offset) : tuple (str, tuple, int)
+        Element type, array shape and position of the first element
+    """
+    with open(path, 'rb') as npy_file:
+        return parse_npy_header(npy_file, path)
+
+def parse_npy_header(npy_file, name):
+    """
+    Reads the header at the start of a .npy stream, such as a .npy file or a
+    member of a .npz file, leaving the stream at the first element.
+
+    Parameters
+    ----------
+    npy_file : binary file object
+        Stream positioned at the start of the .npy data
+    name : str
+        Name of the stream in error messages
+
+    Returns
+    -------
+    (dtype, shape, offset) : tuple (str, tuple, int)
+        Element type, array shape and position of the first element
+    """
+    if npy_file.read(6) != NPY_MAGIC:
+        raise ValueError(f"'{name}' is not a .npy file")
+    major = npy_file.read(2)[0]
+    if major == 1:
+        header_length, = struct.unpack('<H', npy_file.read(2))
+    else:
+        header_length, = struct.unpack('<I', npy_file.read(4))
+    header = ast.literal_eval(npy_file.read(header_length).decode('latin1'))
+    if header['fortran_order']:
+        raise ValueError(f"'{name}' is stored in Fortran order")
+    return header['descr'], tuple(header['shape']), \
+        (10 if major == 1 else 12) + header_length
+
+def npy_header(length, width, dtype):
+    """
+    Builds the header of a 2D .npy array, padded so that the data starts on
+    a 64 byte boundary.
+
+    Parameters
+    ----------
+    length : int
+        Number of squares in each row
+    width : int
+        Number of rows
+    dtype : str
+        NumPy style element type
+
+    Returns
+    -------
+    header : bytes
+    """
+    header = repr({'descr': dtype, 'fortran_order': False,
+        'shape': (width, length)}).encode('latin1')
+    padding = 63 - (len(NPY_MAGIC) + 4 + len(header)) % 64
+    header += b' '*padding + b'\n'
+    return NPY_MAGIC + b'\x01\x00' + struct.pack('<H', len(header)) + header
+
+def open_npy(path):
+    """
+    Memory maps a 2D .npy file of heights.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .npy file
+
+    Returns
+    -------
+    raster : HeightRaster
+    """
+    dtype, shape, offset = read_npy_header(path)
+    if len(shape) != 2:
+        raise ValueError(f"'{path}' holds a {len(shape)}D array, expected 2D")
+    width, length = shape
+    return HeightRaster(path, length, width, dtype, offset)
+
+def open_raw(path, length, width, dtype='<i2', offset=0):
+    """
+    Memory maps a headerless raw file of heights stored row by row.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raw file
+    length : int
+        Number of squares in each row
+    width : int
+        Number of rows
+    dtype : str, optional, default '<i2'
+        NumPy style element type
+    offset : int, optional, default 0
+        Number of bytes to skip before the first row
+
+    Returns
+    -------
+    raster : HeightRaster
+    """
+    return HeightRaster(path, length, width, dtype, offset)
+
+def read_hdr(path):
+    """
+    Reads the ESRI .hdr file describing a raw binary raster, such as a .bil
+    file, which holds one "KEY value" pair per line.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .hdr file
+
+    Returns
+    -------
+    (dtype, length, width, offset, nodata) : tuple (str, int, int, int, 
+        int or float or None)
+        Element type, shape, position of the first element and NODATA value
+    """
+    header = {}
+    with open(path) as hdr_file:
+        for line in hdr_file:
+            fields = line.split()
+            if len(fields) >= 2:
+                header[fields[0].upper()] = fields[1]
+    if int(header.get('NBANDS', 1)) != 1:
+        raise ValueError(f"'{path}' describes more than one band")
+    pixel_type = header.get('PIXELTYPE', 'UNSIGNEDINT').upper()
+    bits = int(header.get('NBITS', 8))
+    if (pixel_type, bits) not in HDR_DTYPES:
+        raise ValueError(f"Unsupported PIXELTYPE {pixel_type} of {bits} " +
+            f"bits in '{path}'")
+    byteorder = '<'
+    if header.get('BYTEORDER', 'I').upper() in ('M', 'MSBFIRST'):
+        byteorder = '>'
+    nodata = header.get('NODATA')
+    if nodata is not None:
+        nodata = float(nodata) if pixel_type == 'FLOAT' else int(nodata)
+    return (byteorder + HDR_DTYPES[pixel_type, bits], int(header['NCOLS']),
+        int(header['NROWS']), int(header.get('SKIPBYTES', 0)), nodata)
+
+def hdr_path(path):
+    """
+    Path of the ESRI .hdr file which may describe a raw raster.
+    """
+    return os.path.splitext(path)[0] + '.hdr'
+
+def open_bil(path):
+    """
+    Memory maps a raw binary raster described by the ESRI .hdr file of the
+    same name, such as a .bil file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raw file, next to its .hdr file
+
+    Returns
+    -------
+    raster : HeightRaster
+    """
+    dtype, length, width, offset, nodata = read_hdr(hdr_path(path))
+    return HeightRaster(path, length, width, dtype, offset, nodata)
+
+def read_pgm_header(path):
+    """
+    Reads the header of a binary PGM image without loading its pixels.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .pgm file
+
+    Returns
+    -------
+    (dtype, length, width, offset) : tuple (str, int, int, int)
+        Element type ('u1' up to a maximum value of 255, '>u2' beyond), 
+        shape and position of the first pixel
+    """
+    with open(path, 'rb') as pgm_file:
+        header = pgm_file.read(1024)
+    if header[:2] != PGM_MAGIC:
+        raise ValueError(f"'{path}' is not a binary (P5) PGM file")
+    # Width, height and maximum value follow the magic number, separated by
+    # whitespace and comments, and a single whitespace byte ends the header
+    fields, position = [], 2
+    while len(fields) < 3:
+        while header[position:position+1].isspace():
+            position += 1
+        if header[position:position+1] == b'#':
+            position = header.index(b'\n', position)
+            continue
+        start = position
+        while header[position:position+1].isdigit():
+            position += 1
+        if start == position:
+            raise ValueError(f"Malformed PGM header in '{path}'")
+        fields.append(int(header[start:position]))
+    length, width, max_value = fields
+    return ('u1' if max_value < 256 else '>u2'), length, width, position+1
+
+def open_pgm(path):
+    """
+    Memory maps a binary 8 or 16-bit PGM image as a raster of heights.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .pgm file
+
+    Returns
+    -------
+    raster : HeightRaster
+    """
+    dtype, length, width, offset = read_pgm_header(path)
+    return HeightRaster(path, length, width, dtype, offset)
+
+def read_esri_ascii(path):
+    """
+    Reads an ESRI ASCII grid. Its header gives the number of columns and
+    rows and an optional NODATA_value, and the heights follow as text. The
+    heights are parsed in one pass into a flat array of integers, or of
+    floats if any height is not an integer.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .asc file
+
+    Returns
+    -------
+    raster : MemoryRaster
+    """
+    with open(path) as asc_file:
+        tokens = asc_file.read().split()
+    header, position = {}, 0
+    while position < len(tokens) and tokens[position][:1].isalpha():
+        header[tokens[position].lower()] = tokens[position+1]
+        position += 2
+    length, width = int(header['ncols']), int(header['nrows'])
+    values = tokens[position:]
+    try:
+        heights = array('q', map(int, values))
+        nodata = header.get('nodata_value')
+        nodata = None if nodata is None else int(float(nodata))
+    except ValueError:
+        heights = array('d', map(float, values))
+        nodata = header.get('nodata_value')
+        nodata = None if nodata is None else float(nodata)
+    if len(heights) != length*width:
+        raise ValueError(f"'{path}' holds {len(heights)} heights, expected " +
+            f"{length}x{width}")
+    return MemoryRaster(heights, length, width, nodata)
+
+def open_heights(path, length=None, width=None, dtype='<i2'):
+    """
+    Opens a raster of heights in any of the supported formats, chosen by the
+    name of the file: .npy, .asc and .pgm files by their extension, raw
+    files with an ESRI .hdr file next to them, and otherwise headerless raw
+    files of the given shape and element type.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raster file
+    length : int, optional
+        Number of squares in each row of a headerless raw file
+    width : int, optional
+        Number of rows of a headerless raw file
+    dtype : str, optional, default '<i2'
+        NumPy style element type of a headerless raw file
+
+    Returns
+    -------
+    raster : HeightRaster or MemoryRaster
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return open_npy(path)
+    if extension == '.asc':
+        return read_esri_ascii(path)
+    if extension == '.pgm':
+        return open_pgm(path)
+    if os.path.exists(hdr_path(path)):
+        return open_bil(path)
+    if length is None or width is None:
+        raise ValueError(f"The shape of the raw file '{path}' is unknown, " +
+            "give its length and width")
+    return open_raw(path, length, width, dtype)
+
+def write_raster(path, rows, length, width, dtype='<i2', nodata=None,
+    raster_format=None):
+    """
+    Writes rows of heights to a raster file one row at a time, so that rows
+    produced by a generator are streamed to disk without ever holding the
+    whole raster in memory. The format is chosen by the file's extension:
+    .npy, .asc (ESRI ASCII grid), .pgm (binary PGM, with dtype 'u1' for 8
+    bits or otherwise 16 bits), .bil (raw, with an ESRI .hdr file next to
+    it), and raw binary for any other extension.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raster file to create
+    rows : iterable of lists
+        Rows of heights, each of length squares
+    length : int
+        Number of squares in each row
+    width : int
+        Number of rows
+    dtype : str, optional, default '<i2'
+        NumPy style element type of binary formats
+    nodata : int or float, optional
+        Height marking squares without data, recorded by the .asc and .hdr
+        formats
+    raster_format : str, optional
+        One of 'npy', 'asc', 'pgm', 'bil' or 'raw', overriding the extension
+    """
+    if raster_format is None:
+        raster_format = os.path.splitext(path)[1].lower().lstrip('.')
+    if raster_format == 'pgm':
+        dtype = 'u1' if dtype.lstrip('<>|=') == 'u1' else '>u2'
+    byteorder, kind = parse_dtype(dtype)
+    pack = struct.Struct(f'{byteorder}{length}{kind}').pack
+
+    if raster_format == 'asc':
+        with open(path, 'w') as asc_file:
+            asc_file.write(f'ncols {length}\nnrows {width}\n' +
+                'xllcorner 0\nyllcorner 0\ncellsize 1\n' +
+                ('' if nodata is None else f'NODATA_value {nodata}\n'))
+            for row in rows:
+                asc_file.write(' '.join(map(str, row)) + '\n')
+        return
+
+    with open(path, 'wb') as raster_file:
+        if raster_format == 'npy':
+            raster_file.write(npy_header(length, width, dtype))
+        elif raster_format == 'pgm':
+            raster_file.write(b'P5\n%d %d\n%d\n' % (length, width, 
+                255 if kind == 'B' else 65535))
+        for row in rows:
+            raster_file.write(pack(*row))
+
+    if raster_format == 'bil':
+        pixel_type, bits = next(key for key, value in HDR_DTYPES.items() 
+            if RASTER_DTYPES[value] == kind)
+        with open(hdr_path(path), 'w') as hdr_file:
+            hdr_file.write(f'BYTEORDER {"M" if byteorder == ">" else "I"}\n' +
+                f'LAYOUT BIL\nNROWS {width}\nNCOLS {length}\nNBANDS 1\n' +
+                f'NBITS {bits}\nPIXELTYPE {pixel_type}\n' +
+                ('' if nodata is None else f'NODATA {nodata}\n'))
+
+def write_npy(path, topo_grid, dtype='<i2'):
+    """
+    Writes a 2D grid of heights to a .npy file one row at a time.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .npy file to create
+    topo_grid : 2D arr/list of lists
+        Rows of heights, all of the same length
+    dtype : str, optional, default '<i2'
+        NumPy style element type of the file
+    """
+    write_raster(path, topo_grid, len(topo_grid[0]), len(topo_grid), dtype,
+        raster_format='npy')
+
+def write_npz(path, rasters, length, width, dtype='<f4'):
+    """
+    Writes several rasters of the same shape to a compressed .npz file, as
+    written by numpy.savez_compressed(). The rows of each raster are streamed
+    into its own deflated .npy member one row at a time, so that no raster is
+    ever held in memory as a whole.
+
+    Parameters
+    ----------
+    path : str
+        Path of the .npz file to create
+    rasters : dict
+        Rows of each raster, as an iterable of lists, by the name of its
+        array in the .npz file
+    length : int
+        Number of squares in each row
+    width : int
+        Number of rows
+    dtype : str, optional, default '<f4'
+        NumPy style element type of every raster
+    """
+    byteorder, kind = parse_dtype(dtype)
+    pack = struct.Struct(f'{byteorder}{length}{kind}').pack
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as npz_file:
+        for name, rows in rasters.items():
+            with npz_file.open(name + '.npy', 'w', force_zip64=True) as member:
+                member.write(npy_header(length, width, dtype))
+                for row in rows:
+                    member.write(pack(*row))
+
+def load_raster(path, length=None, width=None, dtype='<i2', name=None):
+    """
+    Reads a whole raster, in any format of open_heights() or from a .npz
+    file, as a 2D NumPy array for tools downstream of the simulation. As
+    NumPy is not required by this module, the raster is read as a list of
+    rows instead when NumPy is not installed.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raster file
+    length : int, optional
+        Number of squares in each row of a headerless raw file
+    width : int, optional
+        Number of rows of a headerless raw file
+    dtype : str, optional, default '<i2'
+        NumPy style element type of a headerless raw file
+    name : str, optional
+        Array of a .npz file, by default its first one
+
+    Returns
+    -------
+    raster : numpy.ndarray, or list of lists
+    """
+    if os.path.splitext(path)[1].lower() == '.npz':
+        with zipfile.ZipFile(path) as npz_file:
+            member = name + '.npy' if name else npz_file.namelist()[0]
+            with npz_file.open(member) as npy_file:
+                dtype, shape, offset = parse_npy_header(npy_file, member)
+                data = npy_file.read()
+        if numpy is not None:
+            # A buffer of bytes would give a read-only array
+            return numpy.frombuffer(bytearray(data), dtype).reshape(shape)
+        width, length = shape
+        byteorder, kind = parse_dtype(dtype)
+        unpack = struct.Struct(f'{byteorder}{length}{kind}').unpack_from
+        return [list(unpack(data, y*len(data)//width)) for y in range(width)]
+
+    with open_heights(path, length, width, dtype) as raster:
+        if numpy is None:
+            return raster.rows()
+        if isinstance(raster, HeightRaster):
+            return numpy.fromfile(path, raster.dtype,
+                raster.length*raster.width, offset=raster.offset
+                ).reshape(raster.width, raster.length)
+        return numpy.array(raster.heights).reshape(raster.width,
+            raster.length)
@@ -0,0 +1,475 @@
+#!/usr/bin/env Python
+
+import os
+import json
+import stat
+import socket
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+'''
+A long-running flood server, which saves every request the interpreter
+startup, argument parsing and imports of a run of topographyfloodsim.py.
+Boards are sent as JSON lines over a local TCP or Unix socket, in the format
+of the --batch argument, and each is answered with a JSON line of its
+flood_statistics() in the order the boards were sent.
+
+The boards of all connections are flooded by a pool of worker processes
+which are started, and warmed up, once when the server starts. Requests
+which arrive while every worker is busy wait in a queue and are handed to
+the next free worker together, so a burst of small boards costs a few
+round trips to the pool rather than one per board. A worker which dies
+only fails the boards in flight, and a fresh pool takes over the rest. When the queue is full
+the server stops reading from its connections, which pushes back on the
+clients through their sockets instead of letting the queue grow without
+bound.
+
+FloodClient and remote_simulation() talk to the server from Python:
+
+python floodserver.py --address /tmp/flood.sock --workers 4
+
+>>> remote_simulation([[2,2,2],[2,0,2],[2,2,2]], '/tmp/flood.sock')
+FloodResult(total_flooding=2, max_water_level=2)
+'''
+
+from topographyfloodsim import FloodResult, simulate_board_chunk
+
+# Address of the server, as host:port for TCP or a path for a Unix socket
+DEFAULT_SERVE_ADDRESS = 'localhost:8470'
+# Largest number of boards and of squares flooded by a worker at a time
+DEFAULT_SERVE_BATCH = 256
+DEFAULT_SERVE_BATCH_SQUARES = 10**6
+# Boards waiting for a worker before the server stops reading requests
+DEFAULT_MAX_PENDING = 4096
+# Longest request line the server accepts, in bytes
+DEFAULT_MAX_REQUEST_BYTES = 64*2**20
+# Requests a FloodClient sends ahead of the replies it has read
+DEFAULT_CLIENT_WINDOW = 64
+
+
+def parse_address(address):
+    """
+    Splits a server address into the host and port of a TCP socket, or
+    returns it unchanged as the path of a Unix socket.
+
+    Parameters
+    ----------
+    address : str
+        host:port, or the path of a Unix socket
+
+    Returns
+    -------
+    address : tuple (str, int) or str
+    """
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and '/' not in address:
+        return host or 'localhost', int(port)
+    return address
+
+def board_squares(board):
+    """
+    Validates the shape of a board received by the server, and counts its
+    squares for batching.
+
+    Parameters
+    ----------
+    board : 2D list of lists
+        A board decoded from JSON
+
+    Returns
+    -------
+    squares : int
+    """
+    if not isinstance(board, list) or not board or \
+        not all(isinstance(row, list) and row for row in board):
+        raise ValueError('A board must be a non-empty 2D array of heights')
+    return len(board)*len(board[0])
+
+class FloodServer:
+    """
+    FloodServer serves the flood statistics of boards to any number of
+    connections, see the description of this module.
+
+    ...
+    Parameters
+    ----------
+    address : str, optional, defaults to DEFAULT_SERVE_ADDRESS
+        host:port to listen on over TCP, or the path of a Unix socket
+    workers : int, optional, defaults to the number of CPUs
+        Number of worker processes
+    batch_size : int, optional, defaults to DEFAULT_SERVE_BATCH
+        Largest number of boards handed to a worker at a time
+    batch_squares : int, optional, defaults to DEFAULT_SERVE_BATCH_SQUARES
+        Largest number of squares handed to a worker at a time, unless a
+        single board is larger
+    max_pending : int, optional, defaults to DEFAULT_MAX_PENDING
+        Number of boards queued for the workers before the server stops
+        reading requests
+
+    Attributes
+    ----------
+    requests : int
+        number of boards received
+    batches : int
+        number of batches of boards handed to the workers
+
+    Methods
+    -------
+    start()
+        Starts the workers and listens on the address (coroutine)
+    serve_forever()
+        Serves until cancelled (coroutine)
+    close()
+        Stops listening and shuts the workers down (coroutine)
+    """
+
+    def __init__(self, address=DEFAULT_SERVE_ADDRESS, workers=None,
+        batch_size=DEFAULT_SERVE_BATCH, batch_squares=DEFAULT_SERVE_BATCH_SQUARES,
+        max_pending=DEFAULT_MAX_PENDING):
+        self.address = parse_address(address)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_squares = batch_squares
+        self.max_pending = max_pending
+        self.requests = self.batches = 0
+        self.pool = self.server = self.dispatcher = None
+        # Chunks of boards handed to the pool and not yet done
+        self.pending = set()
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.max_pending)
+        self.held = None
+        self.idle_workers = asyncio.Semaphore(self.workers)
+        self.pool = ProcessPoolExecutor(self.workers)
+        await self.warm_up()
+        self.dispatcher = asyncio.create_task(self.dispatch())
+
+        if isinstance(self.address, tuple):
+            host, port = self.address
+            self.server = await asyncio.start_server(self.handle, host, port,
+                limit=DEFAULT_MAX_REQUEST_BYTES)
+        else:
+            # A socket file left behind by an earlier server is replaced
+            if os.path.exists(self.address) and \
+                stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)
+            self.server = await asyncio.start_unix_server(self.handle,
+                self.address, limit=DEFAULT_MAX_REQUEST_BYTES)
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+        if self.pool is not None:
+            # Chunks still waiting for a worker are cancelled by hand, as
+            # shutdown(cancel_futures=True) needs Python 3.9
+            for future in list(self.pending):
+                future.cancel()
+            self.pool.shutdown()
+            self.pool = None
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    async def dispatch(self):
+        # Hand the queued boards to each worker as it becomes free, so that
+        # a lone request is flooded at once and a burst shares one batch
+        while True:
+            await self.idle_workers.acquire()
+            batch = [self.held or await self.queue.get()]
+            self.held = None
+            squares = batch[0][1]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                request = self.queue.get_nowait()
+                if squares + request[1] > self.batch_squares:
+                    # Too large for this batch, so it starts the next one
+                    self.held = request
+                    break
+                batch.append(request)
+                squares += request[1]
+            self.batches += 1
+            asyncio.create_task(self.flood_batch(batch))
+
+    async def warm_up(self):
+        # Warm every worker up before the first request, which forks the
+        # processes and imports the flood engines in each of them
+        await asyncio.gather(*(self.run_chunk([[[0]]]) 
+            for worker in range(self.workers)))
+
+    def run_chunk(self, boards):
+        # Floods a chunk of boards in the pool, keeping its future pending
+        # until it is done so that close() may cancel it
+        future = self.pool.submit(simulate_board_chunk, boards)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return asyncio.wrap_future(future)
+
+    async def flood_chunk(self, boards):
+        # A worker which dies, of a board too large for its memory say,
+        # breaks the pool for good. The first chunk to find it broken starts
+        # a fresh pool in its place, and only the chunks in flight fail
+        pool = self.pool
+        try:
+            return await self.run_chunk(boards)
+        except BrokenProcessPool:
+            if self.pool is pool:
+                self.pool = ProcessPoolExecutor(self.workers)
+                pool.shutdown(wait=False)
+                await self.warm_up()
+            raise
+
+    async def flood_batch(self, batch):
+        try:
+            boards = [board for board, squares, future in batch]
+            try:
+                results = await self.flood_chunk(boards)
+            except BrokenProcessPool:
+                raise
+            except Exception:
+                if len(batch) == 1:
+                    raise
+                # Find the boards which failed by flooding them one by one
+                results = []
+                for board in boards:
+                    try:
+                        results.extend(await self.flood_chunk([board]))
+                    except Exception as error:
+                        results.append(error)
+        except Exception as error:
+            results = [error]*len(batch)
+        finally:
+            self.idle_workers.release()
+
+        for (board, squares, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def submit(self, line):
+        # Returns the id of a request line and the future of its result
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = None
+        try:
+            board = json.loads(line)
+            if isinstance(board, dict):
+                request_id = board.get('id')
+                board = board.get('grid')
+            squares = board_squares(board)
+        except ValueError as error:
+            future.set_exception(error)
+            return request_id, future
+        self.requests += 1
+        await self.queue.put((board, squares, future))
+        return request_id, future
+
+    async def handle(self, reader, writer):
+        # Replies are written in the order of their requests, and at most
+        # max_pending of them wait on each connection
+        replies = asyncio.Queue(self.max_pending)
+        replier = asyncio.create_task(self.reply(replies, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    future = asyncio.get_running_loop().create_future()
+                    future.set_exception(ValueError('Request longer than ' +
+                        f'{DEFAULT_MAX_REQUEST_BYTES} bytes'))
+                    await replies.put((None, future))
+                    break
+                except ConnectionError:
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await replies.put(await self.submit(line))
+        finally:
+            await replies.put(None)
+            await replier
+            writer.close()
+
+    async def reply(self, replies, writer):
+        connected = True
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                return
+            request_id, future = reply
+            try:
+                total_flooding, max_water_level = await future
+                message = {'total_flooding': total_flooding,
+                    'max_water_level': max_water_level}
+            except Exception as error:
+                message = {'error': f'{type(error).__name__}: {error}'}
+            if request_id is not None:
+                message = {'id': request_id, **message}
+            if not connected:
+                continue
+            try:
+                writer.write(json.dumps(message).encode() + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                # Keep consuming the replies of a client which went away
+                connected = False
+
+def run_server(address=DEFAULT_SERVE_ADDRESS, workers=None, **options):
+    """
+    Runs a FloodServer until interrupted, as used by --serve.
+
+    Parameters
+    ----------
+    address : str, optional, defaults to DEFAULT_SERVE_ADDRESS
+        host:port to listen on over TCP, or the path of a Unix socket
+    workers : int, optional, defaults to the number of CPUs
+        Number of worker processes
+    **options
+        Further arguments of FloodServer
+    """
+    async def serve():
+        server = FloodServer(address, workers, **options)
+        await server.start()
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+class FloodClient:
+    """
+    FloodClient keeps a connection to a FloodServer open and floods boards
+    through it.
+
+    ...
+    Parameters
+    ----------
+    address : str, optional, defaults to DEFAULT_SERVE_ADDRESS
+        Address of the server, as host:port or the path of a Unix socket
+    timeout : float, optional
+        Seconds to wait for the server before giving up, or None to wait
+        as long as it takes
+
+    Methods
+    -------
+    simulate(topo_grid)
+        FloodResult of a single board
+    simulate_many(boards, window=DEFAULT_CLIENT_WINDOW)
+        FloodResults of many boards, sent ahead of their replies
+    close()
+        Closes the connection
+    """
+
+    def __init__(self, address=DEFAULT_SERVE_ADDRESS, timeout=None):
+        address = parse_address(address)
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address, timeout)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(address)
+        self.stream = self.socket.makefile('rwb')
+
+    def send(self, topo_grid):
+        self.stream.write(json.dumps(topo_grid).encode() + b'\n')
+
+    def receive(self):
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError('The flood server closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return FloodResult(reply['total_flooding'], reply['max_water_level'])
+
+    def simulate(self, topo_grid):
+        self.send(topo_grid)
+        self.stream.flush()
+        return self.receive()
+
+    def simulate_many(self, boards, window=DEFAULT_CLIENT_WINDOW):
+        results, pending = [], 0
+        for board in boards:
+            self.send(board)
+            pending += 1
+            if pending == window:
+                self.stream.flush()
+                results.append(self.receive())
+                pending -= 1
+        self.stream.flush()
+        results.extend(self.receive() for reply in range(pending))
+        return results
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Clients of remote_simulation(), kept open by address
+CLIENTS = {}
+
+def remote_simulation(topo_grid, address=DEFAULT_SERVE_ADDRESS):
+    """
+    Floods a board on a FloodServer, as a drop-in replacement for
+    full_simulation(topo_grid, output='none'). The connection to each
+    address is opened on first use and kept for later calls.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        A 2d Python array, square or rectangular
+    address : str, optional, defaults to DEFAULT_SERVE_ADDRESS
+        Address of the server, as host:port or the path of a Unix socket
+
+    Returns
+    -------
+    (total_flooding, max_water_level) : FloodResult
+    """
+    client = CLIENTS.get(address)
+    if client is None:
+        client = CLIENTS[address] = FloodClient(address)
+    try:
+        return client.simulate(topo_grid)
+    except OSError:
+        # Reconnect once to a server which was restarted
+        client.close()
+        client = CLIENTS[address] = FloodClient(address)
+        return client.simulate(topo_grid)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the flood \
+                        statistics of boards sent as JSON lines')
+    parser.add_argument('--address', dest='address', metavar='address',
+                        default=DEFAULT_SERVE_ADDRESS, help='host:port to \
+                        listen on, or the path of a Unix socket')
+    parser.add_argument('--workers', dest='workers', type=int, default=None,
+                        help='number of worker processes, by default one \
+                        per CPU')
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        default=DEFAULT_SERVE_BATCH, help='largest number \
+                        of boards handed to a worker at a time')
+    parser.add_argument('--max-pending', dest='max_pending', type=int,
+                        default=DEFAULT_MAX_PENDING, help='boards queued \
+                        before the server stops reading requests')
+    args = parser.parse_args()
+    run_server(args.address, args.workers, batch_size=args.batch_size,
+        max_pending=args.max_pending)
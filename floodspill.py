@@ -0,0 +1,568 @@
+#!/usr/bin/env Python
+
+import math
+import heapq
+import argparse
+from bisect import bisect_right
+from itertools import accumulate
+from array import array
+from collections import namedtuple
+
+import floodio
+
+'''
+Rainfall scenarios over a fixed board. The flood engines fill every
+depression until it spills, as if it rained forever, while a real storm
+leaves some depressions partly filled and sends the overflow of others into
+their neighbours. FillSpillTree precomputes how the depressions of a board
+fill, spill and merge, so that the water stored after any depth of uniform
+rainfall is answered without simulating the storm.
+
+The board is first split into catchments by an immersion flood: the edges
+of the board drain into the OCEAN, every local minimum grows a catchment of
+its own, and the lowest square between two catchments is their saddle. The
+saddles are joined from the lowest up, as in Kruskal's algorithm, into the
+depression hierarchy of Barnes et al. (2020). Two depressions meeting at a
+saddle first fill up to it, the first one full overflowing into the other,
+and then merge into a parent depression filling above the saddle, while a
+depression meeting the ocean, or a depression which already spills, spills
+into it for good. Each depression keeps its spill elevation, the depression
+it overflows into, its capacity and its volume at every level up to its
+spill elevation.
+
+Rain then fills the depressions of this tree at rates given by their
+catchments, and the overflow of every full depression is passed on along
+the tree. The time at which each depression fills is computed once, in a
+single event-driven pass, so the stored volume is a piecewise linear
+function of the rainfall depth, which is looked up with a binary search.
+'''
+
+# Depression of the squares whose rain runs straight off the board
+OCEAN = 0
+# Height of the squares outside the board, as in topographyfloodsim
+NODATA = None
+
+
+class Lake(namedtuple('Lake', ['depression', 'volume', 'level'])):
+    """
+    A body of water standing in a depression of a FillSpillTree after some
+    rainfall: the depression, the volume of water it holds and the level of
+    its surface.
+    """
+
+    __slots__ = ()
+
+def label_catchments(heights, length, width):
+    """
+    Splits a board into catchments with an immersion flood. The edge squares
+    seed the OCEAN catchment and every local minimum seeds a catchment of its
+    own, numbered from 1 up, and squares are claimed from the lowest up by
+    the catchment which reaches them first. Squares outside the board, of
+    height NODATA, belong to the OCEAN without being claimed, and the squares
+    next to them seed it like the edge squares.
+
+    Parameters
+    ----------
+    heights : list or flat buffer
+        Flat heights of every square, indexed by y*length+x
+    length : int
+        Length (x axis) of the 2D grid
+    width : int
+        Width (y axis) of the 2D grid
+
+    Returns
+    -------
+    (labels, catchments, saddles, order) : tuple (list, int, dict, array)
+        Catchment of every square, the number of catchments besides the
+        OCEAN, the lowest saddle of every pair of neighbouring catchments,
+        keyed by the pair in increasing order, and every square of the board
+        from the lowest up
+    """
+    squares = length*width
+    labels = [-1]*squares
+    outside = NODATA in heights
+    # Entries of the heap are (height, square) for a claimed square and
+    # (height, squares+square) for a local minimum, so plateaus are claimed
+    # before they seed
+    heap = []
+    for i in range(squares):
+        y, x = divmod(i, length)
+        height = heights[i]
+        if height is NODATA:
+            labels[i] = OCEAN
+        elif 0 in (x,y) or x == length-1 or y == width-1 or (outside and 
+            NODATA in (heights[i-length], heights[i+1], heights[i+length], 
+            heights[i-1])):
+            labels[i] = OCEAN
+            heap.append((height, i))
+        elif heights[i-length] >= height and heights[i+1] >= height and \
+            heights[i+length] >= height and heights[i-1] >= height:
+            heap.append((height, squares+i))
+    heapq.heapify(heap)
+
+    catchments = 0
+    saddles = {}
+    order = array('i')
+    popped = bytearray(squares)
+    # Squares claimed at the height of the square claiming them skip the heap
+    pit = []
+    while heap or pit:
+        if pit:
+            height, i = pit.pop()
+        else:
+            height, i = heapq.heappop(heap)
+        if i >= squares:
+            i -= squares
+            if labels[i] >= 0:
+                continue
+            catchments += 1
+            labels[i] = catchments
+        label = labels[i]
+        order.append(i)
+        popped[i] = 1
+        y, x = divmod(i, length)
+        for n, inside in ((i-length, y>0), (i+1, x<length-1),
+                          (i+length, y<width-1), (i-1, x>0)):
+            if not inside:
+                continue
+            other = labels[n]
+            if other == label:
+                continue
+            if other < 0:
+                labels[n] = label
+                neighbour = heights[n]
+                if neighbour == height:
+                    pit.append((height, n))
+                else:
+                    heapq.heappush(heap, (neighbour, n))
+            elif popped[n]:
+                # Catchments meet at the higher of two neighbouring squares,
+                # the one popped last, and squares are popped from the
+                # lowest up so the first saddle of two catchments is theirs
+                saddles.setdefault((label, other) if label < other else
+                    (other, label), height)
+    return labels, catchments, saddles, order
+
+class FillSpillTree:
+    """
+    FillSpillTree is the depression hierarchy of a board, see the
+    description of this module, along with the timeline of its filling
+    under uniform rainfall.
+
+    Depressions are numbered from 1 up: the catchments of the local minima
+    come first, and every merged depression follows its two children. Rain
+    is measured as a depth of water falling on every square, or as the
+    total volume falling on the whole board. Squares outside the board, of
+    height NODATA or holding the nodata value of a raster, drain the squares
+    next to them into the OCEAN, receive no rain and keep their height as
+    their water level.
+
+    ...
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists, or floodio raster
+        A 2d Python array of heights, groomed by prepare_grid(), or a raster
+        from floodio.open_heights()
+
+    Attributes
+    ----------
+    labels : list
+        Catchment of every square, indexed by y*length+x
+    parents : list
+        Depression each depression merges into, or None
+    children : list
+        The two depressions each merged depression was made of, or None
+    spill_elevations : list
+        Level at which each depression spills or merges
+    overflows : list
+        Catchment each depression overflows into once full, or OCEAN
+    capacities : list
+        Volume each depression holds up to its spill elevation
+    fill_depths : list
+        Rainfall depth at which each depression is full
+
+    Methods
+    -------
+    stored_volume(rain_depth=None, water_input=None)
+        Total volume of water held by the board after some rainfall
+    depression_volume(depression, rain_depth=None, water_input=None)
+        Volume of water held by a depression after some rainfall
+    lakes(rain_depth=None, water_input=None)
+        Every body of water standing after some rainfall
+    water_level(x, y, rain_depth=None, water_input=None)
+        Water surface of a square after some rainfall
+    """
+
+    def __init__(self, topo_grid):
+        if isinstance(topo_grid, floodio.RASTER_TYPES):
+            self.length, self.width = topo_grid.length, topo_grid.width
+            self.heights = topo_grid.flat()
+            if topo_grid.nodata is not None:
+                self.heights = [NODATA if height == topo_grid.nodata 
+                    else height for height in self.heights]
+        else:
+            self.length, self.width = len(topo_grid[0]), len(topo_grid)
+            self.heights = [height for row in topo_grid for height in row]
+        self.labels, catchments, saddles, order = label_catchments(
+            self.heights, self.length, self.width)
+        # Every square of the board is claimed once
+        self.area = len(order)
+        self.merge_depressions(catchments, saddles)
+        self.lift_depressions()
+        self.measure_depressions(order)
+        self.fill_depressions()
+
+    def merge_depressions(self, catchments, saddles):
+        # Join the saddles from the lowest up. The depressions of a disjoint
+        # set forest are merged while neither spills, and a depression which
+        # meets the ocean or a spilling depression spills into it for good
+        count = catchments+1
+        self.parents, self.children = [None]*count, [None]*count
+        self.spill_elevations, self.overflows = [None]*count, [None]*count
+        top = list(range(count))
+        spills = bytearray(count)
+        spills[OCEAN] = 1
+
+        def find(depression):
+            while top[depression] != depression:
+                top[depression] = top[top[depression]] # Path halving
+                depression = top[depression]
+            return depression
+
+        for saddle, a, b in sorted((saddle, a, b)
+            for (a, b), saddle in saddles.items()):
+            first, second = find(a), find(b)
+            if first == second or (spills[first] and spills[second]):
+                continue
+            if spills[first] or spills[second]:
+                if spills[second]:
+                    first, second, a, b = second, first, b, a
+                # The second depression spills over the saddle into a
+                self.spill_elevations[second] = saddle
+                self.overflows[second] = a
+                spills[second] = 1
+                continue
+            merged = len(top)
+            top.append(merged)
+            spills.append(0)
+            self.parents.append(None)
+            self.children.append((first, second))
+            self.spill_elevations.append(None)
+            self.overflows.append(None)
+            top[first] = top[second] = merged
+            self.parents[first] = self.parents[second] = merged
+            self.spill_elevations[first] = self.spill_elevations[second] = \
+                saddle
+            self.overflows[first], self.overflows[second] = b, a
+
+    def lift_depressions(self):
+        # Binary lifting tables of the hierarchy: self.ancestors[k] holds
+        # the ancestor 2**k levels above each depression, or None. Merged
+        # depressions are numbered after their children, so the ancestors
+        # of a depression are known before it is reached from the top
+        count = len(self.parents)
+        parents = self.parents
+        levels = [0]*count
+        for depression in range(count-1, 0, -1):
+            if parents[depression] is not None:
+                levels[depression] = levels[parents[depression]] + 1
+        self.ancestors = [parents]
+        for k in range(1, max(levels).bit_length()):
+            jumps = self.ancestors[-1]
+            self.ancestors.append([None if jumps[depression] is None else
+                jumps[jumps[depression]] for depression in range(count)])
+
+    def measure_depressions(self, order):
+        # Every square under water when its depression is full belongs to
+        # the lowest depression filled above it. The volume of a depression
+        # at each level is then that of its full children spread over the
+        # area of their lakes, plus the depth over each of its own squares
+        count = len(self.parents)
+        spill_elevations, children = self.spill_elevations, self.children
+        # Spill elevations grow towards the roots, so a depression skipped
+        # by a square is skipped by every higher square, and the squares
+        # taken from the lowest up jump straight past it
+        jumps = list(self.parents)
+        owners, owned = [], []
+        heights, labels = self.heights, self.labels
+        for i in order:
+            depression = labels[i]
+            if depression == OCEAN:
+                continue
+            height = heights[i]
+            if spill_elevations[depression] <= height:
+                skipped = []
+                while depression is not None and \
+                    spill_elevations[depression] <= height:
+                    skipped.append(depression)
+                    depression = jumps[depression]
+                for node in skipped:
+                    jumps[node] = depression
+                if depression is None:
+                    continue
+            owners.append(depression)
+            owned.append(height)
+
+        # The levels of every depression, from the level its children merge
+        # at followed by the heights of its own squares, lie in one flat
+        # list from self.firsts[depression] to self.firsts[depression+1]
+        sizes = [0]*(count+1)
+        for depression in range(1, count):
+            if children[depression] is not None:
+                sizes[depression] = 1
+        for depression in owners:
+            sizes[depression] += 1
+        self.firsts = list(accumulate(sizes, initial=0))[:-1]
+        filled = list(self.firsts)
+        self.levels = levels = [0]*self.firsts[-1]
+        for depression in range(1, count):
+            if children[depression] is not None:
+                levels[filled[depression]] = \
+                    spill_elevations[children[depression][0]]
+                filled[depression] += 1
+        for depression, height in zip(owners, owned):
+            levels[filled[depression]] = height
+            filled[depression] += 1
+
+        # The k-th segment of the volume of a depression starts at levels[k]
+        # and volumes[k], and covers first_areas[depression]+k squares
+        self.volumes = volumes = [0]*len(levels)
+        self.first_areas = [0]*count
+        self.capacities, self.areas = [0]*count, [0]*count
+        capacities, areas = self.capacities, self.areas
+        for depression in range(1, count):
+            first, last = self.firsts[depression], self.firsts[depression+1]
+            if first == last:
+                continue
+            if children[depression] is not None:
+                lower, upper = children[depression]
+                area = areas[lower] + areas[upper]
+                volume = capacities[lower] + capacities[upper]
+            else:
+                area, volume = 1, 0
+            self.first_areas[depression] = area
+            level = levels[first]
+            volumes[first] = volume
+            for k in range(first+1, last):
+                volume += area*(levels[k]-level)
+                level = levels[k]
+                volumes[k] = volume
+                area += 1
+            capacities[depression] = volume + \
+                area*(spill_elevations[depression]-level)
+            areas[depression] = area
+
+    def route(self, catchment, full, started, jumps):
+        # The depression filling with the water which runs into a catchment,
+        # or None if it runs off the board. The route out of a full
+        # depression leads to the same place for good, whether it climbs
+        # into its parent or overflows into its sibling, which later climbs
+        # into the same parent, so every full depression passed on the way
+        # jumps straight to the end of the route next time
+        depression = catchment
+        passed = []
+        while depression != OCEAN and full[depression]:
+            passed.append(depression)
+            if jumps[depression] is not None:
+                depression = jumps[depression]
+                continue
+            parent = self.parents[depression]
+            if parent is not None and started[parent]:
+                depression = parent
+            else:
+                depression = self.overflows[depression]
+        for node in passed:
+            jumps[node] = depression
+        return None if depression == OCEAN else depression
+
+    def fill_depressions(self):
+        # Follow the rain as it fills each depression at the rate of the
+        # squares draining into it, passing on the rate of every depression
+        # which fills. Depths are the times of this simulation
+        count = len(self.parents)
+        parents, children = self.parents, self.children
+        capacities = self.capacities
+        rates, stored, since = [0]*count, [0]*count, [0]*count
+        full, started = bytearray(count), bytearray(count)
+        self.start_depths = [math.inf]*count
+        self.fill_depths = [math.inf]*count
+        versions = [0]*count
+        jumps = [None]*count
+        events = []
+        # Every change of rate of a depression, as (depression, depth,
+        # stored volume, rate) in the order of the simulation
+        changes = []
+
+        def schedule(depression, depth):
+            changes.append((depression, depth, stored[depression],
+                rates[depression]))
+            versions[depression] += 1
+            heapq.heappush(events, (depth + (capacities[depression] -
+                stored[depression])/rates[depression], versions[depression],
+                depression))
+
+        for label in self.labels:
+            rates[label] += 1
+        # Breakpoints of the total stored volume, and its slope after each
+        total_rate = sum(rates) - rates[OCEAN]
+        self.depths, self.stored, self.slopes = [0], [0], [total_rate]
+        for depression in range(1, count):
+            if rates[depression]:
+                started[depression] = 1
+                self.start_depths[depression] = 0
+                schedule(depression, 0)
+
+        while events:
+            depth, version, depression = heapq.heappop(events)
+            if version != versions[depression]:
+                continue
+            full[depression] = 1
+            self.fill_depths[depression] = depth
+            stored[depression] = capacities[depression]
+
+            # A depression whose sibling is full merges with it, otherwise
+            # its overflow joins the depression the water runs into
+            parent = parents[depression]
+            if parent is not None:
+                first, second = children[parent]
+            if parent is not None and full[first] and full[second]:
+                started[parent] = 1
+                self.start_depths[parent] = depth
+                stored[parent] = capacities[first] + capacities[second]
+                rates[parent] = rates[depression]
+                since[parent] = depth
+                schedule(parent, depth)
+                continue
+            target = self.route(self.overflows[depression], full, started,
+                jumps)
+            if target is None:
+                self.stored.append(self.stored[-1] +
+                    self.slopes[-1]*(depth-self.depths[-1]))
+                self.depths.append(depth)
+                total_rate -= rates[depression]
+                self.slopes.append(total_rate)
+            else:
+                stored[target] += rates[target]*(depth-since[target])
+                since[target] = depth
+                rates[target] += rates[depression]
+                schedule(target, depth)
+        self.total_capacity = sum(capacities[depression]
+            for depression in range(1, count) if parents[depression] is None)
+
+        # Group the changes of rate by depression, keeping their order, so
+        # the timeline of every depression lies in flat lists from
+        # self.change_firsts[depression] to self.change_firsts[depression+1]
+        sizes = [0]*(count+1)
+        for change in changes:
+            sizes[change[0]] += 1
+        self.change_firsts = list(accumulate(sizes, initial=0))[:-1]
+        filled = list(self.change_firsts)
+        self.change_depths = [0]*len(changes)
+        self.change_volumes = [0]*len(changes)
+        self.change_rates = [0]*len(changes)
+        for depression, depth, volume, rate in changes:
+            k = filled[depression]
+            self.change_depths[k] = depth
+            self.change_volumes[k] = volume
+            self.change_rates[k] = rate
+            filled[depression] += 1
+
+    def rain_depth(self, rain_depth=None, water_input=None):
+        # Rain may be given as a depth or as the volume over the whole board
+        if water_input is not None:
+            return water_input / self.area
+        return rain_depth
+
+    def stored_volume(self, rain_depth=None, water_input=None):
+        depth = self.rain_depth(rain_depth, water_input)
+        if depth >= self.depths[-1] and self.slopes[-1] == 0:
+            return self.total_capacity
+        k = bisect_right(self.depths, depth) - 1
+        return self.stored[k] + self.slopes[k]*(depth-self.depths[k])
+
+    def depression_volume(self, depression, rain_depth=None,
+        water_input=None):
+        depth = self.rain_depth(rain_depth, water_input)
+        if depth >= self.fill_depths[depression]:
+            return self.capacities[depression]
+        if depth < self.start_depths[depression]:
+            return 0
+        k = bisect_right(self.change_depths, depth,
+            self.change_firsts[depression],
+            self.change_firsts[depression+1]) - 1
+        return self.change_volumes[k] + \
+            self.change_rates[k]*(depth-self.change_depths[k])
+
+    def level(self, depression, volume):
+        # Inverts the volume of a depression at each level
+        if volume >= self.capacities[depression]:
+            return self.spill_elevations[depression]
+        first = self.firsts[depression]
+        k = bisect_right(self.volumes, volume, first,
+            self.firsts[depression+1]) - 1
+        return self.levels[k] + (volume-self.volumes[k]) / \
+            (self.first_areas[depression]+k-first)
+
+    def lakes(self, rain_depth=None, water_input=None):
+        depth = self.rain_depth(rain_depth, water_input)
+        lakes = []
+        for depression in range(1, len(self.parents)):
+            parent = self.parents[depression]
+            if self.start_depths[depression] > depth or (parent is not None
+                and self.start_depths[parent] <= depth):
+                continue
+            volume = self.depression_volume(depression, depth)
+            if volume > 0:
+                lakes.append(Lake(depression, volume,
+                    self.level(depression, volume)))
+        return lakes
+
+    def water_level(self, x, y, rain_depth=None, water_input=None):
+        depth = self.rain_depth(rain_depth, water_input)
+        i = y*self.length+x
+        depression = self.labels[i]
+        if depression == OCEAN:
+            return self.heights[i]
+        # The square stands in the lake of the highest depression started.
+        # Depressions start after their children, so the started ancestors
+        # are the lowest ones and the highest is found by binary lifting
+        for jumps in reversed(self.ancestors):
+            ancestor = jumps[depression]
+            if ancestor is not None and \
+                self.start_depths[ancestor] <= depth:
+                depression = ancestor
+        volume = self.depression_volume(depression, depth)
+        if volume <= 0:
+            return self.heights[i]
+        return max(self.heights[i], self.level(depression, volume))
+
+"""
+Rainfall scenarios may be run from the command line over a raster of
+heights, for example:
+
+python floodspill.py heights.npy --rain 0.5 1 2 5
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Store uniform rainfall \
+                        of several depths over a raster of heights')
+    parser.add_argument('path', help='.npy, .asc or .pgm file, or raw file \
+                        of heights')
+    parser.add_argument('-l','--length', dest='length', type=int, default=None,
+                        help='number of squares per row of a raw file')
+    parser.add_argument('-w','--width', dest='width', type=int, default=None,
+                        help='number of rows of a raw file')
+    parser.add_argument('--dtype', dest='dtype', default='<i2',
+                        help='element type of a raw file, such as <i2 or <f4')
+    parser.add_argument('--rain', dest='rain', metavar='depth', type=float,
+                        nargs='+', required=True, help='depths of rain \
+                        falling on every square')
+    args = parser.parse_args()
+
+    with floodio.open_heights(args.path, args.length, args.width,
+        args.dtype) as raster:
+        tree = FillSpillTree(raster)
+        for depth in args.rain:
+            print(f"Rain of depth {depth} stores " +
+                f"{tree.stored_volume(depth):g} units of water in " +
+                f"{len(tree.lakes(depth))} lakes.")
@@ -0,0 +1,402 @@
+#!/usr/bin/env Python
+
+import bisect
+import random
+import argparse
+import operator
+from array import array
+from itertools import repeat
+
+import floodio
+
+'''
+A seeded generator of terrain for testing the flood engines at scale. Every
+terrain is produced one row at a time, mostly with bulk operations on whole
+rows (random bytes, byte translation, and map() over rows) rather than a
+Python call per square, so boards of 10k x 10k squares can be streamed to
+disk in any of the raster formats of floodio without holding them in
+memory. The same seed always produces the same board.
+
+The terrains are:
+    noise     uniformly random heights, as generated by prepare_grid()
+    fractal   diamond-square fractal landscape
+    bowl      a single bowl rising to a rim around the board
+    basins    a patchwork of bowls with rims of different heights, which
+              spill into each other
+    maze      a maze of walls whose corridors have uneven floors and drain
+              through a single gap in the outer wall
+    terraces  terraces stepping down across the board, each with a lip, so
+              that water pools on every step and spills down the next
+'''
+
+# Terrain generated when none is chosen
+DEFAULT_TERRAIN = 'noise'
+# Largest side of the diamond-square grid of the fractal terrain, which is
+# interpolated up to larger boards
+FRACTAL_GRID_LIMIT = 1025
+# Side of each bowl of the basins terrain
+BASIN_SIZE = 32
+
+
+def random_bytes(rng, size):
+    """
+    The same bytes as rng.randbytes(size), which needs Python 3.9, built
+    from getrandbits() for older versions of Python.
+    """
+    if size <= 0:
+        return b''
+    return rng.getrandbits(8*size).to_bytes(size, 'little')
+
+def noise_rows(length, width, max_height, rng):
+    """
+    Uniformly random heights from 0 to max_height.
+
+    Parameters
+    ----------
+    length : int
+        Number of squares in each row
+    width : int
+        Number of rows
+    max_height : int
+        Highest height of the board
+    rng : random.Random
+        Seeded source of randomness
+
+    Yields
+    ------
+    row : list of ints
+        The heights of each row in turn
+    """
+    if max_height < 256:
+        # Scale random bytes to heights through a translation table
+        table = bytes([byte*(max_height+1) >> 8 for byte in range(256)])
+        for y in range(width):
+            yield list(random_bytes(rng, length).translate(table))
+    elif max_height < 2**16:
+        for y in range(width):
+            yield [value*(max_height+1) >> 16 
+                for value in array('H', random_bytes(rng, 2*length))]
+    else:
+        for y in range(width):
+            yield [rng.randint(0, max_height) for x in range(length)]
+
+def diamond_square(side, rng, roughness=0.5):
+    """
+    Generates a square fractal heightmap with the diamond-square algorithm.
+
+    Parameters
+    ----------
+    side : int
+        Side of the grid, which must be a power of two plus one
+    rng : random.Random
+        Seeded source of randomness
+    roughness : float, optional, default 0.5
+        Factor by which the random displacement shrinks at each step
+
+    Returns
+    -------
+    heights : list of floats
+        Flat list of side*side heights, indexed by y*side+x
+    """
+    grid = [0.0]*(side*side)
+    for corner in (0, side-1, side*(side-1), side*side-1):
+        grid[corner] = rng.random()
+    step, scale = side-1, 1.0
+    while step > 1:
+        half = step // 2
+        # Diamond step: the centre of every square
+        for y in range(half, side, step):
+            for x in range(half, side, step):
+                grid[y*side+x] = (grid[(y-half)*side+x-half] +
+                    grid[(y-half)*side+x+half] + grid[(y+half)*side+x-half] +
+                    grid[(y+half)*side+x+half]) / 4 + (rng.random()*2-1)*scale
+        # Square step: the middle of every edge
+        for y in range(0, side, half):
+            for x in range((y+half) % step, side, step):
+                total, count = 0.0, 0
+                for nx, ny in ((x, y-half), (x+half, y), (x, y+half),
+                    (x-half, y)):
+                    if 0 <= nx < side and 0 <= ny < side:
+                        total += grid[ny*side+nx]
+                        count += 1
+                grid[y*side+x] = total/count + (rng.random()*2-1)*scale
+        step, scale = half, scale*roughness
+    return grid
+
+def fractal_rows(length, width, max_height, rng):
+    """
+    A diamond-square fractal landscape scaled to heights from 0 to
+    max_height. Boards larger than FRACTAL_GRID_LIMIT stretch every point of
+    the fractal grid over several squares, interpolating between them.
+
+    Parameters and Yields are those of noise_rows().
+    """
+    side = 3
+    while side < min(max(length, width), FRACTAL_GRID_LIMIT):
+        side = 2*side-1
+    # Squares between neighbouring points of the fractal grid
+    stretch = -(-(max(length, width)-1) // (side-1)) or 1
+    grid = diamond_square(side, rng)
+    low, high = min(grid), max(grid)
+    scale = max_height / ((high-low) or 1)
+    grid = [(height-low)*scale for height in grid]
+
+    # Interpolated rises along each stretch, shared by every equal rise
+    ramps = {}
+    points = (length-1) // stretch + 1
+    for y in range(width):
+        y0, fy = divmod(y, stretch)
+        above = grid[y0*side:y0*side+points+1]
+        below = grid[(y0+1)*side:(y0+1)*side+points+1] if fy else above
+        if stretch == 1:
+            yield [round(a) for a in above[:length]]
+            continue
+        fy /= stretch
+        heights = [round(a+(b-a)*fy) for a, b in zip(above, below)]
+        row = []
+        for start, rise in zip(heights, map(operator.sub, heights[1:], 
+            heights)):
+            if rise not in ramps:
+                ramps[rise] = [round(rise*x/stretch) for x in range(stretch)]
+            row.extend(map(operator.add, ramps[rise], repeat(start)))
+        yield row[:length]
+
+def bowl_profile(length, max_height):
+    """
+    Heights rising from 0 at the centre of a row of squares to max_height at
+    both ends, as the cross section of a bowl.
+    """
+    centre = (length-1) / 2
+    return [round(max_height*abs(x-centre)/max(centre, 1)) 
+        for x in range(length)]
+
+def bowl_row(profile, level):
+    """
+    The row of a bowl at a level of its cross section, which is the higher
+    of the profile and the level, built from slices of the profile. 
+    """
+    middle = len(profile) // 2
+    # The profile falls to its middle then rises, so the squares below the
+    # level form a single run around the middle
+    start = middle - bisect.bisect_left(profile[middle-1::-1], level) \
+        if middle else 0
+    stop = bisect.bisect_left(profile, level, middle)
+    start = min(start, stop)
+    return profile[:start] + [level]*(stop-start) + profile[stop:]
+
+def bowl_rows(length, width, max_height, rng):
+    """
+    A bowl rising from its centre to a rim at max_height, roughened by a
+    little noise, which holds a single large pool.
+
+    Parameters and Yields are those of noise_rows().
+    """
+    rim = max(max_height-1, 0)
+    profile = bowl_profile(length, rim)
+    levels = bowl_profile(width, rim)
+    noise = bytes([byte & 1 for byte in range(256)])
+    for level in levels:
+        yield list(map(operator.add, bowl_row(profile, level),
+            random_bytes(rng, length).translate(noise) if max_height else 
+            bytes(length)))
+
+def basin_rows(length, width, max_height, rng):
+    """
+    A patchwork of square bowls of side BASIN_SIZE, each with a random
+    floor and a rim of its own height, so that water pools in every bowl and
+    the lower bowls spill into their neighbours.
+
+    Parameters and Yields are those of noise_rows().
+    """
+    size = max(min(BASIN_SIZE, length, width), 2)
+    columns, rows = -(-length // size), -(-width // size)
+    # Rows of a bowl of each depth, shared by every bowl of that depth
+    bowls = {}
+    for j in range(rows):
+        basins = []
+        for i in range(columns):
+            floor = rng.randint(0, max_height // 2)
+            depth = rng.randint(0, max_height-floor)
+            if depth not in bowls:
+                profile = bowl_profile(size, depth)
+                bowls[depth] = [bowl_row(profile, level) for level in profile]
+            basins.append((floor, bowls[depth]))
+        for dy in range(min(size, width-j*size)):
+            row = []
+            for floor, bowl in basins:
+                row.extend(map(operator.add, bowl[dy], repeat(floor)))
+            yield row[:length]
+
+def maze_rows(length, width, max_height, rng):
+    """
+    A maze of walls at max_height, carved row by row with the binary tree
+    algorithm: every cell at odd coordinates opens a corridor either to the
+    north or to the east. The corridors have uneven floors and drain through
+    a single gap in the outer wall, so water must find its way along winding
+    passages, as in test_draining_maze.
+
+    Parameters and Yields are those of noise_rows().
+    """
+    floors = bytes([byte % (max_height//4 + 1) for byte in range(256)])
+    cells_x, cells_y = (length-1) // 2, (width-1) // 2
+    wall = [max_height]*length
+    if not cells_x or not cells_y:
+        for y in range(width):
+            yield list(wall)
+        return
+
+    # The outer wall, with a gap next to the first cell
+    top = list(wall)
+    top[1] = 0
+    yield top
+    for j in range(cells_y):
+        # Cells of the first row open east, cells of the last column north
+        north = [j > 0 and (i == cells_x-1 or bool(choice & 1))
+            for i, choice in enumerate(random_bytes(rng, cells_x))]
+        if j > 0:
+            row = list(wall)
+            floor_row = random_bytes(rng, cells_x).translate(floors)
+            row[1:2*cells_x:2] = [floor if opens else max_height for opens,
+                floor in zip(north, floor_row)]
+            yield row
+        row = list(wall)
+        row[1:2*cells_x:2] = random_bytes(rng, cells_x).translate(floors)
+        floor_row = random_bytes(rng, cells_x-1).translate(floors)
+        row[2:2*cells_x-1:2] = [max_height if opens else floor for opens,
+            floor in zip(north, floor_row)]
+        yield row
+    for y in range(2*cells_y, width):
+        yield list(wall)
+
+def terrace_rows(length, width, max_height, rng):
+    """
+    Terraces stepping down from one side of the board to the other, each
+    with a lip along its lower edge, so that water pools on every step and
+    spills down the next, as in test_tiered_waterfall.
+
+    Parameters and Yields are those of noise_rows().
+    """
+    steps = max(min(length // 4, max_height // 2), 1)
+    rise = max_height // steps
+    noise = bytes([byte % (rise//4 + 1) for byte in range(256)])
+    base, rough = [], []
+    for x in range(length):
+        step = x*steps // length
+        # Lips at the lower edge of each terrace are level, floors are rough
+        if (x+1)*steps // length != step:
+            base.append(min((steps-1-step)*rise + rise // 2 + 1, max_height))
+            rough.append(0)
+        else:
+            base.append((steps-1-step)*rise)
+            rough.append(1)
+    for y in range(width):
+        # Walls along the sides keep the water on the terraces
+        if y in (0, width-1):
+            yield [max_height]*length
+            continue
+        yield list(map(operator.add, base, map(operator.mul, rough, 
+            random_bytes(rng, length).translate(noise))))
+
+TERRAIN_TYPES = {
+    'noise': noise_rows,
+    'fractal': fractal_rows,
+    'bowl': bowl_rows,
+    'basins': basin_rows,
+    'maze': maze_rows,
+    'terraces': terrace_rows,
+}
+
+def terrain_rows(terrain, length, width, max_height, seed=None):
+    """
+    Generates the rows of a board of a terrain type one at a time.
+
+    Parameters
+    ----------
+    terrain : str
+        One of TERRAIN_TYPES
+    length : int
+        Number of squares in each row
+    width : int
+        Number of rows
+    max_height : int
+        Highest height of the board
+    seed : int or str, optional
+        Seed of the board's randomness, or None for a different board on
+        every call
+
+    Yields
+    ------
+    row : list of ints
+        The heights of each row in turn
+    """
+    if terrain not in TERRAIN_TYPES:
+        raise ValueError(f"Unknown terrain '{terrain}', expected one of " +
+            ", ".join(TERRAIN_TYPES))
+    return TERRAIN_TYPES[terrain](length, width, max_height,
+        random.Random(seed))
+
+def make_terrain(terrain, length, width, max_height, seed=None):
+    """
+    Generates a whole board of a terrain type in memory.
+
+    Parameters are those of terrain_rows().
+
+    Returns
+    -------
+    topo_grid : 2D arr/list of lists
+    """
+    return list(terrain_rows(terrain, length, width, max_height, seed))
+
+def write_terrain(path, terrain, length, width, max_height, seed=None,
+    dtype=None):
+    """
+    Streams a board of a terrain type to a raster file row by row, in any
+    format of floodio.write_raster(), so that boards far larger than memory
+    may be generated.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raster file to create, whose extension picks the format
+    terrain, length, width, max_height, seed
+        As for terrain_rows()
+    dtype : str, optional
+        Element type of binary formats, by default '<i2' if max_height fits
+        in it, and '<i4' otherwise
+    """
+    if dtype is None:
+        dtype = '<i2' if max_height < 2**15 else '<i4'
+    floodio.write_raster(path, terrain_rows(terrain, length, width,
+        max_height, seed), length, width, dtype)
+
+"""
+Boards may be generated from the command line, for example a fractal board
+of 10000 x 10000 squares as a .npy file, which topographyfloodsim.py reads
+with --input and floodtiles.py floods one tile at a time:
+
+python floodterrain.py board.npy --terrain fractal -l 10000 -w 10000 --mh 1000 --seed 1
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a board of \
+                        terrain and write it to a raster file')
+    parser.add_argument('path', help='raster file to create: .npy, .asc, \
+                        .pgm, .bil (with a .hdr file) or raw')
+    parser.add_argument('--terrain', dest='terrain',
+                        choices=list(TERRAIN_TYPES), default=DEFAULT_TERRAIN,
+                        help='terrain type: ' + ', '.join(TERRAIN_TYPES))
+    parser.add_argument('-l','--length', dest='length', type=int,
+                        required=True, help='number of squares per row')
+    parser.add_argument('-w','--width', dest='width', type=int,
+                        required=True, help='number of rows')
+    parser.add_argument('--mh','--max-height', dest='max_height', type=int,
+                        required=True, help='highest height of the board')
+    parser.add_argument('--seed', dest='seed', type=int, default=None,
+                        help='seed of the board, the same seed always \
+                        producing the same board')
+    parser.add_argument('--dtype', dest='dtype', default=None,
+                        help='element type of binary files, such as <i2')
+    args = parser.parse_args()
+
+    write_terrain(args.path, args.terrain, args.length, args.width,
+        args.max_height, args.seed, args.dtype)
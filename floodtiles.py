@@ -0,0 +1,611 @@
+#!/usr/bin/env Python
+
+import math
+import heapq
+import argparse
+import multiprocessing
+from array import array
+
+import floodio
+
+'''
+Out-of-core flooding of height rasters which do not fit in memory, such as
+20k x 20k elevation models. The raster is memory mapped with floodio and
+flooded one tile at a time, so no more than one tile of heights is ever held
+in memory. Only the spill graph between the watersheds of the tile
+perimeters grows with the board, by a few dozen bytes per watershed.
+
+Each tile is flooded on its own from its perimeter with a priority flood,
+which labels every square with the watershed of the perimeter it was flooded
+from and records the level at which neighbouring labels spill into each
+other. The perimeter squares on either side of each tile boundary serve as
+each other's halo, which joins the labels of all tiles into a single spill
+graph, of which each tile only keeps a minimum spanning forest. Flooding
+that small graph from the edges of the board gives the level each label must at least be filled
+to, and a second pass over the tiles raises the water of every square to the
+level of its label. This is the parallel priority flood of Barnes (2016), and
+its results equal those of an in-memory priority_flood() exactly.
+
+The same two passes also run on a pool of worker processes for boards which
+do fit in memory. The heights, water surface and labels of the board are
+then kept in shared memory, which every worker attaches to once, so only the
+bounds of each tile and its perimeter are ever sent between processes.
+'''
+
+# Default side of a square tile, 512x512 squares hold about 20MB of state
+DEFAULT_TILE_SIZE = 512
+# Label of the squares which drain directly over the edges of the board
+OCEAN = 0
+# Shared buffers of the board, attached once in each worker process
+WORKER_BUFFERS = {}
+
+
+def tile_bounds(length, width, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Splits a board into tiles of at most tile_size x tile_size squares.
+
+    Parameters
+    ----------
+    length : int
+        Length (x axis) of the board
+    width : int
+        Width (y axis) of the board
+    tile_size : int, optional, defaults to DEFAULT_TILE_SIZE
+        Side of each tile
+
+    Returns
+    -------
+    tiles : list of tuples (x0, y0, x1, y1)
+        The half-open bounds of every tile, in row-major order
+    """
+    return [(x0, y0, min(x0+tile_size, length), min(y0+tile_size, width))
+        for y0 in range(0, width, tile_size)
+        for x0 in range(0, length, tile_size)]
+
+def flood_tile(heights, bounds, length, width, first_label, drain=None):
+    """
+    Floods a single tile from its perimeter, labelling the watersheds of the
+    perimeter as Barnes (2016) does. Perimeter squares on the edge of the
+    board are labelled OCEAN, and every other perimeter square starts a new
+    label from first_label only if no other label reached it first, so that
+    a perimeter square flooded from a lower one shares its label. Every inner
+    square inherits the label of the square it was flooded from. Where two
+    labels meet, the level at which water spills between them is recorded.
+    Squares outside the board are labelled OCEAN too, so that water drains
+    into them as it does off the edges of the board.
+
+    Parameters
+    ----------
+    heights : list
+        Flat list of the tile's heights, indexed by (y-y0)*(x1-x0)+(x-x0)
+    bounds : tuple (x0, y0, x1, y1)
+        Half-open bounds of the tile on the board
+    length : int
+        Length (x axis) of the whole board
+    width : int
+        Width (y axis) of the whole board
+    first_label : int
+        First label given to the perimeter squares of this tile
+    drain : int or float, optional
+        Height of the squares outside the board, lower than any other height
+
+    Returns
+    -------
+    (levels, labels, spills, next_label) : tuple
+        Flat lists of the local water surface and label of each square, a dict
+        of the lowest spill level between each pair of labels keyed by
+        (low label, high label), and the first label left unused
+    """
+    x0, y0, x1, y1 = bounds
+    tile_length, tile_width = x1-x0, y1-y0
+    levels = list(heights)
+    labels = [-1]*len(heights)
+    closed = bytearray(len(heights))
+    spills = {}
+
+    # Seed the heap with every perimeter square of the tile
+    heap = []
+    next_label = first_label
+    for i in range(len(heights)):
+        ty, tx = divmod(i, tile_length)
+        if drain is not None and heights[i] == drain:
+            labels[i] = OCEAN
+            heap.append((heights[i], i))
+        elif tx in (0, tile_length-1) or ty in (0, tile_width-1):
+            x, y = x0+tx, y0+ty
+            if 0 in (x,y) or x == length-1 or y == width-1:
+                labels[i] = OCEAN
+            heap.append((heights[i], i))
+    heapq.heapify(heap)
+
+    pit = []
+    while heap or pit:
+        if pit:
+            level, i = pit.pop()
+        else:
+            level, i = heapq.heappop(heap)
+        # Perimeter squares flooded from a lower square are queued twice
+        if closed[i]:
+            continue
+        closed[i] = 1
+        if labels[i] == -1:
+            labels[i] = next_label
+            next_label += 1
+        label = labels[i]
+        ty, tx = divmod(i, tile_length)
+        for n, inside in ((i-tile_length, ty>0), (i+1, tx<tile_length-1),
+                          (i+tile_length, ty<tile_width-1), (i-1, tx>0)):
+            if not inside:
+                continue
+            if labels[n] != -1:
+                # Two labels meet, keep the lowest level they spill at
+                if labels[n] != label:
+                    pair = (min(label, labels[n]), max(label, labels[n]))
+                    spill = max(level, levels[n])
+                    if pair not in spills or spill < spills[pair]:
+                        spills[pair] = spill
+                continue
+            labels[n] = label
+            if heights[n] <= level:
+                levels[n] = level
+                pit.append((level, n))
+            else:
+                heapq.heappush(heap, (heights[n], n))
+
+    return levels, labels, spills, next_label
+
+def join_tile(heights, labels, bounds, above, left, spills):
+    """
+    Adds the spill levels between the labels of a tile and those of the tiles
+    above and to the left of it to the spill graph. Squares on either side of
+    a tile boundary are perimeter squares of their tiles, and water spills
+    between them at the higher of their two heights. The bottom row and right
+    column of the tile are then kept in place of those of the previous tiles,
+    so only one row of the board's perimeters is held at any time.
+
+    Parameters
+    ----------
+    heights : list
+        Flat list of the tile's heights
+    labels : list
+        Flat list of the tile's labels, from flood_tile()
+    bounds : tuple (x0, y0, x1, y1)
+        Half-open bounds of the tile on the board
+    above : list
+        (label, height) of the squares on the row above the tile, indexed by
+        x, updated in place with the tile's bottom row
+    left : list
+        (label, height) of the squares on the column left of the tile,
+        indexed by y, updated in place with the tile's right column
+    spills : dict
+        Spill graph to extend, keyed by (low label, high label)
+    """
+    x0, y0, x1, y1 = bounds
+    tile_length, tile_width = x1-x0, y1-y0
+
+    def join(label, height, other):
+        other_label, other_height = other
+        if other_label != label:
+            pair = (min(label, other_label), max(label, other_label))
+            spill = max(height, other_height)
+            if pair not in spills or spill < spills[pair]:
+                spills[pair] = spill
+
+    if y0 > 0:
+        for tx in range(tile_length):
+            join(labels[tx], heights[tx], above[x0+tx])
+    if x0 > 0:
+        for ty in range(tile_width):
+            i = ty*tile_length
+            join(labels[i], heights[i], left[y0+ty])
+
+    bottom = (tile_width-1)*tile_length
+    for tx in range(tile_length):
+        above[x0+tx] = (labels[bottom+tx], heights[bottom+tx])
+    for ty in range(tile_width):
+        i = ty*tile_length+tile_length-1
+        left[y0+ty] = (labels[i], heights[i])
+
+def add_spanning_spills(spills, graph):
+    """
+    Adds the minimum spanning forest of the spills of a tile to the spill
+    graph. The level a label must be filled to is that of the lowest path of
+    spills from it to the OCEAN, which the spanning forest keeps between any
+    two labels, so the graph grows by fewer spills than there are labels in
+    the spills of the tile, however many pairs of labels meet in it.
+
+    Parameters
+    ----------
+    spills : dict
+        Spill levels between the labels of a tile and of its neighbours,
+        keyed by (low label, high label)
+    graph : tuple (array, array, array)
+        Both labels and the level of every spill of the graph, extended in
+        place
+    """
+    sources, targets, spill_levels = graph
+    parent = {}
+
+    def find(label):
+        root = label
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while label != root:
+            parent[label], label = root, parent[label]
+        return root
+
+    for (a, b), spill in sorted(spills.items(), key=lambda item: item[1]):
+        root, other = find(a), find(b)
+        if root != other:
+            parent[other] = root
+            sources.append(a)
+            targets.append(b)
+            spill_levels.append(spill)
+
+def solve_spills(graph, label_count, lowest):
+    """
+    Floods the spill graph from the OCEAN label, which gives the lowest level
+    at which the water of every label can leave the board. The graph is
+    kept in flat arrays throughout, as it is the only part of a tiled flood
+    which grows with the whole board.
+
+    Parameters
+    ----------
+    graph : tuple (array, array, array)
+        Both labels and the level of every spill, from add_spanning_spills()
+    label_count : int
+        Number of labels, all of which are below it
+    lowest : int or float
+        Level below every height, given to the OCEAN
+
+    Returns
+    -------
+    label_levels : array
+        Level every label's squares must at least be filled to, indexed by
+        label
+    """
+    sources, targets, spill_levels = graph
+    # Spills of every label in compressed rows, starting at offsets[label]
+    offsets = array('q', bytes(8*(label_count+1)))
+    for label in sources:
+        offsets[label+1] += 1
+    for label in targets:
+        offsets[label+1] += 1
+    for label in range(label_count):
+        offsets[label+1] += offsets[label]
+    ends = array('q', offsets[:-1])
+    neighbours = array('q', bytes(16*len(sources)))
+    neighbour_spills = array(spill_levels.typecode, 
+        bytes(2*len(sources)*spill_levels.itemsize))
+    for a, b, spill in zip(sources, targets, spill_levels):
+        neighbours[ends[a]], neighbour_spills[ends[a]] = b, spill
+        ends[a] += 1
+        neighbours[ends[b]], neighbour_spills[ends[b]] = a, spill
+        ends[b] += 1
+    del ends
+
+    label_levels = array(spill_levels.typecode, [lowest])*label_count
+    settled = bytearray(label_count)
+    heap = [(lowest, OCEAN)]
+    while heap:
+        level, label = heapq.heappop(heap)
+        if settled[label]:
+            continue
+        settled[label] = 1
+        label_levels[label] = level
+        for k in range(offsets[label], offsets[label+1]):
+            other = neighbours[k]
+            if not settled[other]:
+                heapq.heappush(heap, (max(level, neighbour_spills[k]), other))
+    return label_levels
+
+def add_exact(partials, values):
+    """
+    Adds floats to a running sum kept as a list of non-overlapping partial
+    sums (Shewchuk's algorithm), so that math.fsum(partials) is the correctly
+    rounded total no matter how the values were split between tiles.
+
+    Parameters
+    ----------
+    partials : list
+        Running partial sums, updated in place
+    values : iterable of float
+        Values to add
+    """
+    for value in values:
+        i = 0
+        for partial in partials:
+            if abs(value) < abs(partial):
+                value, partial = partial, value
+            high = value + partial
+            low = partial - (high - value)
+            if low:
+                partials[i] = low
+                i += 1
+            value = high
+        partials[i:] = [value]
+
+def read_tile(raster, bounds, drain):
+    """
+    Reads the heights of a tile of a raster, in which the squares holding the
+    raster's nodata value are given the height drain.
+    """
+    heights = raster.window(*bounds)
+    if raster.nodata is not None:
+        heights = [drain if height == raster.nodata else height 
+            for height in heights]
+    return heights
+
+def tiled_flood(raster, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Floods a memory mapped raster one tile at a time and returns the same two
+    statistics as flood_statistics() does for an in-memory board. Only one
+    tile and one row of tile perimeters are held in memory at a time, besides
+    the spill graph between the watersheds of the tile perimeters and the
+    level of each watershed. Those take a few dozen bytes per watershed, and
+    grow with the number of tiles and the roughness of the terrain: smooth
+    terrain has a handful of watersheds per tile, and noise about one for
+    every four perimeter squares. The tile size bounds the memory of the
+    tiles themselves, and larger tiles keep the graph smaller. Squares
+    holding the raster's nodata value are outside the board, hold no water
+    and drain the squares around them, as they do for flood_surface().
+
+    Parameters
+    ----------
+    raster : floodio.HeightRaster or floodio.MemoryRaster
+        The board's heights, from floodio.open_heights()
+    tile_size : int, optional, defaults to DEFAULT_TILE_SIZE
+        Side of each square tile, which bounds the memory of each tile
+
+    Returns
+    -------
+    total_flooding : int or float
+        Volume of water retained on the board
+    max_water_level : int or float
+        Highest level of water that remained after flooding
+    """
+    length, width = raster.length, raster.width
+    tiles = tile_bounds(length, width, tile_size)
+    # Levels of integer rasters are kept as 64 bit integers, never rounded
+    if raster.floating:
+        typecode, lowest = 'd', -math.inf
+    else:
+        typecode, lowest = 'q', -2**63
+
+    # First pass: flood each tile locally and collect its perimeter and spills
+    first_labels = []
+    above, left = [None]*length, [None]*width
+    graph = (array('q'), array('q'), array(typecode))
+    next_label = OCEAN+1
+    for bounds in tiles:
+        heights = read_tile(raster, bounds, lowest)
+        first_labels.append(next_label)
+        levels, labels, spills, next_label = flood_tile(heights, bounds,
+            length, width, next_label, lowest)
+        join_tile(heights, labels, bounds, above, left, spills)
+        add_spanning_spills(spills, graph)
+
+    label_levels = solve_spills(graph, next_label, lowest)
+    del graph
+
+    # Second pass: repeat the local flood, then raise each square's water to
+    # the level of its label
+    total_flooding, max_water_level = 0, 0
+    partials = []
+    for bounds, first_label in zip(tiles, first_labels):
+        heights = read_tile(raster, bounds, lowest)
+        levels, labels, tile_spills, _ = flood_tile(heights, bounds,
+            length, width, first_label, lowest)
+        depths = []
+        for i, height in enumerate(heights):
+            level = max(levels[i], label_levels[labels[i]])
+            if level > height:
+                depths.append(level-height)
+                max_water_level = max(level, max_water_level)
+        if any(isinstance(depth, float) for depth in depths):
+            add_exact(partials, depths)
+        else:
+            total_flooding += sum(depths)
+
+    if partials:
+        add_exact(partials, [total_flooding])
+        total_flooding = math.fsum(partials)
+    return (total_flooding, max_water_level)
+
+def perimeter_size(bounds):
+    """
+    Number of perimeter squares of a tile, which is the number of labels
+    flood_tile() may give out for it.
+    """
+    x0, y0, x1, y1 = bounds
+    tile_length, tile_width = x1-x0, y1-y0
+    return tile_length*tile_width - max(tile_length-2, 0)*max(tile_width-2, 0)
+
+def attach_buffers(names, typecode, length, width):
+    """
+    Initializer of each worker process of parallel_flood_levels(), which
+    attaches to the shared buffers of the board by name.
+    """
+    # Shared memory needs Python 3.8, and only the parallel flood uses it
+    from multiprocessing import shared_memory
+    WORKER_BUFFERS.clear()
+    WORKER_BUFFERS['shape'] = (length, width)
+    for key, name in names.items():
+        shm = shared_memory.SharedMemory(name=name)
+        WORKER_BUFFERS[key+'_shm'] = shm
+        WORKER_BUFFERS[key] = shm.buf.cast('q' if key == 'labels' else typecode)
+
+def read_shared(key, bounds):
+    """
+    Reads the flat list of a tile's values from a worker's shared buffer.
+    """
+    length, width = WORKER_BUFFERS['shape']
+    x0, y0, x1, y1 = bounds
+    values = []
+    for y in range(y0, y1):
+        values.extend(WORKER_BUFFERS[key][y*length+x0:y*length+x1].tolist())
+    return values
+
+def write_shared(key, bounds, values):
+    """
+    Writes the flat list of a tile's values to a worker's shared buffer.
+    """
+    length, width = WORKER_BUFFERS['shape']
+    x0, y0, x1, y1 = bounds
+    buffer = WORKER_BUFFERS[key]
+    tile_length = x1-x0
+    for ty, y in enumerate(range(y0, y1)):
+        buffer[y*length+x0:y*length+x1] = array(buffer.format,
+            values[ty*tile_length:(ty+1)*tile_length])
+
+def flood_shared_tile(task):
+    """
+    First pass of parallel_flood_levels() for one tile, run in a worker. The
+    local water surface and labels go to the shared buffers, and only the
+    tile's spills and the heights and labels of its perimeter are returned.
+    """
+    bounds, first_label = task
+    length, width = WORKER_BUFFERS['shape']
+    heights = read_shared('heights', bounds)
+    levels, labels, spills, next_label = flood_tile(heights, bounds,
+        length, width, first_label)
+    write_shared('levels', bounds, levels)
+    write_shared('labels', bounds, labels)
+
+    x0, y0, x1, y1 = bounds
+    tile_length, tile_width = x1-x0, y1-y0
+    perimeter = [ty*tile_length+tx for ty in range(tile_width) 
+        for tx in range(0, tile_length, 1 if ty in (0, tile_width-1) 
+        else max(tile_length-1, 1))]
+    return (spills, {i: heights[i] for i in perimeter}, 
+        {i: labels[i] for i in perimeter})
+
+def raise_shared_tile(bounds):
+    """
+    Second pass of parallel_flood_levels() for one tile, run in a worker,
+    which raises the water of every square to the level of its label.
+    """
+    levels = read_shared('levels', bounds)
+    labels = read_shared('labels', bounds)
+    label_levels = WORKER_BUFFERS['label_levels']
+    write_shared('levels', bounds, [max(level, label_levels[label]) 
+        for level, label in zip(levels, labels)])
+
+def parallel_flood_levels(heights, length, width, workers, tile_size=None):
+    """
+    The parallel version of priority_flood_levels(), which splits the board
+    into tiles flooded by a pool of worker processes. Both passes of the
+    tiled flood run in the workers against shared memory, while merging the
+    spill graph between the tiles runs in the calling process. The water
+    surface is identical to that of the serial priority flood. Shared
+    memory needs Python 3.8 or newer, unlike the rest of this module.
+
+    Parameters
+    ----------
+    heights : list
+        Flat list of the heights of every square, indexed by y*length+x
+    length : int
+        Length (x axis) of the board
+    width : int
+        Width (y axis) of the board
+    workers : int
+        Number of worker processes
+    tile_size : int, optional
+        Side of each square tile, by default chosen to give each worker about
+        four tiles
+
+    Returns
+    -------
+    surface : list
+        Flat list of the water surface of every square
+    """
+    # Only imported here, so the serial floods still run on Python 3.6
+    from multiprocessing import shared_memory
+    if tile_size is None:
+        tile_size = max(16, math.ceil(max(length, width) / 
+            math.ceil(2*math.sqrt(workers))))
+    tiles = tile_bounds(length, width, tile_size)
+    first_labels = [OCEAN+1]
+    for bounds in tiles:
+        first_labels.append(first_labels[-1]+perimeter_size(bounds))
+
+    # Integer boards are shared as 64 bit integers so that no level is rounded
+    if all(isinstance(height, int) and abs(height) < 2**62 
+        for height in heights):
+        typecode, lowest = 'q', -2**63
+    else:
+        typecode, lowest = 'd', -math.inf
+    itemsize = array(typecode).itemsize
+    buffers = {
+        'heights': shared_memory.SharedMemory(create=True, 
+            size=max(len(heights), 1)*itemsize),
+        'levels': shared_memory.SharedMemory(create=True, 
+            size=max(len(heights), 1)*itemsize),
+        'labels': shared_memory.SharedMemory(create=True, 
+            size=max(len(heights), 1)*8),
+        'label_levels': shared_memory.SharedMemory(create=True, 
+            size=first_labels[-1]*itemsize),
+    }
+    views = []
+    try:
+        view = buffers['heights'].buf.cast(typecode)
+        views.append(view)
+        view[:len(heights)] = array(typecode, heights)
+
+        names = {key: shm.name for key, shm in buffers.items()}
+        with multiprocessing.Pool(workers, initializer=attach_buffers,
+            initargs=(names, typecode, length, width)) as pool:
+            # First pass, then join the tiles in row-major order
+            above, left = [None]*length, [None]*width
+            graph = (array('q'), array('q'), array(typecode))
+            for bounds, (spills, perimeter_heights, perimeter_labels) \
+                in zip(tiles, pool.map(flood_shared_tile, 
+                zip(tiles, first_labels))):
+                join_tile(perimeter_heights, perimeter_labels, bounds, above,
+                    left, spills)
+                add_spanning_spills(spills, graph)
+
+            view = buffers['label_levels'].buf.cast(typecode)
+            views.append(view)
+            view[:] = solve_spills(graph, first_labels[-1], lowest)
+
+            # Second pass
+            pool.map(raise_shared_tile, tiles)
+
+        view = buffers['levels'].buf.cast(typecode)
+        views.append(view)
+        return view[:len(heights)].tolist()
+    finally:
+        for view in views:
+            view.release()
+        for shm in buffers.values():
+            shm.close()
+            shm.unlink()
+
+def open_raster(path, length=None, width=None, dtype='<i2'):
+    """
+    Opens a raster in any format of floodio.open_heights(), such as a .npy
+    file, or a raw file of the given shape and element type.
+    """
+    return floodio.open_heights(path, length, width, dtype)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flood a raster of heights \
+                        too large for memory, one tile at a time')
+    parser.add_argument('path', help='.npy, .asc or .pgm file, or raw file \
+                        of heights')
+    parser.add_argument('-l','--length', dest='length', type=int, default=None,
+                        help='number of squares per row of a raw file')
+    parser.add_argument('-w','--width', dest='width', type=int, default=None,
+                        help='number of rows of a raw file')
+    parser.add_argument('--dtype', dest='dtype', default='<i2',
+                        help='element type of a raw file, such as <i2 or <f4')
+    parser.add_argument('--tile-size', dest='tile_size', type=int,
+                        default=DEFAULT_TILE_SIZE, help='side of each square \
+                        tile, which bounds the memory of each tile')
+    args = parser.parse_args()
+
+    with open_raster(args.path, args.length, args.width, args.dtype) as raster:
+        total_flooding, max_water_level = tiled_flood(raster, args.tile_size)
+    print(f"Total flooding is {total_flooding} cubes.")
+    print(f"Max water level is {max_water_level}.")
@@ -1,10 +1,41 @@
 #!/usr/bin/env Python
 
+import io
+import os
+import sys
+import json
+import asyncio
 import unittest
-from topographyfloodsim import full_simulation  
+import random
+import signal
+import struct
+import tempfile
+from array import array
+import subprocess
+import threading
+import contextlib
+import floodio
+from floodio import numpy
+import floodtiles
+import floodcache
+import floodbench
+import floodterrain
+import floodserver
+import floodspill
+from topographyfloodsim import full_simulation, priority_flood, \
+    MakeCartesianGrid, VoxelStore, simulate_flood, flood_statistics, \
+    flood_surface, priority_flood_levels, simulate_many, run_batch, \
+    FloodModel, ColumnStore, flood_basins, FloodCheckpoint, groom_grid, \
+    FloodStatistics, export_flood, NODATA
 
 class Test1(unittest.TestCase):
 
+    # Flood engine used by every board test, overridden by engine subclasses
+    engine = 'pathfinding'
+    storage = 'objects'
+    continuous = False
+    workers = 1
+
     def test_small_draining_grid(self):
         chessboard = [  
             [2,1,3,3],
@@ -12,7 +43,9 @@ class Test1(unittest.TestCase):
             [1,0,0,2],
             [1,0,1,1]
         ]
-        total_flooding, max_water_level = full_simulation(chessboard)
+        total_flooding, max_water_level = full_simulation(chessboard, 
+            engine=self.engine, storage=self.storage, 
+            continuous=self.continuous, workers=self.workers)
         self.assertEqual(total_flooding, 0)
            
     def test_full_containment(self):
@@ -26,7 +59,9 @@ class Test1(unittest.TestCase):
             [3,0,0,0,0,0,0,3],
             [0,3,4,3,4,3,4,0],
         ]
-        total_flooding, max_water_level = full_simulation(chessboard)
+        total_flooding, max_water_level = full_simulation(chessboard, 
+            engine=self.engine, storage=self.storage, 
+            continuous=self.continuous, workers=self.workers)
         self.assertEqual(total_flooding, 108)
 
     def test_draining_maze(self):
@@ -40,7 +75,9 @@ class Test1(unittest.TestCase):
             [4,2,3,0,0,0,0,3],
             [4,1,1,0,1,1,1,0],
         ]
-        total_flooding, max_water_level = full_simulation(chessboard)
+        total_flooding, max_water_level = full_simulation(chessboard, 
+            engine=self.engine, storage=self.storage, 
+            continuous=self.continuous, workers=self.workers)
         self.assertEqual(total_flooding, 6)
         
     def test_tiered_waterfall(self):
@@ -54,7 +91,945 @@ class Test1(unittest.TestCase):
             [3,1,3,3,0,0,1,9],
             [2,3,2,0,1,1,0,0],
         ]
-        total_flooding, max_water_level = full_simulation(chessboard)
+        total_flooding, max_water_level = full_simulation(chessboard, 
+            engine=self.engine, storage=self.storage, 
+            continuous=self.continuous, workers=self.workers)
         self.assertEqual(total_flooding, 14)    
+
+class TestPriorityFlood(Test1):
+
+    engine = 'priority_flood'
+
+    def test_water_surface(self):
+        chessboard = [
+            [3,3,3,3],
+            [3,0,1,2],
+            [3,1,3,3],
+            [3,3,3,3]
+        ]
+        water_surface = priority_flood(chessboard)
+        self.assertEqual(water_surface, [
+            [3,3,3,3],
+            [3,2,2,2],
+            [3,2,3,3],
+            [3,3,3,3]
+        ])
+        # Rectangular boards flood as well
+        total_flooding, max_water_level = full_simulation(
+            [[5,5,5,5,5,5],[5,1,5,0,0,5],[5,5,5,5,5,5]], engine=self.engine,
+            storage=self.storage)
+        self.assertEqual((total_flooding, max_water_level), (14, 5))
     
+class TestLevelSweep(Test1):
+
+    engine = 'level_sweep'
+
+    def test_matches_pathfinding(self):
+        rng = random.Random(3)
+        for trial in range(30):
+            size = rng.randint(3, 9)
+            grid = [[rng.randint(0, 6) for x in range(size)] 
+                for y in range(size)]
+            results = []
+            for engine in ('pathfinding', self.engine):
+                cube_grid = MakeCartesianGrid(grid, 6, storage=self.storage)
+                results.append(flood_statistics(
+                    simulate_flood(cube_grid.cubes, engine)))
+            self.assertEqual(results[0], results[1])
+
+class TestCompactLevelSweep(TestLevelSweep):
+
+    storage = 'compact'
+
+class TestContinuous(Test1):
+
+    continuous = True
+
+    def test_large_and_float_heights(self):
+        chessboard = [
+            [30000,30000,30000,30000],
+            [30000,    0,12500,20000],
+            [30000,30000,30000,30000]
+        ]
+        total_flooding, max_water_level = full_simulation(chessboard, 
+            continuous=True)
+        self.assertEqual((total_flooding, max_water_level), (27500, 20000))
+
+        surface = flood_surface([
+            [2.5,2.5,2.5,2.5],
+            [2.5,0.25,1.0,2.5],
+            [2.5,2.5,1.75,2.5],
+            [2.5,2.5,2.5,2.5]
+        ])
+        self.assertEqual(surface.depth(1, 1), 2.25)
+        self.assertEqual(surface.depth(2, 2), 0.75)
+        self.assertEqual(flood_statistics(surface), (4.5, 2.5))
+        self.assertEqual(flood_statistics(surface, 'total'), 4.5)
+
+class TestTiledFlood(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'board.npy')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_in_memory(self):
+        rng = random.Random(7)
+        for trial in range(40):
+            length, width = rng.randint(1, 20), rng.randint(1, 20)
+            grid = [[rng.randint(0, 9) for x in range(length)] 
+                for y in range(width)]
+            floodio.write_npy(self.path, grid)
+            with floodio.open_npy(self.path) as raster:
+                self.assertEqual(floodtiles.tiled_flood(raster, 
+                    rng.randint(1, 8)), flood_statistics(flood_surface(grid)))
+
+    def test_float_raw_raster(self):
+        grid = [[height / 4 for height in row] for row in 
+            [[9,9,9,9,9],[9,1,6,2,9],[9,9,9,3,9],[9,9,9,9,9]]]
+        floodio.write_npy(self.path, grid, '<f4')
+        dtype, shape, offset = floodio.read_npy_header(self.path)
+        with floodio.open_raw(self.path, 5, 4, '<f4', offset) as raster:
+            self.assertEqual(floodtiles.tiled_flood(raster, 2), 
+                flood_statistics(flood_surface(grid)))
+
+    def test_nodata_drains(self):
+        # The pit drains into the square without data next to it
+        path = os.path.join(self.directory.name, 'parcel.asc')
+        floodio.write_raster(path, [[9,9,9,9], [9,0,-9999,9], [9,9,9,9]], 
+            4, 3, nodata=-9999)
+        with floodio.open_heights(path) as raster:
+            self.assertEqual(floodtiles.tiled_flood(raster, 2), (0, 0))
+        rows = [[-9999 if (x*y) % 7 == 3 else height for x, height 
+            in enumerate(row)] for y, row 
+            in enumerate(floodterrain.make_terrain('noise', 15, 11, 9, 4))]
+        floodio.write_raster(path, rows, 15, 11, nodata=-9999)
+        expected = flood_statistics(flood_surface([[NODATA if height == -9999
+            else height for height in row] for row in rows]))
+        self.assertGreater(expected[0], 0)
+        for tile_size in (2, 4, 16):
+            with floodio.open_heights(path) as raster:
+                self.assertEqual(floodtiles.tiled_flood(raster, tile_size), 
+                    expected)
+
+    def test_spill_graph_of_watersheds(self):
+        # Perimeter squares flooded from a lower one share its label, and
+        # each tile only adds its spanning forest of spills
+        grid = floodterrain.make_terrain('fractal', 64, 64, 50, 2)
+        heights = [height for row in grid for height in row]
+        graph = (array('q'), array('q'), array('q'))
+        next_label = 1
+        for bounds in floodtiles.tile_bounds(64, 64, 16):
+            x0, y0, x1, y1 = bounds
+            window = [heights[y*64+x] for y in range(y0, y1) 
+                for x in range(x0, x1)]
+            levels, labels, spills, last_label = floodtiles.flood_tile(
+                window, bounds, 64, 64, next_label)
+            self.assertLess(last_label-next_label, 
+                floodtiles.perimeter_size(bounds)//2)
+            edges = len(graph[0])
+            floodtiles.add_spanning_spills(spills, graph)
+            self.assertLess(len(graph[0])-edges, 
+                len({label for pair in spills for label in pair}))
+            next_label = last_label
+        floodio.write_npy(self.path, grid)
+        with floodio.open_npy(self.path) as raster:
+            self.assertEqual(floodtiles.tiled_flood(raster, 16),
+                flood_statistics(flood_surface(grid)))
+
+class TestParallelFlood(Test1):
+
+    engine = 'priority_flood'
+    workers = 2
+
+    def test_matches_serial(self):
+        rng = random.Random(11)
+        for trial in range(10):
+            length, width = rng.randint(1, 30), rng.randint(1, 30)
+            heights = [rng.choice([rng.randint(0, 9), rng.random()*9]) 
+                for i in range(length*width)]
+            self.assertEqual(floodtiles.parallel_flood_levels(heights, length,
+                width, self.workers, rng.randint(1, 8)),
+                priority_flood_levels(heights, length, width))
+
+    def test_serial_engines_refuse_workers(self):
+        cube_grid = MakeCartesianGrid([[1,1,1],[1,0,1],[1,1,1]], 1)
+        with self.assertRaises(ValueError):
+            simulate_flood(cube_grid.cubes, 'pathfinding', self.workers)
+
+class TestSimulateMany(unittest.TestCase):
+
+    def test_matches_flood_statistics(self):
+        rng = random.Random(13)
+        shapes = [(rng.choice([1, 4, 8]), rng.choice([2, 8])) 
+            for i in range(200)]
+        boards = [[[rng.randint(0, 9) for x in range(length)]
+            for y in range(width)] for length, width in shapes]
+        boards.append([[2.5,2.5,2.5],[2.5,1.0,2.5],[2.5,2.5,2.5]])
+        expected = [flood_statistics(flood_surface(board)) for board in boards]
+        self.assertEqual(simulate_many(boards), expected)
+        self.assertEqual(simulate_many(boards, workers=2, chunk_size=16), 
+            expected)
+
+    def test_batch_json_lines(self):
+        lines = [
+            json.dumps([[3,3,3],[3,0,3],[3,3,3]]),
+            '',
+            json.dumps({'id': 'ragged', 'grid': [[3,3,3],[3,0],[3,3,3,9]]}),
+        ]
+        output = io.StringIO()
+        run_batch(io.StringIO('\n'.join(lines)), output)
+        self.assertEqual([json.loads(line) for line in 
+            output.getvalue().splitlines()], [
+            {'total_flooding': 3, 'max_water_level': 3},
+            {'id': 'ragged', 'total_flooding': 0, 'max_water_level': 0},
+        ])
+
+class TestFloodModel(unittest.TestCase):
+
+    def test_berm_and_channel(self):
+        chessboard = [
+            [5,5,5,5,5],
+            [5,0,0,0,5],
+            [5,0,0,0,5],
+            [5,5,2,5,5]
+        ]
+        model = FloodModel(chessboard)
+        self.assertEqual(model.statistics(), (12, 2))
+        # Raising the berm holds water up to the lowest remaining wall
+        self.assertEqual(model.set_height(2, 3, 5), (30, 5))
+        # Cutting a channel to the edge drains the whole basin
+        self.assertEqual(model.set_heights([(4, 1, 0), (3, 1, 0)]), (0, 0))
+        self.assertEqual(model.depth(1, 2), 0)
+
+    def test_edits_match_full_solve(self):
+        rng = random.Random(17)
+        for trial in range(40):
+            length, width = rng.randint(1, 10), rng.randint(1, 10)
+            grid = [[rng.randint(0, 6) for x in range(length)] 
+                for y in range(width)]
+            model = FloodModel(grid)
+            for edit in range(20):
+                x, y = rng.randrange(length), rng.randrange(width)
+                grid[y][x] = rng.randint(0, 6)
+                statistics = model.set_height(x, y, grid[y][x])
+                surface = flood_surface(grid)
+                self.assertEqual(model.levels, surface.levels)
+                self.assertEqual(statistics, flood_statistics(surface))
+
+class TestFloodCache(unittest.TestCase):
+
+    def test_rotations_and_mirrors_share_a_key(self):
+        grid = [[1,2,3],[4,5,6]]
+        keys = {floodcache.board_key(symmetry) 
+            for symmetry in floodcache.board_symmetries(grid)}
+        self.assertEqual(len(keys), 1)
+        self.assertNotEqual(keys.pop(), floodcache.board_key([[1,2,3],[4,6,5]]))
+
+    def test_memory_and_disk_tiers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            with floodcache.FloodCache(max_entries=1, path=path) as cache:
+                chessboard = [[3,3,3,3],[3,0,1,3],[3,3,3,3]]
+                self.assertEqual(full_simulation(chessboard, cache=cache), 
+                    (5, 3))
+                # The mirror image of a cached board is a hit
+                self.assertEqual(full_simulation([[3,3,3,3],[3,1,0,3],
+                    [3,3,3,3]], cache=cache), (5, 3))
+                cache.put([[1]], (0, 0))
+                self.assertEqual(len(cache), 1)
+                self.assertEqual(cache.counters(), {'hits': 1, 
+                    'memory_hits': 1, 'disk_hits': 0, 'misses': 1, 
+                    'entries': 1})
+            # A new cache on the same file survives the restart
+            with floodcache.FloodCache(path=path) as cache:
+                self.assertEqual(cache.get([[3,3,3],[3,1,3],[3,0,3],[3,3,3]]),
+                    (5, 3))
+                self.assertEqual(cache.disk_hits, 1)
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_boards_are_seeded_and_agree(self):
+        for terrain in floodbench.TERRAIN_TYPES:
+            board = floodbench.make_board(terrain, 12, 10)
+            self.assertEqual(board, floodbench.make_board(terrain, 12, 10))
+            results = {floodbench.flood_board(board, mode) 
+                for mode in floodbench.BENCHMARK_MODES}
+            self.assertEqual(len(results), 1)
+
+    def test_regression_gate(self):
+        results = floodbench.run_benchmarks(sizes=[8], heights=[10], 
+            terrains=['maze'], modes=['level_sweep', 'continuous'], repeat=1)
+        self.assertEqual(len(results), 2)
+        # Continuous mode builds no cubes, and is rated in squares
+        level_sweep, continuous = results
+        self.assertEqual((level_sweep['squares'], level_sweep['cubes']), 
+            (64, 640))
+        self.assertGreater(level_sweep['cubes_per_second'], 
+            level_sweep['squares_per_second'])
+        self.assertEqual((continuous['squares'], continuous['cubes'], 
+            continuous['cubes_per_second']), (64, None, None))
+        self.assertGreater(continuous['squares_per_second'], 0)
+        self.assertEqual(floodbench.compare_results(results, results), [])
+        slower = [dict(record, seconds=1.0) for record in results]
+        baseline = [dict(record, seconds=0.5, 
+            total_flooding=record['total_flooding']+1) for record in results]
+        self.assertEqual(len(floodbench.compare_results(slower, baseline)), 4)
+        # Changed statistics are regressions whatever the threshold
+        self.assertEqual(len(floodbench.compare_results(slower, baseline, 
+            threshold=1)), 2)
+
+class TestFloodProfile(unittest.TestCase):
+
+    def test_profile_of_pathfinding(self):
+        chessboard = [[1,3,3,3],[3,0,1,3],[3,1,0,3],[3,3,3,3]]
+        result = full_simulation(chessboard, engine='pathfinding')
+        self.assertEqual(result, (10, 3))
+        self.assertIsNone(result.profile)
+        result = full_simulation(chessboard, engine='pathfinding', 
+            profile=True)
+        profile = result.profile.as_dict()
+        self.assertEqual(result, (10, 3))
+        self.assertEqual(list(profile['phases']), 
+            ['prepare', 'extrude', 'simulate', 'print', 'statistics'])
+        self.assertEqual(len(profile['levels']), 3)
+        self.assertEqual(profile['searches'], 
+            sum(profile['search_exits'].values()))
+        self.assertEqual(profile['edge_drains'], 2)
+        json.dumps(profile)
+
+    def test_profile_of_level_sweep(self):
+        result = full_simulation([[2,2,2],[2,0,2],[2,2,2]], 
+            engine='level_sweep', storage='compact', profile=True)
+        self.assertEqual(len(result.profile.levels), 2)
+        self.assertEqual(result.profile.searches, 0)
+
+class TestOutputModes(unittest.TestCase):
+
+    chessboard = [[2,2,2],[2,0,2],[2,2,2]]
+
+    def test_import_has_no_side_effects(self):
+        # Arguments meant for another program must not reach the parser
+        completed = subprocess.run([sys.executable, '-c', 
+            'import topographyfloodsim', '--not-an-argument'], 
+            capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(completed.returncode, 0)
+        self.assertEqual(completed.stdout, b'')
+
+    def test_output_modes(self):
+        for storage in ('objects', 'compact'):
+            stream = io.StringIO()
+            full_simulation(self.chessboard, storage=storage, stream=stream)
+            self.assertEqual(stream.getvalue(), 
+                "Your custom topography grid is:\n" +
+                "| 2| 2| 2|\n| 2| 0| 2|\n| 2| 2| 2|\n" +
+                "Length 3, Width 3, Height 2\n" +
+                "|1|1| |1|1| |1|1| \n|1|1| |2|2| |1|1| \n|1|1| |1|1| |1|1| \n" +
+                "Total flooding is 2 cubes.\nMax water level is 2.\n")
+
+        stream = io.StringIO()
+        full_simulation(self.chessboard, output='summary', stream=stream)
+        self.assertEqual(stream.getvalue(), 
+            "Total flooding is 2 cubes.\nMax water level is 2.\n")
+
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            result = full_simulation(self.chessboard, output='none')
+        self.assertEqual(result, (2, 2))
+        self.assertEqual(printed.getvalue(), '')
+        with self.assertRaises(ValueError):
+            full_simulation(self.chessboard, output='loud')
+
+class TestRasterFormats(unittest.TestCase):
+
+    grid = [[5,5,5,5,5],[5,1,2,0,5],[5,5,5,3,5],[5,5,5,5,5]]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        heights = [height for row in self.grid for height in row]
+        self.paths = {}
+        for name, data in (
+            ('board.bil', struct.pack('<20h', *heights)),
+            ('board.pgm', b'P5\n# 16 bits\n5 4\n1000\n' + 
+                struct.pack('>20H', *heights)),
+            ('board8.pgm', b'P5 5 4 255\n' + bytes(heights)),
+            ('board.raw', struct.pack('<20h', *heights)),
+            ('board.hdr', b'BYTEORDER I\nNROWS 4\nNCOLS 5\nNBITS 16\n' +
+                b'PIXELTYPE SIGNEDINT\nNODATA -9999\n'),
+            ('board.asc', b'ncols 5\nnrows 4\nxllcorner 0\nyllcorner 0\n' +
+                b'cellsize 1\nNODATA_value -9999\n' + '\n'.join(' '.join(
+                map(str, row)) for row in self.grid).encode()),
+            ):
+            self.paths[name] = os.path.join(self.directory.name, name)
+            with open(self.paths[name], 'wb') as raster_file:
+                raster_file.write(data)
+        self.paths['board.npy'] = os.path.join(self.directory.name, 
+            'board.npy')
+        floodio.write_npy(self.paths['board.npy'], self.grid)
+        # Headerless raw files need their shape
+        os.rename(self.paths['board.raw'], 
+            os.path.join(self.directory.name, 'plain.raw'))
+        self.paths['board.raw'] = os.path.join(self.directory.name, 
+            'plain.raw')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_every_format_floods_alike(self):
+        for name, path in self.paths.items():
+            if name == 'board.hdr':
+                continue
+            with floodio.open_heights(path, 5, 4) as raster:
+                self.assertEqual(raster.rows(), self.grid)
+                self.assertEqual(full_simulation(raster, continuous=True,
+                    output='none'), (14, 5))
+                self.assertEqual(full_simulation(raster, 
+                    engine='priority_flood', output='none'), (14, 5))
+                self.assertEqual(floodtiles.tiled_flood(raster, 2), (14, 5))
+            
+    def test_binary_rasters_are_not_copied(self):
+        with floodio.open_heights(self.paths['board.npy']) as raster:
+            self.assertIsInstance(raster.flat(), memoryview)
+        with floodio.open_heights(self.paths['board.bil']) as raster:
+            self.assertIsInstance(raster.flat(), memoryview)
+            self.assertEqual(raster.nodata, -9999)
+
+    def test_float_ascii_grid(self):
+        path = os.path.join(self.directory.name, 'float.asc')
+        with open(path, 'w') as asc_file:
+            asc_file.write('ncols 3\nnrows 3\nxllcorner 0\nyllcorner 0\n' +
+                'cellsize 1\n2 2 2\n2 0.5 2\n2 2 2\n')
+        with floodio.open_heights(path) as raster:
+            self.assertTrue(raster.floating)
+            self.assertEqual(flood_statistics(flood_surface(raster)), 
+                (1.5, 2.0))
+
+class TestTerrain(unittest.TestCase):
+
+    def test_terrains_are_seeded(self):
+        for terrain in floodterrain.TERRAIN_TYPES:
+            for length, width, max_height in ((1,1,0), (7,3,10), (40,33,300)):
+                board = floodterrain.make_terrain(terrain, length, width, 
+                    max_height, seed=5)
+                self.assertEqual(board, floodterrain.make_terrain(terrain, 
+                    length, width, max_height, seed=5))
+                self.assertEqual(len(board), width)
+                for row in board:
+                    self.assertEqual(len(row), length)
+                    self.assertTrue(0 <= min(row) <= max(row) <= max_height)
+        self.assertNotEqual(floodterrain.make_terrain('noise', 9, 9, 9, 1),
+            floodterrain.make_terrain('noise', 9, 9, 9, 2))
+        self.assertEqual(full_simulation(length=9, width=9, max_height=9, 
+            terrain='bowl', seed=1, output='none'), full_simulation(
+            floodterrain.make_terrain('bowl', 9, 9, 9, 1), output='none'))
+
+    @unittest.skipUnless(hasattr(random.Random, 'randbytes'), 
+        'random.Random.randbytes needs Python 3.9')
+    def test_random_bytes_match_randbytes(self):
+        # Boards of a seed are the same on every version of Python
+        for size in (0, 1, 7, 300):
+            self.assertEqual(floodterrain.random_bytes(random.Random(4), size),
+                random.Random(4).randbytes(size))
+
+    def test_written_terrain_reads_back(self):
+        board = floodterrain.make_terrain('basins', 21, 13, 250, seed=2)
+        with tempfile.TemporaryDirectory() as directory:
+            for extension in ('npy', 'bil', 'pgm', 'asc', 'raw'):
+                path = os.path.join(directory, 'terrain.' + extension)
+                floodterrain.write_terrain(path, 'basins', 21, 13, 250, 
+                    seed=2)
+                with floodio.open_heights(path, 21, 13) as raster:
+                    self.assertEqual(raster.rows(), board)
+
+class TestFloodServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.directory.name, 'flood.sock')
+        self.server = floodserver.FloodServer(self.address, workers=1)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), 
+            self.loop).result()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.close(), 
+            self.loop).result()
+        asyncio.run_coroutine_threadsafe(self.finish_connections(), 
+            self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.directory.cleanup()
+
+    async def finish_connections(self):
+        # The connections of the clients which left send their last replies
+        # before the loop stops
+        await asyncio.gather(*(asyncio.all_tasks() - 
+            {asyncio.current_task()}), return_exceptions=True)
+
+    def test_matches_simulate_many(self):
+        boards = [floodterrain.make_terrain('basins', 9, 7, 20, seed) 
+            for seed in range(300)]
+        expected = simulate_many([[list(row) for row in board] 
+            for board in boards])
+        with floodserver.FloodClient(self.address) as client:
+            self.assertEqual(client.simulate_many(boards), expected)
+            self.assertEqual(client.simulate([[2,2,2],[2,0,2],[2,2,2]]), 
+                (2, 2))
+            with self.assertRaises(ValueError):
+                client.simulate([])
+            with self.assertRaises(ValueError):
+                client.simulate([[1,'a'],[2,3]])
+            # The connection outlives bad requests
+            self.assertEqual(client.simulate([[1,1,1],[1,0,1],[1,1,1]]), 
+                (1, 1))
+        # Boards sent ahead of their replies share batches
+        self.assertEqual(self.server.requests, 303)
+        self.assertLess(self.server.batches, self.server.requests)
+        self.assertEqual(floodserver.remote_simulation([[3,3,3],[3,0,3],
+            [3,3,3]], self.address), (3, 3))
+        floodserver.CLIENTS.pop(self.address).close()
+
+    def test_close_cancels_waiting_boards(self):
+        board = floodterrain.make_terrain('noise', 60, 60, 30, 1)
+
+        async def close_busy():
+            futures = [self.server.run_chunk([board]) for i in range(20)]
+            await self.server.close()
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+        results = asyncio.run_coroutine_threadsafe(close_busy(), 
+            self.loop).result()
+        # Boards already handed to the worker finish, and those still
+        # waiting for it are cancelled
+        for result in results:
+            if not isinstance(result, asyncio.CancelledError):
+                self.assertEqual(result, simulate_many([board]))
+        self.assertIsInstance(results[-1], asyncio.CancelledError)
+        self.assertFalse(self.server.pending)
+
+    def test_recovers_from_dead_worker(self):
+        with floodserver.FloodClient(self.address) as client:
+            self.assertEqual(client.simulate([[2,2,2],[2,0,2],[2,2,2]]), 
+                (2, 2))
+            # A worker killed as if it ran out of memory fails the boards
+            # in flight, and a fresh pool floods the next ones
+            for pid in list(self.server.pool._processes):
+                os.kill(pid, signal.SIGKILL)
+            with self.assertRaises(ValueError):
+                client.simulate([[3,3,3],[3,0,3],[3,3,3]])
+            self.assertEqual(client.simulate([[3,3,3],[3,0,3],[3,3,3]]), 
+                (3, 3))
+
+class TestBasinIndex(unittest.TestCase):
+
+    def test_two_ponds(self):
+        chessboard = [
+            [5,5,5,5,5,5,5],
+            [5,1,2,5,0,0,5],
+            [5,1,5,5,0,0,4],
+            [5,5,5,5,5,5,5],
+        ]
+        basins = flood_basins(chessboard)
+        self.assertEqual(len(basins), 2)
+        pond, puddle = basins.largest()
+        self.assertEqual(pond, (basins.basin_id(4, 1), 4, (6, 2), 4, 16))
+        self.assertEqual(puddle, (basins.basin_id(1, 2), 5, (1, 0), 3, 11))
+        self.assertEqual(basins.basin_at(2, 2), None)
+        self.assertEqual(basins.basin_at(5, 2), pond)
+        self.assertEqual(basins.largest(1), [pond])
+
+        stream = io.StringIO()
+        result = full_simulation(chessboard, engine='level_sweep', 
+            output='summary', basins=1, stream=stream)
+        self.assertEqual(result.basins.largest(), [pond, puddle])
+        self.assertEqual(stream.getvalue().splitlines()[-1], 
+            f"Basin {pond.basin_id} holds 16 cubes over 4 squares, and " +
+            "spills at 4 over square 6, 2.")
+
+    def test_basins_add_up(self):
+        rng = random.Random(19)
+        for trial in range(40):
+            grid = [[rng.randint(0, 5) for x in range(rng.randint(1, 10))]]
+            grid += [[rng.randint(0, 5) for x in grid[0]] 
+                for y in range(rng.randint(0, 9))]
+            surface = flood_surface(grid, basins=True)
+            basins = surface.basins
+            self.assertEqual(sum(basin.volume for basin in basins), 
+                flood_statistics(surface)[0])
+            for basin in basins:
+                squares = [(x, y) for y in range(len(grid)) 
+                    for x in range(len(grid[0])) 
+                    if basins.basin_id(x, y) == basin.basin_id]
+                self.assertEqual(len(squares), basin.area)
+                # Every square of a basin stands under the same surface,
+                # and it spills over a neighbouring square of that height
+                self.assertEqual({surface.water_level(x, y) 
+                    for x, y in squares}, {basin.spill_elevation})
+                x, y = basin.spill_point
+                self.assertEqual(grid[y][x], basin.spill_elevation)
+                self.assertIn(1, [abs(x-sx)+abs(y-sy) for sx, sy in squares])
+
+class TestFillSpillTree(unittest.TestCase):
+
+    def test_spill_into_neighbour(self):
+        # The pond on the left fills first and spills into the right one,
+        # then both merge into a lake spilling off the board at 6
+        tree = floodspill.FillSpillTree([
+            [9,9,9,9,9,9],
+            [9,2,4,0,0,6],
+            [9,9,9,9,9,9],
+        ])
+        self.assertEqual(tree.capacities[1:], [8, 2, 18])
+        self.assertEqual(tree.fill_depths[1:], [2.5, 2, 4.5])
+        self.assertEqual(tree.lakes(2.25), [(1, 7, 3.5), (2, 2, 4)])
+        self.assertEqual(tree.lakes(3), [(3, 12, 4.5)])
+        self.assertEqual(tree.water_level(2, 1, 3), 4.5)
+        self.assertEqual(tree.water_level(2, 1, 2.25), 4)
+        self.assertEqual(tree.stored_volume(1), 4)
+        self.assertEqual(tree.stored_volume(water_input=36), 8)
+        self.assertEqual(tree.stored_volume(10), 18)
+
+    def test_unlimited_rain_floods(self):
+        rng = random.Random(18)
+        for trial in range(40):
+            grid = [[rng.choice((rng.randint(0, 6), rng.random()*6))
+                for x in range(rng.randint(1, 12))]]
+            grid += [[rng.randint(0, 6) for x in grid[0]]
+                for y in range(rng.randint(0, 11))]
+            surface = flood_surface(grid)
+            tree = floodspill.FillSpillTree(grid)
+            self.assertAlmostEqual(tree.stored_volume(10**6),
+                flood_statistics(surface)[0])
+            for y in range(len(grid)):
+                for x in range(len(grid[0])):
+                    self.assertAlmostEqual(tree.water_level(x, y, 10**6),
+                        surface.water_level(x, y))
+            # Storage grows with the rain and is the water of every lake
+            stored = 0
+            for depth in range(40):
+                volume = tree.stored_volume(depth/4)
+                self.assertGreaterEqual(volume, stored - 1e-9)
+                self.assertAlmostEqual(volume, 
+                    sum(lake.volume for lake in tree.lakes(depth/4)))
+                stored = volume
+
+    def test_outside_squares_drain(self):
+        # The pond next to the squares outside the board drains into them
+        grid = [[5,5,5,5,5,5,5], [5,0,NODATA,5,1,2,5], [5,5,5,5,5,5,5]]
+        tree = floodspill.FillSpillTree(grid)
+        self.assertEqual(tree.stored_volume(10**6), 7)
+        self.assertEqual(tree.water_level(1, 1, 10**6), 0)
+        self.assertEqual(tree.water_level(4, 1, 10**6), 5)
+        self.assertIsNone(tree.water_level(2, 1, 10**6))
+        # Rain only falls on the 20 squares of the board
+        self.assertEqual(tree.stored_volume(water_input=40), 4)
+        topo_grid = floodterrain.make_terrain('noise', 12, 9, 10, 5)
+        rows = [[-9999 if (x > 6 and y > 4) or (x, y) == (3, 3) else height 
+            for x, height in enumerate(row)] 
+            for y, row in enumerate(topo_grid)]
+        grid = [[NODATA if height == -9999 else height for height in row] 
+            for row in rows]
+        surface = flood_surface([list(row) for row in grid])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'parcel.asc')
+            floodio.write_raster(path, rows, 12, 9, nodata=-9999)
+            with floodio.open_heights(path) as raster:
+                trees = [floodspill.FillSpillTree(grid), 
+                    floodspill.FillSpillTree(raster)]
+        for tree in trees:
+            self.assertEqual(tree.stored_volume(10**6), 
+                flood_statistics(surface)[0])
+            for y in range(9):
+                for x in range(12):
+                    if grid[y][x] is not NODATA:
+                        self.assertEqual(tree.water_level(x, y, 10**6),
+                            surface.water_level(x, y))
+
+    def test_water_level_of_deep_hierarchy(self):
+        # A staircase of ponds merges into a hierarchy as deep as the board
+        # is long, and the lake of a square is the highest started ancestor
+        grid = [[40]*42, [40] + [x//2 if x % 2 else 0 
+            for x in range(40)] + [40], [40]*42]
+        tree = floodspill.FillSpillTree(grid)
+        self.assertGreater(len(tree.ancestors), 4)
+        for depth in (0, 0.5, 3, 10, 40, 10**6):
+            for x in range(42):
+                depression = tree.labels[42+x]
+                if depression != floodspill.OCEAN:
+                    while tree.parents[depression] is not None and \
+                        tree.start_depths[tree.parents[depression]] <= depth:
+                        depression = tree.parents[depression]
+                    volume = tree.depression_volume(depression, depth)
+                    expected = max(grid[1][x], tree.level(depression, 
+                        volume)) if volume > 0 else grid[1][x]
+                else:
+                    expected = grid[1][x]
+                self.assertEqual(tree.water_level(x, 1, depth), expected)
+
+class KilledCheckpoint(FloodCheckpoint):
+    """
+    A FloodCheckpoint which interrupts the simulation once a number of levels
+    are finished, as if the process had been killed.
+    """
+
+    def __init__(self, path, levels, killed_level):
+        super().__init__(path, levels)
+        self.killed_level = killed_level
+
+    def level_done(self, cube_matrix, topo_grid, levels):
+        super().level_done(cube_matrix, topo_grid, levels)
+        if levels == self.killed_level:
+            raise KeyboardInterrupt
+
+class TestCheckpoint(unittest.TestCase):
+
+    def flood(self, topo_grid, engine, storage, checkpoint=None):
+        groomed_grid, max_height = groom_grid([list(row) for row in topo_grid])
+        cubes = MakeCartesianGrid(groomed_grid, max_height, 
+            storage=storage).cubes
+        simulate_flood(cubes, engine, checkpoint=checkpoint)
+        return [(cube.content, cube.drains_out) for plane in cubes 
+            for column in plane for cube in column]
+
+    def test_resume_after_kill(self):
+        topo_grid = floodterrain.make_terrain('noise', 12, 12, 20, 4)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'flood.checkpoint')
+            for engine in ('pathfinding', 'level_sweep'):
+                for storage in ('objects', 'compact', 'columns'):
+                    expected = self.flood(topo_grid, engine, storage)
+                    # Checkpoints are saved after levels 3 and 6 before the
+                    # kill, and the flood resumes from level 6
+                    with self.assertRaises(KeyboardInterrupt):
+                        self.flood(topo_grid, engine, storage, 
+                            KilledCheckpoint(path, 3, 8))
+                    checkpoint = FloodCheckpoint(path, 3, resume=True)
+                    self.assertEqual(self.flood(topo_grid, engine, storage, 
+                        checkpoint), expected)
+                    self.assertEqual(checkpoint.resumed_level, 6)
+                    os.remove(path)
+
+            # A checkpoint only resumes the board it was saved for
+            with self.assertRaises(KeyboardInterrupt):
+                self.flood(topo_grid, 'level_sweep', 'compact',
+                    KilledCheckpoint(path, 1, 1))
+            topo_grid[5][5] += 1
+            with self.assertRaises(ValueError):
+                self.flood(topo_grid, 'level_sweep', 'compact',
+                    FloodCheckpoint(path, resume=True))
+            with self.assertRaises(ValueError):
+                self.flood(topo_grid, 'priority_flood', 'compact', 
+                    FloodCheckpoint(path))
+
+class TestFloodStatistics(unittest.TestCase):
+
+    def test_counted_while_flooding(self):
+        topo_grid = floodterrain.make_terrain('basins', 10, 10, 12, 7)
+        groomed_grid, max_height = groom_grid(topo_grid)
+        for engine in ('pathfinding', 'level_sweep', 'priority_flood'):
+            for storage in ('objects', 'compact', 'columns'):
+                cubes = MakeCartesianGrid(groomed_grid, max_height, 
+                    storage=storage).cubes
+                statistics = FloodStatistics(10, 10, max_height)
+                simulate_flood(cubes, engine, statistics=statistics)
+                # The counts equal those of a scan of every cube
+                water = [(x, y, z) for x in range(10) for y in range(10) 
+                    for z in range(max_height) 
+                    if cubes[x][y][z].content == 2]
+                self.assertEqual((statistics.total_flooding, 
+                    statistics.max_water_level), flood_statistics(cubes))
+                self.assertEqual(statistics.level_counts, [sum(1 for cube 
+                    in water if cube[2] == z) for z in range(max_height)])
+                self.assertEqual(statistics.wet_area, 
+                    len({(x, y) for x, y, z in water}))
+
+        result = full_simulation(topo_grid, engine='level_sweep', 
+            storage='compact', output='none')
+        self.assertEqual(result, (statistics.total_flooding,
+            statistics.max_water_level))
+        self.assertEqual(result.statistics.as_dict(), statistics.as_dict())
+
+    def test_counted_when_resumed(self):
+        topo_grid = floodterrain.make_terrain('noise', 12, 12, 20, 4)
+        groomed_grid, max_height = groom_grid(topo_grid)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'flood.checkpoint')
+            with self.assertRaises(KeyboardInterrupt):
+                simulate_flood(MakeCartesianGrid(groomed_grid, max_height, 
+                    storage='compact').cubes, 'level_sweep', 
+                    checkpoint=KilledCheckpoint(path, 3, 8))
+            cubes = MakeCartesianGrid(groomed_grid, max_height, 
+                storage='compact').cubes
+            statistics = FloodStatistics(12, 12, max_height)
+            simulate_flood(cubes, 'level_sweep', statistics=statistics,
+                checkpoint=FloodCheckpoint(path, 3, resume=True))
+        self.assertEqual((statistics.total_flooding, 
+            statistics.max_water_level), flood_statistics(cubes))
+
+class TestExport(unittest.TestCase):
+
+    def load(self, *args, **kwargs):
+        # Rasters are loaded as NumPy arrays when NumPy is installed
+        raster = floodio.load_raster(*args, **kwargs)
+        return raster if numpy is None else raster.tolist()
+
+    def test_depth_and_surfaces(self):
+        topo_grid = floodterrain.make_terrain('basins', 9, 7, 10, 2)
+        groomed_grid, max_height = groom_grid(topo_grid)
+        surface = flood_surface(topo_grid)
+        depths = [[level-height for height, level in zip(
+            surface.heights[y*9:(y+1)*9], surface.levels[y*9:(y+1)*9])] 
+            for y in range(7)]
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in ('objects', 'compact', 'columns'):
+                cubes = MakeCartesianGrid(groomed_grid, max_height, 
+                    storage=storage).cubes
+                simulate_flood(cubes, 'level_sweep')
+                for extension in ('npy', 'asc', 'raw'):
+                    path = os.path.join(directory, 'depth.' + extension)
+                    export_flood(path, cubes)
+                    self.assertEqual(self.load(path, 9, 7, '<f4'),
+                        depths)
+
+            # Both surfaces of a FloodSurface go to one .npz file
+            path = os.path.join(directory, 'surfaces.npz')
+            export_flood(path, surface, dtype='<i4')
+            self.assertEqual(self.load(path, name='board'), 
+                [list(surface.heights[y*9:(y+1)*9]) for y in range(7)])
+            self.assertEqual(self.load(path, name='water'), 
+                [list(surface.levels[y*9:(y+1)*9]) for y in range(7)])
+
+    @unittest.skipUnless(numpy, 'NumPy is not installed')
+    def test_numpy_arrays(self):
+        rows = [[3*x-y for x in range(5)] for y in range(4)]
+        with tempfile.TemporaryDirectory() as directory:
+            for name, dtype in (('board.npy', '<i2'), ('board.asc', None),
+                ('board.raw', '<f4'), ('board.npz', '>i4')):
+                path = os.path.join(directory, name)
+                if name.endswith('.npz'):
+                    floodio.write_npz(path, {'board': rows}, 5, 4, dtype)
+                else:
+                    floodio.write_raster(path, rows, 5, 4, dtype or '<i2')
+                raster = floodio.load_raster(path, 5, 4, dtype or '<i2')
+                self.assertEqual(raster.shape, (4, 5))
+                if dtype is None:
+                    self.assertEqual(raster.dtype.kind, 'i')
+                else:
+                    self.assertEqual(raster.dtype, numpy.dtype(dtype))
+                self.assertEqual(raster.tolist(), rows)
+                # The array is the caller's own to change
+                raster[1, 2] += 1
+                self.assertEqual(raster[1, 2], rows[1][2]+1)
+
+class TestNodata(unittest.TestCase):
+
+    def test_outside_squares_drain(self):
+        # The pit next to the short last row drains into the padding
+        board = [[5,5,5,5,5], [5,0,5,0,5], [5,5,5]]
+        self.assertEqual(full_simulation(board, output='none'), (5, 5))
+        self.assertEqual(board[2], [5,5,5,NODATA,NODATA])
+        self.assertEqual(simulate_many([[[5,5,5,5,5], [5,0,5,0,5], 
+            [5,5,5]]]), [(5, 5)])
+
+    def test_engines_agree(self):
+        topo_grid = floodterrain.make_terrain('noise', 12, 9, 10, 5)
+        for y in range(9):
+            for x in range(12):
+                if (x > 6 and y > 4) or (x, y) in ((3, 3), (9, 1)):
+                    topo_grid[y][x] = NODATA
+        groomed_grid, max_height = groom_grid(topo_grid)
+        expected = flood_surface(groomed_grid).statistics()
+        self.assertGreater(expected[0], 0)
+        for engine in ('pathfinding', 'level_sweep', 'priority_flood'):
+            for storage in ('objects', 'compact', 'columns'):
+                cubes = MakeCartesianGrid(groomed_grid, max_height, 
+                    storage=storage).cubes
+                self.assertIsNone(cubes[3][3])
+                simulate_flood(cubes, engine)
+                self.assertEqual(flood_statistics(cubes), expected)
+        # Only the columns inside the board are stored
+        cubes = MakeCartesianGrid(groomed_grid, max_height, 
+            storage='compact').cubes
+        self.assertEqual(len(cubes.content), (108-22)*max_height)
+        self.assertEqual(cubes[11][0][2].coords, (11, 0, 2))
+
+    def test_raster_nodata(self):
+        topo_grid = floodterrain.make_terrain('basins', 10, 8, 9, 3)
+        rows = [[-9999 if x+y > 12 else height for x, height 
+            in enumerate(row)] for y, row in enumerate(topo_grid)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'parcel.asc')
+            floodio.write_raster(path, rows, 10, 8, nodata=-9999)
+            with floodio.open_heights(path) as raster:
+                continuous = full_simulation(raster, continuous=True, 
+                    output='none')
+            with floodio.open_heights(path) as raster:
+                cubes = full_simulation(raster, engine='level_sweep', 
+                    output='none')
+        self.assertEqual(continuous, cubes)
+        self.assertEqual(cubes, full_simulation([[NODATA if height == -9999
+            else height for height in row] for row in rows], output='none'))
+
+class TestCompactStorage(Test1):
+
+    storage = 'compact'
+
+    def test_voxel_views(self):
+        cube_grid = MakeCartesianGrid([[2,0,1],[0,3,1]], 3, storage='compact')
+        cubes = cube_grid.cubes
+        self.assertIsInstance(cubes, VoxelStore)
+        self.assertEqual((len(cubes), len(cubes[0]), len(cubes[0][0])), 
+            (3, 2, 3))
+        self.assertEqual([cube.content for cube in cubes[1][1]], [1,1,1])
+        self.assertEqual([cube.content for cube in cubes[0][0]], [1,1,0])
+        self.assertEqual(cubes[2][1][-1].coords, (2,1,2))
+        # drains_out flags are independent bits of the packed plane
+        cubes[0][1][2].drains_out = True
+        self.assertTrue(cubes[0][1][2].drains_out)
+        self.assertFalse(cubes[0][1][1].drains_out)
+        cubes[0][1][2].drains_out = False
+        self.assertFalse(cubes[0][1][2].drains_out)
+        cubes[1][0][2].content = 2
+        self.assertEqual(cubes.content.count(2), 1)
+
+class TestCompactPriorityFlood(TestPriorityFlood):
+
+    storage = 'compact'
+
+class TestColumnStorage(Test1):
+
+    storage = 'columns'
+
+    def test_column_runs(self):
+        grid = [[3,3,3,3],[3,0,1,3],[3,3,3,3]]
+        cubes = MakeCartesianGrid(grid, 3, storage='columns').cubes
+        self.assertIsInstance(cubes, ColumnStore)
+        simulate_flood(cubes, 'level_sweep')
+        self.assertEqual(list(cubes.columns())[4], (1, 1, 0, 3))
+        self.assertEqual([cubes.content_at(2, 1, z) for z in range(3)], 
+            [1,2,2])
+        self.assertEqual([cube.content for cube in cubes[2][1]], [1,2,2])
+        self.assertEqual(flood_statistics(cubes), (5, 3))
+        # The voxel view holds the same cubes
+        voxels = cubes.expand()
+        self.assertIsInstance(voxels, VoxelStore)
+        self.assertEqual(flood_statistics(voxels), (5, 3))
+        self.assertEqual([cube.content for cube in voxels[1][1]], [2,2,2])
+        # Water cannot float above air
+        with self.assertRaises(ValueError):
+            cubes[0][0][2].content = 2
+
+class TestColumnPriorityFlood(TestPriorityFlood):
+
+    storage = 'columns'
+
+class TestColumnLevelSweep(TestLevelSweep):
+
+    storage = 'columns'
+
 unittest.main()  # Calling from the command
\ No newline at end of file
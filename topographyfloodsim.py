@@ -1,21 +1,64 @@
 #!/usr/bin/env Python
 
+import os
 import sys
+import zlib
 import argparse
 import time
-import random
-from itertools import count
+import heapq
+import math
+import json
+import operator
+import multiprocessing
+from array import array
+from itertools import count, accumulate, compress, repeat, chain
+from collections import namedtuple
+
+import floodio
+import floodterrain
+import floodtiles
+import floodcache
 
 # Default dimensions if no grid length / width / height specified
 DEFAULT_LENGTH, DEFAULT_WIDTH, DEFAULT_MAX_HEIGHT = 8, 8, 10 
 # Descriptive key for 3D cube contents
 CONTENT_AIR, CONTENT_BOARD, CONTENT_WATER = 0, 1, 2
+# Translation of content bytes into the digits printed by print_cube_grid()
+CONTENT_DIGITS = bytes.maketrans(b'\x00\x01\x02', b'012')
+# Flood engines selectable through simulate_flood() and the --engine argument
+ENGINE_PATHFINDING, ENGINE_PRIORITY_FLOOD = 'pathfinding', 'priority_flood'
+ENGINE_LEVEL_SWEEP = 'level_sweep'
+DEFAULT_ENGINE = ENGINE_PATHFINDING
+# Cube storage backends of MakeCartesianGrid and the --storage argument
+STORAGE_OBJECTS, STORAGE_COMPACT = 'objects', 'compact'
+STORAGE_COLUMNS = 'columns'
+DEFAULT_STORAGE = STORAGE_OBJECTS
+# Number of boards handed to a worker process at a time by simulate_many()
+DEFAULT_BATCH_CHUNK = 2000
+# How the drain() searches of the pathfinding engine end, as profiled
+SEARCH_DRAINS_OUT, SEARCH_EDGE = 'drains_out', 'edge'
+SEARCH_WATER, SEARCH_ENCLOSED = 'water', 'enclosed'
+# What full_simulation() and the --output argument write: nothing, only the
+# flood statistics, or the grids as well
+OUTPUT_NONE, OUTPUT_SUMMARY, OUTPUT_FULL = 'none', 'summary', 'full'
+DEFAULT_OUTPUT = OUTPUT_FULL
+# First line of a checkpoint file of the level engines, and the seconds
+# between checkpoints when no interval is given
+CHECKPOINT_MAGIC = b'TOPOGRAPHYFLOODSIM CHECKPOINT 1\n'
+DEFAULT_CHECKPOINT_SECONDS = 600
+# Height of the squares outside the board, such as the padding of short rows
+# or the nodata squares of a raster, which hold no cubes and drain like the
+# edges of the board
+NODATA = None
+# Value written by export_flood() for the squares outside the board
+EXPORT_NODATA = -9999
 
 '''
 The argument parser is used if the user wishes to generate random grids
 without passing a user-defined grid through the program.
 The user may specify any of the following: length, width, and/or maximum 
-height of the "topography" to be generated.
+height of the "topography" to be generated. The arguments are only parsed
+when the script is run, so that importing this module has no side effects.
 '''
 parser = argparse.ArgumentParser(description='Pass arguments for random grid \
                     generation')
@@ -28,7 +71,89 @@ parser.add_argument('-w','--width', dest='grid_width', metavar='grid width',
 parser.add_argument('--mh','--max-height', dest='max_height', 
                     metavar='maximum height', type=int, default=None, 
                     help='maximum height of random topography grid')
-args = parser.parse_args() 
+parser.add_argument('--terrain', dest='terrain', metavar='terrain type',
+                    choices=list(floodterrain.TERRAIN_TYPES),
+                    default=None, help='terrain of random topography grid: ' +
+                    ', '.join(floodterrain.TERRAIN_TYPES) + f' (default \
+                    {floodterrain.DEFAULT_TERRAIN})')
+parser.add_argument('--seed', dest='seed', metavar='seed', type=int,
+                    default=None, help='seed of random topography grid, \
+                    which is different on every run without one')
+parser.add_argument('--engine', dest='engine', metavar='flood engine',
+                    choices=[ENGINE_PATHFINDING, ENGINE_PRIORITY_FLOOD,
+                    ENGINE_LEVEL_SWEEP], default=DEFAULT_ENGINE, 
+                    help='flood engine used by the simulation: pathfinding \
+                    (default), priority_flood or level_sweep')
+parser.add_argument('--storage', dest='storage', metavar='cube storage',
+                    choices=[STORAGE_OBJECTS, STORAGE_COMPACT, 
+                    STORAGE_COLUMNS], default=DEFAULT_STORAGE, help='storage \
+                    of the 3D grid: objects (default) for one TopoCube per \
+                    cube, compact for a single byte buffer, or columns for \
+                    the board and water tops of each column')
+parser.add_argument('--continuous', dest='continuous', action='store_true',
+                    help='flood the 2D grid of heights directly, which \
+                    accepts float heights and heights of any magnitude')
+parser.add_argument('--workers', dest='workers', metavar='worker processes',
+                    type=int, default=None, help='number of processes \
+                    flooding tiles of the board in parallel with the \
+                    priority_flood engine or in continuous mode, boards of \
+                    a --batch, or boards sent to a --serve server, by \
+                    default one, or one per CPU for a server')
+parser.add_argument('--cache', dest='cache', metavar='cache file',
+                    default=None, help='SQLite file caching the results of \
+                    boards across runs')
+parser.add_argument('--profile', dest='profile', metavar='profile file',
+                    nargs='?', const='-', default=None, help='write timings \
+                    and counters of the simulation as JSON to this file, or \
+                    to standard output if no file is given')
+parser.add_argument('--input', dest='input', metavar='heights file',
+                    default=None, help='.npy, .asc (ESRI ASCII grid) or .pgm \
+                    file of heights, or raw file described by a .hdr file \
+                    or by -l, -w and --dtype')
+parser.add_argument('--dtype', dest='dtype', metavar='element type',
+                    default='<i2', help='element type of a raw --input file \
+                    without a .hdr file, such as <i2 (default) or <f4')
+parser.add_argument('--batch', dest='batch', metavar='boards file',
+                    default=None, help='JSON lines file of boards, or - for \
+                    standard input, whose statistics are written to standard \
+                    output as JSON lines')
+parser.add_argument('--basins', dest='basins', metavar='count', type=int,
+                    default=0, help='index the basins of the board and \
+                    print the volume, area and spill point of this many of \
+                    the largest')
+parser.add_argument('--serve', dest='serve', metavar='address', nargs='?',
+                    const='', default=None, help='serve the statistics of \
+                    boards sent as JSON lines on host:port or a Unix socket \
+                    path (default localhost:8470) with a pool of --workers \
+                    processes, see floodserver.py')
+parser.add_argument('--checkpoint', dest='checkpoint', 
+                    metavar='checkpoint file', default=None, help='file \
+                    receiving checkpoints of the pathfinding and level_sweep \
+                    engines, from which --resume continues a simulation')
+parser.add_argument('--checkpoint-levels', dest='checkpoint_levels', 
+                    metavar='levels', type=int, default=None, help='number of \
+                    flood levels between checkpoints')
+parser.add_argument('--checkpoint-seconds', dest='checkpoint_seconds', 
+                    metavar='seconds', type=float, default=None, help='seconds \
+                    between checkpoints, by default ' + 
+                    f'{DEFAULT_CHECKPOINT_SECONDS} when neither interval is \
+                    given')
+parser.add_argument('--resume', dest='resume', action='store_true', 
+                    help='continue from the --checkpoint file if it exists, \
+                    rather than starting over')
+parser.add_argument('--export', dest='export', metavar='raster file',
+                    default=None, help='write the depth of water on every \
+                    square to a .npy, .asc or raw float32 file, or the board \
+                    and water surfaces to a compressed .npz file')
+parser.add_argument('--nodata', dest='nodata', metavar='nodata value',
+                    type=float, default=None, help='height of the squares \
+                    outside the board in the --input file, overriding the \
+                    nodata value of its header')
+parser.add_argument('--output', dest='output', metavar='output',
+                    choices=[OUTPUT_NONE, OUTPUT_SUMMARY, OUTPUT_FULL],
+                    default=DEFAULT_OUTPUT, help='what the simulation prints: \
+                    none, summary for the flood statistics only, or full \
+                    (default) for the grids as well')
  
  
 class MakeCartesianGrid:
@@ -41,7 +166,8 @@ class MakeCartesianGrid:
     elevation. You must know the height (maximum value) of the 2D grid in order
     to call this function, which can be easily computed with prepare_grid().
     The 3D array will store contents as follows: 0: air, 1: board,
-    and 2: water.
+    and 2: water. Squares of the 2D grid whose height is NODATA are outside
+    the board, and their columns are not stored at all: cubes[x][y] is None.
 
     ...
     Parameters
@@ -52,6 +178,10 @@ class MakeCartesianGrid:
         the height of the 3D grid
     manual_run : bool, optional, default False
         flag to indicate whether to automatically run the extrusion 
+    storage : str, optional, defaults to DEFAULT_STORAGE
+        'objects' stores one TopoCube per cube, 'compact' stores the whole 3D
+        grid in a VoxelStore backed by a single byte buffer, and 'columns'
+        stores the board and water tops of each column in a ColumnStore
     
     Attributes
     ----------
@@ -60,9 +190,11 @@ class MakeCartesianGrid:
         the length from the 2D grid input
     width : int
         the width from the 2D grid input
-    cubes : 3d arr / list of lists of lists of TopoCube objects
+    cubes : 3d arr / list of lists of lists of TopoCube objects, VoxelStore
+        or ColumnStore
         a 3D cube matrix of TopoCube instances used to track contents of the 3D 
-        space
+        space, or a VoxelStore or ColumnStore offering the same cubes[x][y][z]
+        access
 
     Methods
     -------
@@ -71,15 +203,38 @@ class MakeCartesianGrid:
         grid square.
     """      
     
-    def __init__(self, grid, height, manual_run=False):
+    def __init__(self, grid, height, manual_run=False, 
+        storage=DEFAULT_STORAGE):
         self.length = len(grid[0])
         self.width = len(grid)
         self.height = height
         self.grid = grid # 
-        self.cubes = \
-            [[[CONTENT_AIR for z in range(self.height)] \
-            for y in range(self.width)] \
-            for x in range(self.length)] 
+        # Columns outside the board, indexed as x*width+y, are picked out of
+        # the rows in C, one plane of columns at a time
+        outside = None
+        if any(NODATA in row for row in grid):
+            squares_outside = bytearray(map(operator.is_, 
+                chain.from_iterable(grid), repeat(NODATA)))
+            outside = bytearray(self.length*self.width)
+            for x in range(self.length):
+                outside[x*self.width:(x+1)*self.width] = \
+                    squares_outside[x::self.length]
+        if storage == STORAGE_COMPACT:
+            self.cubes = VoxelStore(self.length, self.width, self.height, 
+                outside)
+        elif storage == STORAGE_COLUMNS:
+            self.cubes = ColumnStore(self.length, self.width, self.height,
+                outside)
+        elif storage == STORAGE_OBJECTS:
+            self.cubes = [[None]*self.width for x in range(self.length)]
+            for column in inside_columns(self.cubes, 
+                outside or bytes(self.length*self.width)):
+                x, y = divmod(column, self.width)
+                self.cubes[x][y] = [CONTENT_AIR]*self.height
+        else:
+            raise ValueError(f"Unknown cube storage '{storage}', expected " +
+                f"'{STORAGE_OBJECTS}', '{STORAGE_COMPACT}' or " + 
+                f"'{STORAGE_COLUMNS}'")
         if not manual_run:
             self.extrude()
         
@@ -107,16 +262,29 @@ class MakeCartesianGrid:
         if grid is None:
             grid = self.grid
 
-        # Build the 3D grid in order of y, x, and then z axes
-        for y in range(self.width):
-            for x in range(self.length):
-                for z in range(self.height):
-                    self.cubes[x][y][z] = TopoCube(coords=(x,y,z))
-                
-                    # Build board cubes upwards to height value of x,y
-                    if grid[y][x]-1>=z:
-                        self.cubes[x][y][z].content = CONTENT_BOARD
-                        
+        # A VoxelStore or ColumnStore is filled in bulk, one column of board
+        # at a time. Only the columns inside the board are visited
+        if isinstance(self.cubes, (VoxelStore, ColumnStore)):
+            self.cubes.clear()
+            for column in inside_columns(self.cubes):
+                x, y = divmod(column, self.width)
+                if grid[y][x] is not NODATA:
+                    self.cubes.fill_column(x, y, 0, grid[y][x], 
+                        CONTENT_BOARD)
+            return self.cubes
+
+        # Build the 3D grid in order of x, y, and then z axes
+        for column in inside_columns(self.cubes):
+            x, y = divmod(column, self.width)
+            if grid[y][x] is NODATA:
+                continue
+            for z in range(self.height):
+                self.cubes[x][y][z] = TopoCube(coords=(x,y,z))
+            
+                # Build board cubes upwards to height value of x,y
+                if grid[y][x]-1>=z:
+                    self.cubes[x][y][z].content = CONTENT_BOARD
+                    
         return self.cubes
 
 class TopoCube:
@@ -148,21 +316,417 @@ class TopoCube:
         self.content = int(content)
         self.drains_out = drains_out
 
-def prepare_grid(topo_grid=None, length=None, width=None, max_height = None):
+class VoxelStore:
+    """
+    VoxelStore is the compact alternative to a 3D matrix of TopoCube objects.
+    The content of every cube is kept as one byte of a single contiguous
+    bytearray, and the drains_out flags are bit-packed into a second one, so
+    a 200x200x200 grid takes about 9MB instead of 8 million Python objects.
+    The cubes of each (x, y) column are stored next to each other, which lets
+    whole columns be filled or searched with single bytearray operations.
+
+    Indexing a VoxelStore returns lightweight views, so existing callers can
+    keep using cubes[x][y][z].content and cubes[x][y][z].drains_out, as well
+    as len() and iteration over each of the three axes. The columns outside
+    the board take no room in the buffers, and cubes[x][y] is None for them.
+
+    ...
+    Parameters
+    ----------
+    length : int
+        the length (x axis) of the 3D grid
+    width : int
+        the width (y axis) of the 3D grid
+    height : int
+        the height (z axis) of the 3D grid
+    outside : bytearray, optional
+        1 for every column outside the board, indexed as x*width+y
+
+    Attributes
+    ----------
+    content : bytearray
+        content of every cube, 0: air, 1: board, 2: water
+    drains : bytearray
+        bit-packed drains_out flag of every cube
+    outside : bytearray or None
+        1 for every column outside the board
+    offsets : array of ints or None
+        position of every column within the buffers, or -1 outside the board,
+        when any column is outside it
+    columns : array of ints or None
+        the x*width+y of every stored column, in order
+
+    Methods
+    -------
+    index(x, y, z)
+        Position of a cube within the content buffer
+    fill_column(x, y, start, stop, content)
+        Sets the content of the cubes start to stop-1 of a column
+    column_height(x, y)
+        Number of board cubes at the bottom of a column, or NODATA outside
+        the board
+    clear()
+        Resets every cube to air which does not drain out
+    """
+
+    __slots__ = ('length', 'width', 'height', 'content', 'drains', 'outside',
+        'offsets', 'columns')
+
+    def __init__(self, length, width, height, outside=None):
+        self.length = length
+        self.width = width
+        self.height = height
+        self.outside = outside
+        self.offsets = self.columns = None
+        stored = length*width
+        if outside is not None:
+            # Only the columns inside the board are stored, one after another
+            self.columns = array('i', compress(range(length*width), 
+                map(operator.not_, outside)))
+            self.offsets = array('i', [-1])*(length*width)
+            for k, column in enumerate(self.columns):
+                self.offsets[column] = k*height
+            stored = len(self.columns)
+        self.content = bytearray(stored*height)
+        self.drains = bytearray((stored*height+7)//8)
+
+    def index(self, x, y, z):
+        if self.offsets is not None:
+            return self.offsets[x*self.width+y]+z
+        return (x*self.width+y)*self.height+z
+
+    def fill_column(self, x, y, start, stop, content):
+        stop = min(stop, self.height)
+        if stop > start:
+            offset = self.index(x, y, 0)
+            self.content[offset+start:offset+stop] = bytes([content])*(stop-start)
+
+    def column_height(self, x, y):
+        if self.outside is not None and self.outside[x*self.width+y]:
+            return NODATA
+        offset = self.index(x, y, 0)
+        # The board ends at the first cube of air or water in the column
+        tops = [self.content.find(content, offset, offset+self.height) 
+            for content in (CONTENT_AIR, CONTENT_WATER)]
+        return min([top-offset for top in tops if top >= 0] or [self.height])
+
+    def clear(self):
+        self.content[:] = bytes(len(self.content))
+        self.drains[:] = bytes(len(self.drains))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.length
+        if not 0 <= x < self.length:
+            raise IndexError('VoxelStore index out of range')
+        return VoxelPlane(self, x)
+
+    def __iter__(self):
+        for x in range(self.length):
+            yield VoxelPlane(self, x)
+
+class VoxelPlane:
+    """
+    A view of the (y, z) plane at one x position of a VoxelStore, which
+    behaves like cube_matrix[x] of a 3D matrix of TopoCube objects, down to
+    the None of the columns outside the board.
+    """
+
+    __slots__ = ('store', 'x')
+
+    def __init__(self, store, x):
+        self.store = store
+        self.x = x
+
+    def __len__(self):
+        return self.store.width
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.store.width
+        if not 0 <= y < self.store.width:
+            raise IndexError('VoxelPlane index out of range')
+        outside = self.store.outside
+        if outside is not None and outside[self.x*self.store.width+y]:
+            return None
+        return VoxelColumn(self.store, self.x, y)
+
+    def __iter__(self):
+        for y in range(self.store.width):
+            yield self[y]
+
+class VoxelColumn:
+    """
+    A view of the (x, y) column of a VoxelStore, which behaves like
+    cube_matrix[x][y] of a 3D matrix of TopoCube objects.
+    """
+
+    __slots__ = ('store', 'offset')
+
+    def __init__(self, store, x, y):
+        self.store = store
+        self.offset = store.index(x, y, 0)
+
+    def __len__(self):
+        return self.store.height
+
+    def __getitem__(self, z):
+        if z < 0:
+            z += self.store.height
+        if not 0 <= z < self.store.height:
+            raise IndexError('VoxelColumn index out of range')
+        return VoxelCube(self.store, self.offset+z)
+
+    def __iter__(self):
+        for z in range(self.store.height):
+            yield VoxelCube(self.store, self.offset+z)
+
+class VoxelCube:
+    """
+    A view of a single cube of a VoxelStore, which offers the same coords,
+    content and drains_out attributes as a TopoCube. Reading and writing the
+    attributes goes straight through to the buffers of the VoxelStore.
+    """
+
+    __slots__ = ('store', 'position')
+
+    def __init__(self, store, position):
+        self.store = store
+        self.position = position
+
+    @property
+    def coords(self):
+        column, z = divmod(self.position, self.store.height)
+        if self.store.columns is not None:
+            column = self.store.columns[column]
+        x, y = divmod(column, self.store.width)
+        return (x, y, z)
+
+    @property
+    def content(self):
+        return self.store.content[self.position]
+
+    @content.setter
+    def content(self, content):
+        self.store.content[self.position] = content
+
+    @property
+    def drains_out(self):
+        return bool(self.store.drains[self.position >> 3] & 
+            (1 << (self.position & 7)))
+
+    @drains_out.setter
+    def drains_out(self, drains_out):
+        if drains_out:
+            self.store.drains[self.position >> 3] |= 1 << (self.position & 7)
+        else:
+            self.store.drains[self.position >> 3] &= ~(1 << (self.position & 7))
+
+class ColumnStore:
+    """
+    ColumnStore is the run-length alternative to a VoxelStore. Every (x, y)
+    column of the 3D grid is board from the bottom up to its board top, then
+    water up to its water top, then air, so a column is stored as just those
+    two numbers. A 1000x1000x1000 grid takes 8MB instead of a billion bytes,
+    and its statistics take one pass over the columns instead of the cubes.
+
+    The content attribute reads and writes single cubes by their position
+    in a VoxelStore of the same shape, so the VoxelPlane, VoxelColumn and
+    VoxelCube views work on a ColumnStore unchanged, and every flood engine
+    may fill it. Water written to a cube must touch the water or board below
+    it, which is always the case while flooding from the bottom up. Columns
+    outside the board hold neither board nor water, and cubes[x][y] is None
+    for them.
+
+    ...
+    Parameters
+    ----------
+    length : int
+        the length (x axis) of the 3D grid
+    width : int
+        the width (y axis) of the 3D grid
+    height : int
+        the height (z axis) of the 3D grid
+    outside : bytearray, optional
+        1 for every column outside the board, indexed as x*width+y
+
+    Attributes
+    ----------
+    board_top : array of ints
+        number of board cubes of every column, indexed as x*width+y
+    water_top : array of ints
+        level of the top of the water of every column, or its board top
+        when it holds no water
+    content : ColumnContent
+        content of every cube, 0: air, 1: board, 2: water
+    drains : ColumnDrains
+        drains_out flags of the cubes, packed like those of a VoxelStore
+    outside : bytearray or None
+        1 for every column outside the board
+
+    Methods
+    -------
+    index(x, y, z)
+        Position of a cube within a VoxelStore of the same shape
+    content_at(x, y, z)
+        Content of a cube
+    fill_column(x, y, start, stop, content)
+        Sets the content of the cubes start to stop-1 of a column
+    column_height(x, y)
+        Number of board cubes at the bottom of a column, or NODATA outside
+        the board
+    columns()
+        Iterates over the (x, y, board_top, water_top) of every column
+        inside the board
+    statistics()
+        The flood statistics of the columns
+    expand()
+        The same grid as a VoxelStore
+    clear()
+        Resets every cube to air which does not drain out
+    """
+
+    __slots__ = ('length', 'width', 'height', 'board_top', 'water_top',
+        'content', 'drains', 'outside')
+
+    def __init__(self, length, width, height, outside=None):
+        self.length = length
+        self.width = width
+        self.height = height
+        self.outside = outside
+        self.board_top = array('i', bytes(4*length*width))
+        self.water_top = array('i', bytes(4*length*width))
+        self.content = ColumnContent(self)
+        self.drains = ColumnDrains()
+
+    def index(self, x, y, z):
+        return (x*self.width+y)*self.height+z
+
+    def content_at(self, x, y, z):
+        return self.content[self.index(x, y, z)]
+
+    def fill_column(self, x, y, start, stop, content):
+        stop = min(stop, self.height)
+        if stop <= start:
+            return
+        column = x*self.width+y
+        board_top, water_top = self.board_top[column], self.water_top[column]
+        if content == CONTENT_BOARD and start <= board_top == water_top:
+            self.board_top[column] = self.water_top[column] = \
+                max(board_top, stop)
+        elif content == CONTENT_WATER and board_top <= start <= water_top:
+            self.water_top[column] = max(water_top, stop)
+        elif content == CONTENT_AIR and board_top <= start and \
+            stop >= water_top:
+            self.water_top[column] = min(water_top, start)
+        else:
+            raise ValueError(f"Cubes {start} to {stop-1} of column {x}, {y} " +
+                "would split its board, water or air into separate runs")
+
+    def column_height(self, x, y):
+        if self.outside is not None and self.outside[x*self.width+y]:
+            return NODATA
+        return self.board_top[x*self.width+y]
+
+    def columns(self):
+        board_top, water_top = self.board_top, self.water_top
+        for column in inside_columns(self):
+            x, y = divmod(column, self.width)
+            yield x, y, board_top[column], water_top[column]
+
+    def statistics(self):
+        total_flooding = sum(self.water_top) - sum(self.board_top)
+        max_water_level = max(compress(self.water_top, map(operator.gt, 
+            self.water_top, self.board_top)), default=0)
+        return total_flooding, max_water_level
+
+    def expand(self):
+        voxels = VoxelStore(self.length, self.width, self.height, 
+            self.outside)
+        for x, y, board_top, water_top in self.columns():
+            voxels.fill_column(x, y, 0, board_top, CONTENT_BOARD)
+            voxels.fill_column(x, y, board_top, water_top, CONTENT_WATER)
+        return voxels
+
+    def clear(self):
+        self.board_top[:] = self.water_top[:] = array('i', 
+            bytes(4*self.length*self.width))
+        self.drains.clear()
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.length
+        if not 0 <= x < self.length:
+            raise IndexError('ColumnStore index out of range')
+        return VoxelPlane(self, x)
+
+    def __iter__(self):
+        for x in range(self.length):
+            yield VoxelPlane(self, x)
+
+class ColumnContent:
+    """
+    The content of the cubes of a ColumnStore, indexed by their position in
+    a VoxelStore of the same shape, as read and written by VoxelCube views.
+    """
+
+    __slots__ = ('store',)
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, position):
+        column, z = divmod(position, self.store.height)
+        if z < self.store.board_top[column]:
+            return CONTENT_BOARD
+        if z < self.store.water_top[column]:
+            return CONTENT_WATER
+        return CONTENT_AIR
+
+    def __setitem__(self, position, content):
+        column, z = divmod(position, self.store.height)
+        x, y = divmod(column, self.store.width)
+        if self[position] != content:
+            self.store.fill_column(x, y, z, z+1, content)
+
+    def __len__(self):
+        return self.store.length*self.store.width*self.store.height
+
+class ColumnDrains(dict):
+    """
+    The drains_out flags of a ColumnStore, packed into bytes like those of a
+    VoxelStore, of which only the bytes with a flag set are kept.
+    """
+
+    def __missing__(self, key):
+        return 0
+
+def prepare_grid(topo_grid=None, length=None, width=None, max_height = None,
+    output=DEFAULT_OUTPUT, stream=None, terrain=floodterrain.DEFAULT_TERRAIN,
+    seed=None):
     """
     prepare_grid accepts a standard Python 2d array input, and normalizes it 
     for extrusion by the MakeCartesianGrid class. It assumes an "x" length 
     based on the length of the first array, then truncates or fills the rest
     of the "y" arrays. It also computes the maximum elevation of the grid's
-    values.
+    values. Squares outside the board, such as those filling short rows or
+    the nodata squares of a raster, are given the height NODATA.
     
     Alternatively, instead of passing a 2D array as topo_grid, you may create a 
     random 2D grid of height values by supplying length, width, and maximum
-    height desired. 
+    height desired, shaped like any terrain of floodterrain.TERRAIN_TYPES and
+    the same on every run with the same seed. A raster read by floodio.open_heights() may also be 
+    passed, whose rows are rectangular already.
 
     Parameters
     ----------
-    topo_grid : 2D arr/list of lists, optional
+    topo_grid : 2D arr/list of lists or floodio raster, optional
         A 2d Python array, square or rectangular
     length : int, optional, defaults to DEFAULT_LENGTH
         Desired length of a randomized 2D grid
@@ -170,6 +734,14 @@ def prepare_grid(topo_grid=None, length=None, width=None, max_height = None):
         Desired width of a randomized 2D grid, 
     max_height : int, optional, defaults to DEFAULT_MAX_HEIGHT
        Maximum values (height) of a randomized 2D grid
+    output : str, optional, defaults to DEFAULT_OUTPUT
+        The grid is only printed with OUTPUT_FULL
+    stream : file object, optional, defaults to sys.stdout
+        Text stream receiving the printed grid
+    terrain : str, optional, defaults to floodterrain.DEFAULT_TERRAIN
+        Terrain type of a randomized 2D grid
+    seed : int or str, optional
+        Seed of a randomized 2D grid, or None for a different grid each time
 
     Returns
     -------
@@ -180,37 +752,92 @@ def prepare_grid(topo_grid=None, length=None, width=None, max_height = None):
         maximum height.
     """
     
+    verbose = output == OUTPUT_FULL
+    stream = sys.stdout if stream is None else stream
     if topo_grid is None: 
         # randomizing a 2D grid
         board_length = length or DEFAULT_LENGTH
         board_width = width or DEFAULT_WIDTH
         board_max_height = max_height or DEFAULT_MAX_HEIGHT
-        print(f"Randomizing a topography grid of {board_length}x{board_width}" +
-            f" with values 0-{board_max_height}")
+        if verbose:
+            stream.write("Randomizing a topography grid of " +
+                f"{board_length}x{board_width} with values " +
+                f"0-{board_max_height}\nYour random topography grid is:\n")
 
         #Randomize values in 2D array up to maximum height calculated above
-        topo_grid = [[random.randint(0,board_max_height) 
-            for i in range(board_length)] for j in range(board_width)]
-        print("Your random topography grid is:")
+        topo_grid = floodterrain.make_terrain(terrain, board_length, 
+            board_width, board_max_height, seed)
+    elif isinstance(topo_grid, floodio.RASTER_TYPES):
+        nodata = topo_grid.nodata
+        topo_grid = topo_grid.rows()
+        if nodata is not None:
+            topo_grid = [[NODATA if height == nodata else height 
+                for height in row] for row in topo_grid]
+        board_max_height = grid_max_height(topo_grid)
+        if verbose:
+            stream.write("Your topography grid read from file is:\n")
     else: 
-        # base board length on the first row's length
-        board_length = len(topo_grid[0])
-        board_width = len(topo_grid)
-        board_max_height = max(map(max, topo_grid))
+        topo_grid, board_max_height = groom_grid(topo_grid)
+        if verbose:
+            stream.write("Your custom topography grid is:\n")  
         
-        # Fill incomplete rows with zeros for uniform row length
-        for y in range(board_width):
-            row = topo_grid[y]
-            if len(row) < board_length:
-                row.extend([0 for i in range((board_length-len(row)))])  
-            # trim longer rows to first row's length
-            topo_grid[y] = row[0:board_length]
-        print("Your custom topography grid is:")  
-        
-    print_grid(topo_grid)
+    if verbose:
+        print_grid(topo_grid, stream)
     return topo_grid, board_max_height
     
-def print_grid(topo_grid):
+def groom_grid(topo_grid):
+    """
+    The quiet grooming step of prepare_grid(), which pads or trims every row
+    of a custom 2D grid to the length of its first row without printing it.
+    Short rows are padded with squares outside the board, of height NODATA.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        A 2d Python array, groomed in place
+
+    Returns
+    -------
+    (topo_grid, board_max_height) : tuple (2D arr/list of lists, int)
+        The groomed grid and the maximum value detected in it
+    """
+    # base board length on the first row's length
+    board_length = len(topo_grid[0])
+    board_width = len(topo_grid)
+    board_max_height = grid_max_height(topo_grid)
+    
+    # Fill incomplete rows with squares outside the board for uniform row 
+    # length, and trim longer rows to first row's length, leaving the rows 
+    # that fit untouched
+    for y in range(board_width):
+        row = topo_grid[y]
+        if len(row) < board_length:
+            row.extend([NODATA]*(board_length-len(row)))
+        elif len(row) > board_length:
+            topo_grid[y] = row[:board_length]
+    return topo_grid, board_max_height
+
+def grid_max_height(topo_grid):
+    """
+    The maximum height of the squares of a 2D grid inside the board, or 0
+    when there are none.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        A 2d Python array of heights, of which NODATA squares are skipped
+
+    Returns
+    -------
+    board_max_height : int or float
+    """
+    if not any(NODATA in row for row in topo_grid):
+        return max(map(max, topo_grid))
+    # The squares inside the board are picked out in C
+    return max(compress(chain.from_iterable(topo_grid), map(operator.is_not,
+        chain.from_iterable(topo_grid), repeat(NODATA))), default=0)
+
+def print_grid(topo_grid, stream=None):
     """
     Prints a right-aligned table of integers representing the heights
     of each square in the 2D array passed. This grid printer allows
@@ -220,24 +847,28 @@ def print_grid(topo_grid):
     
     To minimize possible errors, always pass a 2D grid of 'height' values 
     through prepare_grid() first to properly groom the topography grid.
+    Squares outside the board are left blank.
 
     Parameters
     ----------
     topo_grid : 2D arr/list of lists
         A 2d Python array of integers, square or rectangular
+    stream : file object, optional, defaults to sys.stdout
+        Text stream receiving the table, one write per row
     """    
-    for i in range(len(topo_grid)):
-        print("|", end="")
-        for j in range(len(topo_grid[0])):
-            print(str(topo_grid[i][j]).rjust(2), end="|")
-        print("")
+    stream = sys.stdout if stream is None else stream
+    length = len(topo_grid[0])
+    for row in topo_grid:
+        stream.write("|" + "".join([f"{height!s:>2}|" if height is not NODATA
+            else "  |" for height in row[:length]]) + "\n")
 
-def print_cube_grid(cube_grid, include_coords = False):
+def print_cube_grid(cube_grid, include_coords = False, stream=None):
     """
     Prints a pipe-separated table of integers representing a 3D grid as follows:
     0: air, 1: board, 2: water
     The 3D array must be a perfect cuboid / orthotope, as there is no error
-    handling for extraneous array elements. 
+    handling for extraneous array elements. Columns outside the board are
+    left blank.
 
     Parameters
     ----------
@@ -245,6 +876,8 @@ def print_cube_grid(cube_grid, include_coords = False):
         A 2d Python array of integers, square or rectangular
     include_coords : bool, optional, default False
         Add 3D coordinates to each position in addition to the material
+    stream : file object, optional, defaults to sys.stdout
+        Text stream receiving the table, one write per row
     
     Example Print Output
     --------------------
@@ -256,221 +889,2165 @@ def print_cube_grid(cube_grid, include_coords = False):
     """           
     length = len(cube_grid) 
     width = len(cube_grid[0])
-    height = len(cube_grid[0][0])
+    height = grid_height(cube_grid)
     
     # Detect max digit length for clean right justification of table
     len_digits = len(str(length))-1
     wid_digits = len(str(width))-1
     ht_digits = len(str(height))-1
     
-    print(f"Length {length}, Width {width}, Height {height}")
+    stream = sys.stdout if stream is None else stream
+    stream.write(f"Length {length}, Width {width}, Height {height}\n")
+    compact = isinstance(cube_grid, VoxelStore) and not include_coords
+    runs = isinstance(cube_grid, ColumnStore) and not include_coords
+    outside = outside_columns(cube_grid)
     for y in range(width):
+        columns = []
         for x in range(length):
-            print("", end="|")
-            for z in range(height):
-                if include_coords:
-                    print("-".join([str(x).rjust(len_digits),
-                        str(y).rjust(wid_digits),
-                        str(z).rjust(ht_digits)]), end=":")
-                print(f"{cube_grid[x][y][z].content}", end='|')
-            print("", end=" ")
-        print("")
-
-def simulate_flood(cube_matrix):
+            if outside[x*width+y]:
+                columns.append("|" + " |"*height + " ")
+            elif runs:
+                # Spell the runs of the column out as digits
+                column = x*width+y
+                board_top = cube_grid.board_top[column]
+                water_top = cube_grid.water_top[column]
+                digits = "1"*board_top + "2"*(water_top-board_top) + \
+                    "0"*(height-water_top)
+                columns.append("|" + "|".join(digits) + 
+                    ("| " if digits else " "))
+            elif compact:
+                # Turn the bytes of the column into digits in a single pass
+                offset = cube_grid.index(x, y, 0)
+                digits = cube_grid.content[offset:offset+height].translate(
+                    CONTENT_DIGITS).decode()
+                columns.append("|" + "|".join(digits) + 
+                    ("| " if digits else " "))
+            elif include_coords:
+                columns.append("|" + "".join(["-".join([
+                    str(x).rjust(len_digits), str(y).rjust(wid_digits),
+                    str(z).rjust(ht_digits)]) + f":{cube.content}|" 
+                    for z, cube in enumerate(cube_grid[x][y])]) + " ")
+            else:
+                columns.append("|" + "".join([f"{cube.content}|" 
+                    for cube in cube_grid[x][y]]) + " ")
+        stream.write("".join(columns) + "\n")
+
+class FloodProfile:
+    """
+    FloodProfile collects the timings and counters of a single simulation
+    when it is passed to simulate_flood() or requested from full_simulation().
+    Simulations without a FloodProfile skip all of its bookkeeping.
+
+    ...
+    Attributes
+    ----------
+    phases : dict
+        seconds spent in each phase of full_simulation(), in order
+    levels : list of floats
+        seconds spent on each flood level by the level engines
+    searches : int
+        number of drain() searches run by the pathfinding engine
+    visited : int
+        number of squares visited by those searches
+    search_exits : dict
+        number of searches ending on a square already known to drain
+        ('drains_out'), on the edge of the board ('edge'), on water
+        ('water'), or enclosed by the board ('enclosed')
+    known_drains : int
+        number of cubes found to drain from their drains_out flag alone
+    edge_drains : int
+        number of edge cubes, which drain without a search
+
+    Methods
+    -------
+    lap(phase)
+        Records the time since the previous lap as the time of a phase
+    as_dict()
+        The timings, counters and hit rates as a dict fit for JSON
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.levels = []
+        self.searches = self.visited = 0
+        self.search_exits = {SEARCH_DRAINS_OUT: 0, SEARCH_EDGE: 0, 
+            SEARCH_WATER: 0, SEARCH_ENCLOSED: 0}
+        self.known_drains = self.edge_drains = 0
+        self.last_lap = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now-self.last_lap
+        self.last_lap = now
+
+    def as_dict(self):
+        searches = self.searches or 1
+        slowest = max(range(len(self.levels)), key=self.levels.__getitem__,
+            default=None)
+        return {
+            'phases': dict(self.phases),
+            'levels': list(self.levels),
+            'slowest_level': slowest,
+            'searches': self.searches,
+            'visited': self.visited,
+            'visited_per_search': self.visited / searches,
+            'search_exits': dict(self.search_exits),
+            'drains_out_hit_rate': 
+                self.search_exits[SEARCH_DRAINS_OUT] / searches,
+            'water_contact_rate': self.search_exits[SEARCH_WATER] / searches,
+            'known_drains': self.known_drains,
+            'edge_drains': self.edge_drains,
+        }
+
+class FloodResult(namedtuple('FloodResult', 
+    ['total_flooding', 'max_water_level'])):
+    """
+    FloodResult is the (total_flooding, max_water_level) tuple returned by 
+    full_simulation(), which also carries the FloodProfile and BasinIndex of
+    the simulation when they were requested.
+
+    Attributes
+    ----------
+    total_flooding : int or float
+        Number of cubes, or volume, of water retained by the board
+    max_water_level : int or float
+        Highest level of water retained by the board
+    profile : FloodProfile or None
+        Timings and counters of the simulation
+    basins : BasinIndex or None
+        Basins of the board
+    statistics : FloodStatistics or None
+        Statistics gathered while flooding the 3D grid
+    """
+    profile = None
+    basins = None
+    statistics = None
+
+class FloodStatistics:
+    """
+    FloodStatistics accumulates the statistics of a flood while an engine
+    writes its water, so that they never need a second pass over the 3D
+    grid: the number of water cubes on every level, from which the total
+    flooding and the highest water level follow, and the wet area, which is
+    the number of squares holding any water. Levels are counted through
+    their changes, so a whole column of water costs as little as one cube.
+    It is passed to simulate_flood(), and full_simulation() returns it as
+    the statistics of its result.
+
+    ...
+    Parameters
+    ----------
+    length : int
+        the length (x axis) of the 3D grid
+    width : int
+        the width (y axis) of the 3D grid
+    height : int
+        the height (z axis) of the 3D grid
+
+    Attributes
+    ----------
+    changes : list of int
+        change in the number of water cubes from each level to the next
+    wet : bytearray
+        1 for every square holding water, indexed by y*length+x
+    level_counts : list of int
+        number of water cubes on each level
+    total_flooding : int
+        number of water cubes
+    max_water_level : int
+        highest level of water, as returned by flood_statistics()
+    wet_area : int
+        number of squares holding water
+
+    Methods
+    -------
+    add_level(level, cubes)
+        Counts water cubes on a level
+    add_column(i, start, stop)
+        Counts the water cubes start to stop-1 of the column of square i
+    as_dict()
+        The statistics as a dict fit for JSON
+    """
+
+    def __init__(self, length, width, height):
+        self.changes = [0]*(height+1)
+        self.wet = bytearray(length*width)
+
+    def add_level(self, level, cubes):
+        self.changes[level] += cubes
+        self.changes[level+1] -= cubes
+
+    def add_column(self, i, start, stop):
+        if stop > start:
+            self.changes[start] += 1
+            self.changes[stop] -= 1
+            self.wet[i] = 1
+
+    @property
+    def level_counts(self):
+        return list(accumulate(self.changes[:-1]))
+
+    @property
+    def total_flooding(self):
+        return sum(self.level_counts)
+
+    @property
+    def max_water_level(self):
+        level_counts = self.level_counts
+        return next((level+1 for level in range(len(level_counts)-1, -1, -1)
+            if level_counts[level]), 0)
+
+    @property
+    def wet_area(self):
+        return self.wet.count(1)
+
+    def as_dict(self):
+        level_counts = self.level_counts
+        return {
+            'total_flooding': sum(level_counts),
+            'max_water_level': self.max_water_level,
+            'wet_area': self.wet_area,
+            'level_counts': level_counts,
+        }
+
+class FloodCheckpoint:
+    """
+    FloodCheckpoint saves the progress of the pathfinding and level_sweep 
+    engines to a file every few levels or seconds, so that a simulation which
+    was killed may resume from its last checkpoint instead of starting over.
+    These engines flood one level at a time from the bottom and never touch a
+    finished level again, and the water of every column sits right on top of
+    its board, so a checkpoint only keeps the number of finished levels and
+    the top of the water of each column. The rest of the state of an engine
+    is rebuilt from the board, and a resumed simulation produces exactly the
+    cubes of an uninterrupted one.
+
+    ...
+    Parameters
+    ----------
+    path : str
+        Path of the checkpoint file, which is replaced whole by each 
+        checkpoint so that a kill midway leaves the previous one intact
+    levels : int, optional
+        Number of levels between checkpoints
+    seconds : float, optional
+        Seconds between checkpoints, DEFAULT_CHECKPOINT_SECONDS when neither
+        interval is given
+    resume : bool, optional, default False
+        Continue from the checkpoint file if it exists, rather than starting
+        over and replacing it
+
+    Attributes
+    ----------
+    resumed_level : int
+        Number of finished levels restored from the checkpoint file
+    saved_level : int
+        Number of finished levels of the last checkpoint written or restored
+    saves : int
+        Number of checkpoints written
+
+    Methods
+    -------
+    restore(cube_matrix, topo_grid, statistics=None)
+        Fills in the water of the last checkpoint, counting it in a
+        FloodStatistics, and returns the number of finished levels
+    level_done(cube_matrix, topo_grid, levels)
+        Saves a checkpoint if one is due once this many levels are finished
+    save(cube_matrix, topo_grid, levels)
+        Saves a checkpoint of the water of the finished levels
+    """
+
+    def __init__(self, path, levels=None, seconds=None, resume=False):
+        if levels is None and seconds is None:
+            seconds = DEFAULT_CHECKPOINT_SECONDS
+        self.path = path
+        self.levels = levels
+        self.seconds = seconds
+        self.resume = resume
+        self.resumed_level = self.saved_level = 0
+        self.saves = 0
+        self.last_save = time.perf_counter()
+
+    def header(self, cube_matrix, topo_grid):
+        # Dimensions and checksum of the board, so that a checkpoint is never
+        # resumed on another board
+        heights = array('i', (height if height is not NODATA else -1 
+            for row in topo_grid for height in row))
+        if sys.byteorder != 'little':
+            heights.byteswap()
+        return {'length': len(cube_matrix), 'width': len(cube_matrix[0]),
+            'height': grid_height(cube_matrix), 'board': zlib.crc32(heights)}
+
+    def water_tops(self, cube_matrix, topo_grid, levels):
+        # Top of the water of every column within the finished levels, 
+        # indexed by y*length+x
+        length = len(topo_grid[0])
+        tops = array('i', bytes(4*length*len(topo_grid)))
+        water = bytes([CONTENT_WATER])
+        for y, row in enumerate(topo_grid):
+            for x, height in enumerate(row):
+                top = height
+                if height is NODATA:
+                    top = -1
+                elif isinstance(cube_matrix, ColumnStore):
+                    top = max(top, min(levels, 
+                        cube_matrix.water_top[x*cube_matrix.width+y]))
+                elif isinstance(cube_matrix, VoxelStore):
+                    # Count the water bytes at the bottom of the column
+                    offset = cube_matrix.index(x, y, 0)
+                    cubes = cube_matrix.content[offset+height:offset+levels]
+                    top += len(cubes) - len(cubes.lstrip(water))
+                else:
+                    column = cube_matrix[x][y]
+                    while top < levels and column[top].content == CONTENT_WATER:
+                        top += 1
+                tops[y*length+x] = top
+        return tops
+
+    def restore(self, cube_matrix, topo_grid, statistics=None):
+        if not self.resume or not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as checkpoint_file:
+            if checkpoint_file.readline() != CHECKPOINT_MAGIC:
+                raise ValueError(f"{self.path} is not a flood checkpoint")
+            header = json.loads(checkpoint_file.readline())
+            tops = array('i', zlib.decompress(checkpoint_file.read()))
+        if sys.byteorder != 'little':
+            tops.byteswap()
+        board = self.header(cube_matrix, topo_grid)
+        if {key: header.get(key) for key in board} != board:
+            raise ValueError(f"Checkpoint {self.path} was saved while " +
+                "flooding another board")
+
+        length = len(topo_grid[0])
+        for y, row in enumerate(topo_grid):
+            for x, height in enumerate(row):
+                if height is NODATA:
+                    continue
+                top = tops[y*length+x]
+                if statistics is not None:
+                    statistics.add_column(y*length+x, height, top)
+                # A VoxelStore or ColumnStore fills whole columns at once
+                if isinstance(cube_matrix, (VoxelStore, ColumnStore)):
+                    cube_matrix.fill_column(x, y, height, top, CONTENT_WATER)
+                    continue
+                column = cube_matrix[x][y]
+                for z in range(height, top):
+                    column[z].content = CONTENT_WATER
+        self.resumed_level = self.saved_level = header['levels']
+        return header['levels']
+
+    def level_done(self, cube_matrix, topo_grid, levels):
+        if (self.levels is not None and 
+            levels - self.saved_level >= self.levels) or \
+            (self.seconds is not None and 
+            time.perf_counter() - self.last_save >= self.seconds):
+            self.save(cube_matrix, topo_grid, levels)
+
+    def save(self, cube_matrix, topo_grid, levels):
+        header = self.header(cube_matrix, topo_grid)
+        header['levels'] = levels
+        tops = self.water_tops(cube_matrix, topo_grid, levels)
+        if sys.byteorder != 'little':
+            tops.byteswap()
+        # Write the new checkpoint beside the last one, and only replace it
+        # once the new one is safely on disk
+        partial_path = self.path + '.partial'
+        with open(partial_path, 'wb') as checkpoint_file:
+            checkpoint_file.write(CHECKPOINT_MAGIC)
+            checkpoint_file.write(json.dumps(header).encode() + b'\n')
+            checkpoint_file.write(zlib.compress(tops, 1))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(partial_path, self.path)
+        self.saved_level = levels
+        self.saves += 1
+        self.last_save = time.perf_counter()
+
+def simulate_flood(cube_matrix, engine=DEFAULT_ENGINE, workers=1, 
+    profile=None, checkpoint=None, statistics=None):
     """
     The primary function that simulates flood physics upon the 3D matrix of
-    TopoCubes passed. 
+    TopoCubes passed. The flood physics are delegated to one of the engines
+    registered in FLOOD_ENGINES, and every engine produces the same water
+    content in the 3D matrix.
 
     Parameters
     ----------
     cube_matrix : 3D arr / list of lists of lists of TopoCube objects
         A 3D Python array of TopoCode objects generated in MakeCartesianGrid
-    
+    engine : str, optional, defaults to DEFAULT_ENGINE
+        'pathfinding' floods the matrix one level at a time with a pathfinding
+        search per cube, 'priority_flood' computes the water surface of each
+        column from the board edges inwards with a heap over the 2D grid, and
+        'level_sweep' floods one level at a time while merging the connected
+        regions of air of each level with a union-find structure
+    workers : int, optional, default 1
+        Number of worker processes of the priority_flood engine, which then
+        splits the board into tiles flooded in parallel
+    profile : FloodProfile, optional
+        Receives the timings of each level of the pathfinding and level_sweep
+        engines, and the search counters of the pathfinding engine
+    checkpoint : FloodCheckpoint, optional
+        Saves the progress of the pathfinding and level_sweep engines, and 
+        restores it first when resuming
+    statistics : FloodStatistics, optional
+        Counts the water of every engine as it is written
+
     Returns
     -------
     cube_matrix : 3D arr / list of lists of lists of TopoCube objects
-        A fullly extruded 3d Python array of TopoCube objects which hold 
+        A fullly extruded 3d Python array of TopoCube objects which hold
         information about the content of each cube (air, board, or water)
-  
+
     """
-        
+    if engine not in FLOOD_ENGINES:
+        raise ValueError(f"Unknown flood engine '{engine}', expected one of " +
+            ", ".join(FLOOD_ENGINES))
+    if checkpoint is not None and engine == ENGINE_PRIORITY_FLOOD:
+        raise ValueError(f"The '{engine}' engine floods every level at " +
+            "once, only the level engines save checkpoints")
+    if workers > 1:
+        if engine != ENGINE_PRIORITY_FLOOD:
+            raise ValueError(f"The '{engine}' engine runs in a single " +
+                f"process, use the '{ENGINE_PRIORITY_FLOOD}' engine with " +
+                "multiple workers")
+        return priority_flood_cubes(cube_matrix, workers, statistics)
+    if engine == ENGINE_PRIORITY_FLOOD:
+        return FLOOD_ENGINES[engine](cube_matrix, statistics=statistics)
+    return FLOOD_ENGINES[engine](cube_matrix, profile, checkpoint, statistics)
+
+def pathfinding_flood(cube_matrix, profile=None, checkpoint=None,
+    statistics=None):
+    """
+    The original flood engine, which floods the 3D matrix one level at a time
+    beginning at the bottom. Every air cube on a level launches a pathfinding
+    search through the 2D slice of that level to check whether it drains off
+    the board or pools.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+    profile : FloodProfile, optional
+        Receives the time of each level and the counters of the searches
+    checkpoint : FloodCheckpoint, optional
+        Saves the finished levels, and restores them first when resuming
+    statistics : FloodStatistics, optional
+        Counts every water cube as it is written
+
+    Returns
+    -------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        The same 3D Python array, with water cubes filled in
+
+    """
+
     # Establish the 3D parameters of the simulation based on matrix dimensions
     length = len(cube_matrix)
     width = len(cube_matrix[0])
-    height = len(cube_matrix[0][0])    
+    height = grid_height(cube_matrix)
+    # Only the squares inside the board are flooded
+    squares = sorted(map(divmod, inside_columns(cube_matrix), 
+        repeat(width)), key=lambda square: (square[1], square[0]))
+
+    # A checkpoint restores the water of the levels it finished, where every
+    # other air cube was found to drain out
+    start_level = 0
+    if checkpoint is not None:
+        topo_grid = column_heights(cube_matrix)
+        start_level = checkpoint.restore(cube_matrix, topo_grid, statistics)
+        for flood_level in range(start_level):
+            for x, y in squares:
+                current_cube = cube_matrix[x][y][flood_level]
+                if current_cube.content == CONTENT_AIR:
+                    current_cube.drains_out = True
     
     # Flood the topography one level at a time, beginning at bottom
-    for flood_level in range(height):
+    for flood_level in range(start_level, height):
+        if profile is not None:
+            level_start = time.perf_counter()
         # Flood each square individually on this level with pathfinding
-        for y in range(width):
-            for x in range(length):
-                
-                # Store current cube as a shorter variable
-                current_cube = cube_matrix[x][y][flood_level]
-                cube_below = cube_matrix[x][y][flood_level-1]
-                
-                # Must be air to bother with recursive function 
-                if current_cube.content == CONTENT_BOARD:
-                    continue
-                # Detect if there is air below. If not, then drain the square
-                elif flood_level>0 and cube_below == CONTENT_AIR:
-                    current_cube.content = CONTENT_AIR
-                    continue
-                # If we already detected that the square drains, drain & ignore
-                elif current_cube.drains_out:
-                    current_cube.content = CONTENT_AIR
-                # Check if it's the edge of the board, if so, drain & ignore
-                elif (0 in (x,y) or x == length-1 or y == width-1):
-                    current_cube.drains_out = True
+        for x, y in squares:
+            
+            # Store current cube as a shorter variable
+            current_cube = cube_matrix[x][y][flood_level]
+            cube_below = cube_matrix[x][y][flood_level-1]
+            
+            # Must be air to bother with recursive function 
+            if current_cube.content == CONTENT_BOARD:
+                continue
+            # Detect if there is air below. If not, then drain the square
+            elif flood_level>0 and cube_below == CONTENT_AIR:
+                current_cube.content = CONTENT_AIR
+                continue
+            # If we already detected that the square drains, drain & ignore
+            elif current_cube.drains_out:
+                current_cube.content = CONTENT_AIR
+                if profile is not None:
+                    profile.known_drains += 1
+            # Check if it's the edge of the board, if so, drain & ignore
+            elif (0 in (x,y) or x == length-1 or y == width-1):
+                current_cube.drains_out = True
+                if profile is not None:
+                    profile.edge_drains += 1
+            
+            elif current_cube.content == CONTENT_AIR:    
+
+                def drain():
+                    """
+                    The nested pathfinding function that crawls through the 
+                    2D slice of the 3D grid at the current flood level to 
+                    check for containment or drainage at each current 
+                    position. It uses the current x, y, and flood_level 
+                    values as the position.
                 
-                elif current_cube.content == CONTENT_AIR:    
-
-                    def drain():
-                        """
-                        The nested pathfinding function that crawls through the 
-                        2D slice of the 3D grid at the current flood level to 
-                        check for containment or drainage at each current 
-                        position. It uses the current x, y, and flood_level 
-                        values as the position.
+                    Returns
+                    -------
+                    exit : str
+                        How the search ended. The current cube drains out
+                        if the search reached a cube known to drain
+                        (SEARCH_DRAINS_OUT) or the edge of the board
+                        (SEARCH_EDGE), and water pools at the cube if it
+                        reached water (SEARCH_WATER) or found no way out
+                        (SEARCH_ENCLOSED)
+                    """
                     
-                        Returns
-                        -------
-                        True/False : bool
-                            If the function detected that the current cube 
-                            drains out, it returns True. If water pools at the 
-                            cube, it returns False 
-                        """
-                        
-                        # Keep track of unique touches during the pathfinding
-                        touched = set([x,y])
-                        # List of discovered coordinates that must be resolved 
-                        pathfinding = [(x,y)]
-                        
-                        # Continue pathfinding until all paths exhausted
-                        while pathfinding:
-                            tx,ty = pathfinding.pop(0) # Continue pathfinding
-                            # Track which squares have already been resolved
-                            touched.add((tx,ty)) 
-                            # Branch out from current path in 4 NESW directions
-                            paths = [(0,-1),(1,0),(0,+1),(-1,0)]
-                            for (i,j) in paths:
-                                px, py = tx+i, ty+j
-                                
-                                # Store current path cube as a shorter variable
-                                current_cube = cube_matrix[px][py][flood_level]
-                                if (px,py) in touched:
-                                    continue
-                                # If we already detected drainage, then drain 
-                                if current_cube.drains_out:
-                                    return True
-                                # Detect out-of-bounds pathfinding 
-                                if not (0 <= px <= length-1) and \
-                                    (0 <= py <= width-1):
-                                    return True
-                                # If path ran into water, then this also floods
-                                if current_cube.content == CONTENT_WATER:
-                                    return False
-                                # Ignore watertight boards during pathfinding                                    
-                                if current_cube.content == CONTENT_BOARD:
-                                    continue
-                                # If path hit edge of board, it always drains
-                                if 0 in (px,py) or length-1 in (px,py):
-                                    return True     
-                                # If air, mark for more pathfinding and continue  
-                                if current_cube.content == CONTENT_AIR:
-                                    touched.add((px,py))
-                                    pathfinding.append((px,py))
-                        return False
-                    drained = drain() # Execute the drain function for each x,y
-                    # The function returns True for drains, False for pools
-                    if drained: 
-                        current_cube.drains_out = True 
-                    else:
-                        current_cube.content = CONTENT_WATER                    
+                    # Keep track of unique touches during the pathfinding
+                    touched.add((x,y))
+                    # List of discovered coordinates that must be resolved 
+                    pathfinding = [(x,y)]
+                    
+                    # Continue pathfinding until all paths exhausted
+                    while pathfinding:
+                        tx,ty = pathfinding.pop(0) # Continue pathfinding
+                        # Track which squares have already been resolved
+                        touched.add((tx,ty)) 
+                        # Branch out from current path in 4 NESW directions
+                        paths = [(0,-1),(1,0),(0,+1),(-1,0)]
+                        for (i,j) in paths:
+                            px, py = tx+i, ty+j
+                            
+                            # Squares outside the board drain like its
+                            # edges
+                            column = cube_matrix[px][py]
+                            if column is None:
+                                return SEARCH_EDGE
+                            # Store current path cube as a shorter variable
+                            current_cube = column[flood_level]
+                            if (px,py) in touched:
+                                continue
+                            # If we already detected drainage, then drain 
+                            if current_cube.drains_out:
+                                return SEARCH_DRAINS_OUT
+                            # Detect out-of-bounds pathfinding 
+                            if not (0 <= px <= length-1) and \
+                                (0 <= py <= width-1):
+                                return SEARCH_EDGE
+                            # If path ran into water, then this also floods
+                            if current_cube.content == CONTENT_WATER:
+                                return SEARCH_WATER
+                            # Ignore watertight boards during pathfinding                                    
+                            if current_cube.content == CONTENT_BOARD:
+                                continue
+                            # If path hit edge of board, it always drains
+                            if 0 in (px,py) or px == length-1 or \
+                                py == width-1:
+                                return SEARCH_EDGE
+                            # If air, mark for more pathfinding and continue  
+                            if current_cube.content == CONTENT_AIR:
+                                touched.add((px,py))
+                                pathfinding.append((px,py))
+                    return SEARCH_ENCLOSED
+                touched = set()
+                exit = drain() # Execute the drain function for each x,y
+                if profile is not None:
+                    profile.searches += 1
+                    profile.visited += len(touched)
+                    profile.search_exits[exit] += 1
+                # The search either reached a way out, or the cube pools
+                if exit in (SEARCH_DRAINS_OUT, SEARCH_EDGE): 
+                    current_cube.drains_out = True 
+                else:
+                    current_cube.content = CONTENT_WATER
+                    if statistics is not None:
+                        statistics.add_level(flood_level, 1)
+                        statistics.wet[y*length+x] = 1
+        if profile is not None:
+            profile.levels.append(time.perf_counter()-level_start)
+        if checkpoint is not None:
+            checkpoint.level_done(cube_matrix, topo_grid, flood_level+1)
     return cube_matrix # The final 3d array of TopoCubes which includes water
-    
-def flood_statistics(cube_matrix, request=None): 
+
+def priority_flood(topo_grid, workers=1):
     """
-    This function produces two simple statistics of the fully flooded 3d cube 
-    matrix produced by the simulate_flood() function. 
+    Computes the final water surface of every square in a 2D grid of heights
+    without extruding it into cubes. Water can only leave the board over its
+    edges, so the edge squares seed a min-heap, and the board is then flooded
+    inwards from the lowest known square. A square reached from a lower water
+    surface pools up to that surface, otherwise it keeps its own height. This
+    visits every square once, so the cost is about O(N log N) for N squares
+    regardless of the board's maximum height.
 
     Parameters
     ----------
-    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
-        A 3D Python array of TopoCode objects that have been flooded with
-        simulate_flood()
-    
+    topo_grid : 2D arr/list of lists
+        A 2d Python array of heights, groomed by prepare_grid()
+    workers : int, optional, default 1
+        Number of worker processes, see priority_flood_levels()
+
     Returns
     -------
-    total_flooding (selectable) : int 
-        Number of cubes in the 3D grid that retained water
-    max_water_level (selectable) : int
-        Highest level of water that remained after flooding the 3D grid
-  
-    """  
-    
-    total_flooding, max_water_level = 0, 0
-    
-    # Crawl through entire 3D matrix, count flooded cells and track max level
-    for x in cube_matrix:
-        for y in x:
-            for z_index, z in enumerate(y):
-                if z.content == CONTENT_WATER:
-                    total_flooding +=1
-                    max_water_level = max(z_index+1, max_water_level)
-    
-    # By default, function returns both stats, but either may be selected
-    if request == 'total':
-        return total_flooding
-    elif request == 'maximum level':
-        return max_water_level
-    else:
-        return (total_flooding, max_water_level)
+    water_surface : 2D arr/list of lists
+        A 2d Python array of the same shape holding the water surface of each
+        square, which equals the square's height wherever no water pools
+    """
+    width = len(topo_grid)
+    length = len(topo_grid[0])
+    # Work on flat lists indexed by y*length+x, which are much faster to access
+    heights = [height for row in topo_grid for height in row]
+    surface = priority_flood_levels(heights, length, width, workers)
+    return [surface[y*length:(y+1)*length] for y in range(width)]
 
-def full_simulation(topo_grid=None, length=args.grid_length, 
-    width=args.grid_width, max_height=args.max_height):
+def board_drains(heights, length, width, nodata=NODATA):
     """
-    This function wraps all of the function and class calls required for flood 
-    simulation into one function. This function is automatically called when 
-    the script is invoked. It passes all arguments into the prepare_grid()
-    function whether customized or defaulted to None, where they are then 
-    handled appropriately. 
+    Finds the squares of a 2D grid of heights where water leaves the board:
+    the squares of its edges, and the squares next to a square outside the
+    board. The squares along the outside of the board are found from either
+    side of it, whichever has fewer squares, so that a small site within a
+    large grid costs as little as a large site within a small grid.
 
     Parameters
     ----------
-    topo_grid : 2D arr / list of lists, optional
-        A 2d Python array, square or rectangular
-    length : int, optional, defaults to DEFAULT_LENGTH
-        Desired length of a randomized 2D grid
+    heights : list or flat buffer
+        Flat heights of every square, indexed by y*length+x
+    length : int
+        Length (x axis) of the 2D grid
+    width : int
+        Width (y axis) of the 2D grid
+    nodata : int or float, optional, defaults to NODATA
+        Height of the squares outside the board
+
+    Returns
+    -------
+    (drains, resolved) : tuple (list, bytearray)
+        Flat index of every square inside the board which drains, and 1 for
+        each of them and for every square outside the board
+    """
+    squares = length*width
+    outside = None
+    if nodata in heights:
+        outside = bytearray(map(operator.eq, heights, repeat(nodata)))
+    resolved = bytearray(outside) if outside is not None \
+        else bytearray(squares)
+
+    drains = []
+    edges = {*range(length), *range(squares-length, squares),
+        *range(0, squares, length), *range(length-1, squares, length)}
+    for i in sorted(edges):
+        if not resolved[i]:
+            resolved[i] = 1
+            drains.append(i)
+    if outside is None:
+        return drains, resolved
+
+    outside_count = outside.count(1)
+    if outside_count <= squares-outside_count:
+        # Drain the squares inside the board next to each outside square
+        for i in compress(range(squares), outside):
+            y, x = divmod(i, length)
+            # Branch out from the square in 4 NESW directions
+            for n, inside in ((i-length, y>0), (i+1, x<length-1),
+                              (i+length, y<width-1), (i-1, x>0)):
+                if inside and not resolved[n]:
+                    resolved[n] = 1
+                    drains.append(n)
+    else:
+        # Drain each square inside the board next to an outside square
+        for i in compress(range(squares), map(operator.not_, resolved)):
+            y, x = divmod(i, length)
+            for n, inside in ((i-length, y>0), (i+1, x<length-1),
+                              (i+length, y<width-1), (i-1, x>0)):
+                if inside and outside[n]:
+                    resolved[i] = 1
+                    drains.append(i)
+                    break
+    return drains, resolved
+
+def priority_flood_levels(heights, length, width, workers=1, nodata=NODATA):
+    """
+    The flat version of priority_flood(), which works on a single list of
+    heights indexed by y*length+x. Heights may be integers or floats of any
+    magnitude, since only their order matters to the flood. With more than
+    one worker, the board is split into tiles which a pool of processes
+    floods against shared memory with floodtiles.parallel_flood_levels(),
+    and the water surface is identical to that of a single process. Squares
+    outside the board keep their nodata height, and are never visited.
+
+    Parameters
+    ----------
+    heights : list
+        Flat list of the heights of every square, indexed by y*length+x
+    length : int
+        Length (x axis) of the 2D grid
+    width : int
+        Width (y axis) of the 2D grid
+    workers : int, optional, default 1
+        Number of worker processes
+    nodata : int or float, optional, defaults to NODATA
+        Height of the squares outside the board
+
+    Returns
+    -------
+    surface : list
+        Flat list of the water surface of every square
+    """
+    if workers > 1:
+        if nodata in heights:
+            raise ValueError("Boards with squares outside them are flooded " +
+                "in a single process, flood with one worker")
+        return floodtiles.parallel_flood_levels(heights, length, width, 
+            workers)
+
+    surface = list(heights)
+
+    # Seed the heap with every square which drains off the board, along its
+    # edges and around the squares outside it
+    drains, resolved = board_drains(heights, length, width, nodata)
+    heap = [(heights[i], i) for i in drains]
+    heapq.heapify(heap)
+
+    # Squares filled up to the current level skip the heap altogether
+    pit = []
+    while heap or pit:
+        if pit:
+            level, i = pit.pop()
+        else:
+            level, i = heapq.heappop(heap)
+        y, x = divmod(i, length)
+        # Branch out from the current square in 4 NESW directions
+        for n, inside in ((i-length, y>0), (i+1, x<length-1),
+                          (i+length, y<width-1), (i-1, x>0)):
+            if not inside or resolved[n]:
+                continue
+            resolved[n] = 1
+            if heights[n] <= level:
+                # Lower squares pool up to the surface they were reached from
+                surface[n] = level
+                pit.append((level, n))
+            else:
+                heapq.heappush(heap, (heights[n], n))
+
+    return surface
+
+class FloodSurface:
+    """
+    FloodSurface holds the result of flooding a 2D grid of heights without
+    extruding it into cubes: the height and final water surface of every
+    square. Heights may be floats or integers of any magnitude, such as a DEM
+    in millimetres, because the memory and time needed depend only on the
+    number of squares and never on the range of heights. It is produced by
+    flood_surface(), and flood_statistics() accepts it in place of a 3D cube
+    matrix. Squares outside the board hold no water, and keep their nodata
+    height as their water surface.
+
+    ...
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists, or floodio raster
+        A 2d Python array of heights, groomed by prepare_grid(), or a raster
+        whose flat heights are used in place without building any rows
+    water_surface : list
+        Flat list of the water surface of every square, indexed by y*length+x
+    basins : BasinIndex, optional
+        Basins of the grid, when they were indexed while flooding
+
+    Attributes
+    ----------
+    length : int
+        the length from the 2D grid input
+    width : int
+        the width from the 2D grid input
+    heights : list or flat buffer
+        flat list of the height of every square, indexed by y*length+x
+    levels : list
+        flat list of the water surface of every square
+    nodata : int or float or None
+        height of the squares outside the board
+    continuous : bool
+        True if any height is a float, in which case volumes are summed as
+        real numbers
+    basins : BasinIndex or None
+        Basins of the grid
+
+    Methods
+    -------
+    water_level(x, y)
+        Water surface of a square
+    depth(x, y)
+        Depth of the water standing on a square
+    water_surface()
+        The water surface of every square as a 2D array
+    statistics()
+        Total flooding and maximum water level, as with flood_statistics()
+    """
+
+    def __init__(self, topo_grid, water_surface, basins=None):
+        self.levels = water_surface
+        self.basins = basins
+        self.nodata = NODATA
+        if isinstance(topo_grid, floodio.RASTER_TYPES):
+            self.width, self.length = topo_grid.width, topo_grid.length
+            self.heights = topo_grid.flat()
+            self.continuous = topo_grid.floating
+            self.nodata = topo_grid.nodata
+            return
+        self.width = len(topo_grid)
+        self.length = len(topo_grid[0])
+        self.heights = [height for row in topo_grid for height in row]
+        self.continuous = any(isinstance(height, float) 
+            for height in self.heights)
+
+    def water_level(self, x, y):
+        return self.levels[y*self.length+x]
+
+    def depth(self, x, y):
+        i = y*self.length+x
+        if self.heights[i] == self.nodata:
+            return 0
+        return self.levels[i]-self.heights[i]
+
+    def water_surface(self):
+        return [self.levels[y*self.length:(y+1)*self.length] 
+            for y in range(self.width)]
+
+    def statistics(self):
+        # Squares outside the board are skipped, as they hold no water
+        depths = [level-height for level, height 
+            in zip(self.levels, self.heights) 
+            if level is not NODATA and level > height]
+        # Real volumes are summed without accumulating rounding errors
+        total_flooding = math.fsum(depths) if self.continuous else sum(depths)
+        max_water_level = max((level for level, height 
+            in zip(self.levels, self.heights) 
+            if level is not NODATA and level > height), default=0)
+        return (total_flooding, max_water_level)
+
+def flood_surface(topo_grid, workers=1, basins=False):
+    """
+    Floods a 2D grid of heights with priority_flood_levels() and returns the
+    result as a FloodSurface, without ever building a 3D cube matrix. This is
+    the continuous mode of the simulation, which accepts float heights and
+    large integer heights alike.
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists, or floodio raster
+        A 2d Python array of heights, groomed by prepare_grid(), or a raster
+        from floodio.open_heights(), which is flooded straight from its 
+        buffer
+    workers : int, optional, default 1
+        Number of worker processes, see priority_flood_levels()
+    basins : bool, optional, default False
+        Index the basins while flooding with priority_flood_basins(), which
+        runs in a single process
+
+    Returns
+    -------
+    surface : FloodSurface
+        The heights and final water surface of every square
+    """
+    if isinstance(topo_grid, floodio.RASTER_TYPES):
+        heights = topo_grid.flat()
+        length, width = topo_grid.length, topo_grid.width
+        nodata = topo_grid.nodata
+    else:
+        width = len(topo_grid)
+        length = len(topo_grid[0])
+        heights = [height for row in topo_grid for height in row]
+        nodata = NODATA
+    if basins:
+        if workers > 1:
+            raise ValueError("Basins are indexed in a single process, " +
+                "flood with one worker")
+        return FloodSurface(topo_grid, 
+            *priority_flood_basins(heights, length, width, nodata))
+    return FloodSurface(topo_grid, 
+        priority_flood_levels(heights, length, width, workers, nodata))
+
+class Basin(namedtuple('Basin', ['basin_id', 'spill_elevation', 
+    'spill_point', 'area', 'volume'])):
+    """
+    The statistics of one basin of a BasinIndex: its id, the water surface
+    at which it spills, the (x, y) square it spills over, the number of its
+    squares under water and the volume of water it holds.
+    """
+
+    __slots__ = ()
+
+class BasinIndex:
+    """
+    BasinIndex labels every square of a flooded 2D grid with the basin it
+    belongs to, where a basin is a connected region of squares under water,
+    and keeps the statistics of every basin. It is built by
+    priority_flood_basins() while flooding, so looking up the basin of a
+    square or the statistics of a basin takes constant time, and the basins
+    are ranked by volume once rather than on every query.
+
+    ...
+    Parameters
+    ----------
+    length : int
+        Length (x axis) of the 2D grid
+    width : int
+        Width (y axis) of the 2D grid
+    labels : array of ints
+        Flat basin id of every square, indexed by y*length+x, 0 where dry
+    spill_elevations, spill_points, areas, volumes : lists
+        Statistics of the basins, indexed by basin id from 1 up
+
+    Attributes
+    ----------
+    ranking : list of ints
+        Basin ids from the largest volume to the smallest
+
+    Methods
+    -------
+    basin_id(x, y)
+        Id of the basin of a square, or 0 if the square is dry
+    basin(basin_id)
+        Basin of an id
+    basin_at(x, y)
+        Basin of a square, or None if the square is dry
+    largest(count)
+        Basins of the largest volumes, largest first
+    """
+
+    def __init__(self, length, width, labels, spill_elevations, spill_points,
+        areas, volumes):
+        self.length = length
+        self.width = width
+        self.labels = labels
+        self.spill_elevations = spill_elevations
+        self.spill_points = spill_points
+        self.areas = areas
+        self.volumes = volumes
+        self.ranking = sorted(range(1, len(volumes)), 
+            key=volumes.__getitem__, reverse=True)
+
+    def basin_id(self, x, y):
+        return self.labels[y*self.length+x]
+
+    def basin(self, basin_id):
+        if not 0 < basin_id < len(self.volumes):
+            raise IndexError(f'No basin {basin_id}')
+        return Basin(basin_id, self.spill_elevations[basin_id], 
+            self.spill_points[basin_id], self.areas[basin_id], 
+            self.volumes[basin_id])
+
+    def basin_at(self, x, y):
+        basin_id = self.basin_id(x, y)
+        return self.basin(basin_id) if basin_id else None
+
+    def largest(self, count=None):
+        return [self.basin(basin_id) for basin_id in self.ranking[:count]]
+
+    def __len__(self):
+        return len(self.ranking)
+
+    def __iter__(self):
+        for basin_id in range(1, len(self.volumes)):
+            yield self.basin(basin_id)
+
+def priority_flood_basins(heights, length, width, nodata=NODATA):
+    """
+    The priority flood of priority_flood_levels(), which also labels the
+    basins as it floods them. A square under water joins the basin of the
+    square it was reached from, or starts a new basin spilling over that
+    square when it was reached from a dry one. The basins of neighbouring
+    squares under water are merged with a disjoint-set structure, since a
+    pond may be reached over several dry squares of its spill elevation.
+    The area and volume of each basin are counted as its squares are
+    flooded, and added together when basins merge.
+
+    Parameters
+    ----------
+    heights : list or flat buffer
+        Flat heights of every square, indexed by y*length+x
+    length : int
+        Length (x axis) of the 2D grid
+    width : int
+        Width (y axis) of the 2D grid
+    nodata : int or float, optional, defaults to NODATA
+        Height of the squares outside the board, which drain their neighbours
+        and belong to no basin
+
+    Returns
+    -------
+    (surface, basins) : tuple (list, BasinIndex)
+        Flat water surface of every square, and the basins of the grid
+    """
+    surface = list(heights)
+    labels = array('i', bytes(4*length*width))
+    # Statistics of every basin by id, where id 0 stands for dry squares
+    parent, spill_elevations, spill_points = [0], [None], [None]
+    areas, volumes = [0], [0]
+
+    def find(basin_id):
+        while parent[basin_id] != basin_id:
+            parent[basin_id] = parent[parent[basin_id]] # Path halving
+            basin_id = parent[basin_id]
+        return basin_id
+
+    drains, resolved = board_drains(heights, length, width, nodata)
+    heap = [(heights[i], i) for i in drains]
+    heapq.heapify(heap)
+
+    pit = []
+    while heap or pit:
+        if pit:
+            level, i = pit.pop()
+        else:
+            level, i = heapq.heappop(heap)
+        y, x = divmod(i, length)
+        basin_id = labels[i]
+        root = find(basin_id) if basin_id else 0
+        for n, inside in ((i-length, y>0), (i+1, x<length-1),
+                          (i+length, y<width-1), (i-1, x>0)):
+            if not inside:
+                continue
+            if resolved[n]:
+                # Neighbouring squares under water belong to one basin, 
+                # which keeps the lower id and the spill point found first
+                other = labels[n]
+                if root and other and other != basin_id:
+                    other = find(other)
+                    if other != root:
+                        root, other = min(root, other), max(root, other)
+                        parent[other] = root
+                        areas[root] += areas[other]
+                        volumes[root] += volumes[other]
+                continue
+            resolved[n] = 1
+            height = heights[n]
+            if height < level:
+                surface[n] = level
+                if root:
+                    labels[n] = basin_id
+                    areas[root] += 1
+                    volumes[root] += level-height
+                else:
+                    # Water reached from a dry square spills over it
+                    labels[n] = len(parent)
+                    parent.append(len(parent))
+                    spill_elevations.append(level)
+                    spill_points.append((x, y))
+                    areas.append(1)
+                    volumes.append(level-height)
+                pit.append((level, n))
+            elif height == level:
+                pit.append((level, n))
+            else:
+                heapq.heappush(heap, (height, n))
+
+    # Number the merged basins from 1 up in the order they were found, and
+    # relabel the squares in a single pass
+    numbers, roots = [0]*len(parent), [0]
+    for basin_id in range(1, len(parent)):
+        if find(basin_id) == basin_id:
+            roots.append(basin_id)
+            numbers[basin_id] = len(roots)-1
+    if len(roots) < len(parent):
+        numbers = [numbers[find(basin_id)] for basin_id in range(len(parent))]
+        labels = array('i', map(numbers.__getitem__, labels))
+    return surface, BasinIndex(length, width, labels, 
+        [spill_elevations[root] for root in roots],
+        [spill_points[root] for root in roots],
+        [areas[root] for root in roots], [volumes[root] for root in roots])
+
+def flood_basins(topo_grid):
+    """
+    Floods a 2D grid of heights and indexes its basins with
+    priority_flood_basins().
+
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists, or floodio raster
+        A 2d Python array of heights, groomed by prepare_grid(), or a raster
+        from floodio.open_heights()
+
+    Returns
+    -------
+    basins : BasinIndex
+    """
+    if isinstance(topo_grid, floodio.RASTER_TYPES):
+        return priority_flood_basins(topo_grid.flat(), topo_grid.length,
+            topo_grid.width, topo_grid.nodata)[1]
+    heights = [height for row in topo_grid for height in row]
+    return priority_flood_basins(heights, len(topo_grid[0]), 
+        len(topo_grid))[1]
+
+class FloodModel:
+    """
+    FloodModel keeps the solved water surface of a 2D grid of heights, so that
+    local edits to the board such as raising a berm or cutting a channel are
+    re-flooded without solving the whole board again. Alongside the water
+    surface it keeps the tree of the priority flood: every square remembers
+    the neighbour whose water surface reached it first, and its own surface
+    is the higher of its height and that neighbour's surface.
+
+    Raising a square can only raise the water of the squares that were
+    reached through it, so only that subtree is flooded again, from the
+    unchanged squares around it. Lowering a square can only lower water, and
+    the lower surface is spread outwards from the square for only as long as
+    it lowers the squares it reaches. Either way an edit costs time in
+    proportion to the drainage region it affects rather than to the board.
+
+    ...
+    Parameters
+    ----------
+    topo_grid : 2D arr/list of lists
+        A 2d Python array of heights, groomed by prepare_grid()
+
+    Attributes
+    ----------
+    length : int
+        the length from the 2D grid input
+    width : int
+        the width from the 2D grid input
+    heights : list
+        flat list of the height of every square, indexed by y*length+x
+    levels : list
+        flat list of the water surface of every square
+    parents : list
+        flat list of the square each square's water surface came from, or -1
+        for the edge squares which seed the flood
+    total_flooding : int or float
+        running volume of the water on the board
+
+    Methods
+    -------
+    set_height(x, y, height)
+        Changes the height of one square and re-floods the affected region
+    set_heights(edits)
+        Applies several (x, y, height) edits in turn
+    water_level(x, y)
+        Water surface of a square
+    depth(x, y)
+        Depth of the water standing on a square
+    statistics()
+        Total flooding and maximum water level, as with flood_statistics()
+    surface()
+        A FloodSurface snapshot of the current board
+    """
+
+    def __init__(self, topo_grid):
+        self.width = len(topo_grid)
+        self.length = len(topo_grid[0])
+        self.heights = [height for row in topo_grid for height in row]
+        if NODATA in self.heights:
+            raise ValueError("FloodModel re-floods boards without any " +
+                "squares outside them")
+        self.levels = list(self.heights)
+        self.parents = [-1]*len(self.heights)
+        # Number of wet squares at each water level, to track the maximum
+        self.wet_levels = {}
+        self.total_flooding = 0
+
+        self.flood_region(range(len(self.heights)))
+
+    def neighbours(self, i):
+        y, x = divmod(i, self.length)
+        return [n for n, inside in ((i-self.length, y>0), 
+            (i+1, x<self.length-1), (i+self.length, y<self.width-1), 
+            (i-1, x>0)) if inside]
+
+    def is_edge(self, i):
+        y, x = divmod(i, self.length)
+        return 0 in (x,y) or x == self.length-1 or y == self.width-1
+
+    def forget(self, i):
+        # Remove a square's water from the running statistics
+        if self.levels[i] > self.heights[i]:
+            self.total_flooding -= self.levels[i]-self.heights[i]
+            self.wet_levels[self.levels[i]] -= 1
+            if not self.wet_levels[self.levels[i]]:
+                del self.wet_levels[self.levels[i]]
+
+    def record(self, i):
+        # Add a square's water to the running statistics
+        if self.levels[i] > self.heights[i]:
+            self.total_flooding += self.levels[i]-self.heights[i]
+            self.wet_levels[self.levels[i]] = \
+                self.wet_levels.get(self.levels[i], 0) + 1
+
+    def flood_region(self, region):
+        """
+        Floods a region of squares with the priority flood, seeded by the edge
+        squares inside the region and by the squares just outside of it, whose
+        water surface is known and stays the same.
+        """
+        heights, levels, parents = self.heights, self.levels, self.parents
+        inside_region = bytearray(len(heights))
+        for i in region:
+            inside_region[i] = 1
+
+        heap = []
+        for i in region:
+            if self.is_edge(i):
+                inside_region[i] = 0
+                levels[i], parents[i] = heights[i], -1
+                heap.append((levels[i], i))
+                continue
+            for n in self.neighbours(i):
+                if not inside_region[n]:
+                    heap.append((levels[n], n))
+        heapq.heapify(heap)
+
+        pit = []
+        while heap or pit:
+            level, i = pit.pop() if pit else heapq.heappop(heap)
+            for n in self.neighbours(i):
+                if not inside_region[n]:
+                    continue
+                inside_region[n] = 0
+                parents[n] = i
+                if heights[n] <= level:
+                    levels[n] = level
+                    pit.append((level, n))
+                else:
+                    levels[n] = heights[n]
+                    heapq.heappush(heap, (levels[n], n))
+        for i in region:
+            self.record(i)
+
+    def set_height(self, x, y, height):
+        """
+        Changes the height of the square at (x, y) and re-floods only the
+        region whose water can be affected by the change.
+
+        Returns
+        -------
+        (total_flooding, max_water_level) : tuple
+            The updated statistics, as with flood_statistics()
+        """
+        e = y*self.length+x
+        old_height = self.heights[e]
+        if height == old_height:
+            return self.statistics()
+
+        if height > old_height:
+            if height <= self.levels[e]:
+                # Raising the floor of a pond leaves its surface unchanged
+                self.forget(e)
+                self.heights[e] = height
+                self.record(e)
+                return self.statistics()
+
+            # Only the squares whose water came through e can rise
+            subtree, position = [e], 0
+            while position < len(subtree):
+                for n in self.neighbours(subtree[position]):
+                    if self.parents[n] == subtree[position]:
+                        subtree.append(n)
+                position += 1
+            for i in subtree:
+                self.forget(i)
+            self.heights[e] = height
+            self.flood_region(subtree)
+            return self.statistics()
+
+        # Lowering e, it keeps the lowest surface reaching it from a neighbour
+        # which does not depend on it. Neighbours below e's old surface cannot
+        # depend on it, failing those its own parent is the lowest.
+        self.forget(e)
+        self.heights[e] = height
+        if self.is_edge(e):
+            level, parent = height, -1
+        else:
+            lower = [(self.levels[n], n) for n in self.neighbours(e) 
+                if self.levels[n] < self.levels[e]]
+            parent_level, parent = min(lower) if lower else \
+                (self.levels[self.parents[e]], self.parents[e])
+            level = max(height, parent_level)
+        lowered = level < self.levels[e]
+        self.levels[e], self.parents[e] = level, parent
+        self.record(e)
+
+        # Spread the lower surface for as long as it lowers other squares
+        heap = [(level, e)] if lowered else []
+        while heap:
+            level, i = heapq.heappop(heap)
+            if level > self.levels[i]:
+                continue
+            for n in self.neighbours(i):
+                candidate = max(level, self.heights[n])
+                if candidate < self.levels[n]:
+                    self.forget(n)
+                    self.levels[n], self.parents[n] = candidate, i
+                    self.record(n)
+                    heapq.heappush(heap, (candidate, n))
+        return self.statistics()
+
+    def set_heights(self, edits):
+        """
+        Applies several (x, y, height) edits in turn with set_height().
+
+        Returns
+        -------
+        (total_flooding, max_water_level) : tuple
+            The updated statistics, as with flood_statistics()
+        """
+        for x, y, height in edits:
+            self.set_height(x, y, height)
+        return self.statistics()
+
+    def water_level(self, x, y):
+        return self.levels[y*self.length+x]
+
+    def depth(self, x, y):
+        i = y*self.length+x
+        return self.levels[i]-self.heights[i]
+
+    def statistics(self):
+        return (self.total_flooding, max(self.wet_levels, default=0))
+
+    def surface(self):
+        return FloodSurface([self.heights[y*self.length:(y+1)*self.length] 
+            for y in range(self.width)], list(self.levels))
+
+def grid_height(cube_matrix):
+    """
+    Reads the height (z axis) of a 3D matrix from its first column inside the
+    board, as the columns outside the board hold no cubes.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+
+    Returns
+    -------
+    height : int
+    """
+    if isinstance(cube_matrix, (VoxelStore, ColumnStore)):
+        return cube_matrix.height
+    return next((len(column) for plane in cube_matrix for column in plane 
+        if column is not None), 0)
+
+def outside_columns(cube_matrix):
+    """
+    Finds the columns of a 3D matrix outside the board, without building a
+    view of every column of a VoxelStore or ColumnStore.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+
+    Returns
+    -------
+    outside : bytes-like
+        1 for every column outside the board, indexed as x*width+y
+    """
+    if isinstance(cube_matrix, (VoxelStore, ColumnStore)):
+        return cube_matrix.outside or bytes(cube_matrix.length*
+            cube_matrix.width)
+    return bytes(map(operator.is_, chain.from_iterable(cube_matrix), 
+        repeat(None)))
+
+def inside_columns(cube_matrix, outside=None):
+    """
+    Lists the columns of a 3D matrix inside the board. They are picked out
+    of the mask of outside_columns() in C, so a site in a large bounding box
+    costs no Python step per column outside it.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+    outside : bytes-like, optional
+        1 for every column outside the board, by default that of the matrix
+
+    Returns
+    -------
+    columns : iterable of ints
+        x*width+y of every column inside the board, in order
+    """
+    if outside is None:
+        if isinstance(cube_matrix, VoxelStore) and \
+            cube_matrix.columns is not None:
+            return cube_matrix.columns
+        outside = outside_columns(cube_matrix)
+    if 1 not in outside:
+        return range(len(outside))
+    return compress(range(len(outside)), map(operator.not_, outside))
+
+def column_heights(cube_matrix):
+    """
+    Reads the height of the board in every column of a 3D matrix, which is
+    the number of board cubes extruded upwards from the bottom of the column,
+    or NODATA for the columns outside the board.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+
+    Returns
+    -------
+    topo_grid : 2D arr/list of lists
+        A 2d Python array of the board heights, indexed as topo_grid[y][x]
+    """
+    length = len(cube_matrix)
+    width = len(cube_matrix[0])
+    height = grid_height(cube_matrix)
+
+    # A VoxelStore searches whole columns at once, and a ColumnStore knows
+    # the height of each column. Only the columns inside the board are read
+    topo_grid = [[NODATA]*length for y in range(width)]
+    if isinstance(cube_matrix, (VoxelStore, ColumnStore)):
+        for column in inside_columns(cube_matrix):
+            x, y = divmod(column, width)
+            topo_grid[y][x] = cube_matrix.column_height(x, y)
+        return topo_grid
+
+    for x, y in map(divmod, inside_columns(cube_matrix), repeat(width)):
+        column = cube_matrix[x][y]
+        z = 0
+        while z < height and column[z].content == CONTENT_BOARD:
+            z += 1
+        topo_grid[y][x] = z
+    return topo_grid
+
+def priority_flood_cubes(cube_matrix, workers=1, statistics=None):
+    """
+    The priority flood engine for simulate_flood(). It reads the board height
+    of each column from the 3D matrix, computes the water surface over the 2D
+    grid with priority_flood(), then fills each column with water up to that
+    surface.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+    workers : int, optional, default 1
+        Number of worker processes, see priority_flood_levels()
+    statistics : FloodStatistics, optional
+        Counts the water of every column as it is filled
+
+    Returns
+    -------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        The same 3D Python array, with water cubes filled in
+    """
+    topo_grid = column_heights(cube_matrix)
+    water_surface = priority_flood(topo_grid, workers)
+
+    width = len(topo_grid)
+    for x, y in map(divmod, inside_columns(cube_matrix), repeat(width)):
+        if statistics is not None:
+            statistics.add_column(y*len(cube_matrix)+x, topo_grid[y][x],
+                water_surface[y][x])
+        # A VoxelStore or ColumnStore fills whole columns at once
+        if isinstance(cube_matrix, (VoxelStore, ColumnStore)):
+            cube_matrix.fill_column(x, y, topo_grid[y][x], 
+                water_surface[y][x], CONTENT_WATER)
+            continue
+        column = cube_matrix[x][y]
+        for z in range(topo_grid[y][x], water_surface[y][x]):
+            column[z].content = CONTENT_WATER
+    return cube_matrix
+
+def level_sweep_flood(cube_matrix, profile=None, checkpoint=None,
+    statistics=None):
+    """
+    The level sweep engine for simulate_flood(). Like the pathfinding engine
+    it floods the 3D matrix one level at a time beginning at the bottom, but
+    instead of searching from every air cube it keeps the connected regions of
+    air in a disjoint-set (union-find) structure. A column joins the air of a
+    level once the level reaches the top of its board, and is merged with its
+    neighbouring air regions, so the regions of the previous level are reused
+    rather than searched again. A region drains if it contains an edge square
+    or a square next to the board's outside, and every air cube of a region
+    which does not drain holds water. Columns outside the board never join.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects generated in MakeCartesianGrid
+    profile : FloodProfile, optional
+        Receives the time of each level
+    checkpoint : FloodCheckpoint, optional
+        Saves the finished levels, and restores them first when resuming
+    statistics : FloodStatistics, optional
+        Counts the water of every region as it is written
+
+    Returns
+    -------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        The same 3D Python array, with water cubes filled in
+    """
+    length = len(cube_matrix)
+    width = len(cube_matrix[0])
+    height = grid_height(cube_matrix)
+    topo_grid = column_heights(cube_matrix)
+
+    # Squares are indexed as y*length+x, and grouped by the level at which
+    # their column turns into air. The squares inside the board are picked
+    # out in C, and numbered from 0 up by positions for the disjoint sets,
+    # so the squares outside the board cost no Python step nor any room.
+    # Those outside all take the last position, which never turns into air
+    heights = list(chain.from_iterable(topo_grid))
+    squares = range(length*width)
+    positions = squares
+    if NODATA in heights:
+        squares = array('i', compress(squares, 
+            map(operator.is_not, heights, repeat(NODATA))))
+        positions = array('i', [len(squares)])*(length*width)
+        for k, i in enumerate(squares):
+            positions[i] = k
+    squares_by_level = [[] for z in range(height+1)]
+    for i in squares:
+        squares_by_level[heights[i]].append(i)
+
+    # Disjoint-set forest of the air squares, by position. Only the root of
+    # each region keeps the region's size, drainage flag and list of member
+    # squares. The squares along the edges and the outside of the board
+    # drain from the start
+    parent = list(range(len(squares)))
+    size = [1]*len(squares)
+    members = [None]*len(squares)
+    drains = bytearray(len(squares))
+    for i in board_drains(heights, length, width)[0]:
+        drains[positions[i]] = 1
+    is_air = bytearray(len(squares)+1)
+    pooling = set() # roots of the regions which do not drain
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]] # Path halving
+            i = parent[i]
+        return i
+
+    # Water is written straight into the buffer of a VoxelStore
+    compact = isinstance(cube_matrix, VoxelStore)
+    # The regions of the levels restored from a checkpoint are merged again,
+    # but their water is already in place
+    start_level = 0
+    if checkpoint is not None:
+        start_level = checkpoint.restore(cube_matrix, topo_grid, statistics)
+
+    for flood_level in range(height):
+        if profile is not None:
+            level_start = time.perf_counter()
+        # Add the squares whose column turns into air on this level
+        for i in squares_by_level[flood_level]:
+            y, x = divmod(i, length)
+            k = positions[i]
+            is_air[k] = 1
+            members[k] = [i]
+            if not drains[k]:
+                pooling.add(k)
+            # Merge with the air regions in 4 NESW directions
+            for n, inside in ((i-length, y>0), (i+1, x<length-1),
+                              (i+length, y<width-1), (i-1, x>0)):
+                if not inside:
+                    continue
+                n = positions[n]
+                if not is_air[n]:
+                    continue
+                root, other = find(k), find(n)
+                if root == other:
+                    continue
+                # Union by size, moving the smaller list of members
+                if size[root] < size[other]:
+                    root, other = other, root
+                parent[other] = root
+                size[root] += size[other]
+                members[root].extend(members[other])
+                members[other] = None
+                pooling.discard(other)
+                if drains[other] or drains[root]:
+                    drains[root] = 1
+                    pooling.discard(root)
+
+        # Every air square of a region which does not drain holds water
+        for root in pooling if flood_level >= start_level else ():
+            if statistics is not None:
+                statistics.add_level(flood_level, len(members[root]))
+                for i in members[root]:
+                    statistics.wet[i] = 1
+            for i in members[root]:
+                y, x = divmod(i, length)
+                if compact:
+                    cube_matrix.content[cube_matrix.index(x, y, flood_level)] \
+                        = CONTENT_WATER
+                else:
+                    cube_matrix[x][y][flood_level].content = CONTENT_WATER
+        if profile is not None:
+            profile.levels.append(time.perf_counter()-level_start)
+        if checkpoint is not None and flood_level >= start_level:
+            checkpoint.level_done(cube_matrix, topo_grid, flood_level+1)
+    return cube_matrix
+
+# Registry of the engines that simulate_flood() may delegate to
+FLOOD_ENGINES = {
+    ENGINE_PATHFINDING: pathfinding_flood,
+    ENGINE_PRIORITY_FLOOD: priority_flood_cubes,
+    ENGINE_LEVEL_SWEEP: level_sweep_flood,
+}
+
+def flood_statistics(cube_matrix, request=None): 
+    """
+    This function produces two simple statistics of the fully flooded 3d cube 
+    matrix produced by the simulate_flood() function, or of the FloodSurface
+    produced by flood_surface(). 
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects that have been flooded with
+        simulate_flood(), a VoxelStore or ColumnStore, or a FloodSurface
+    
+    Returns
+    -------
+    total_flooding (selectable) : int or float
+        Number of cubes in the 3D grid that retained water, or the volume of
+        water retained by a FloodSurface
+    max_water_level (selectable) : int or float
+        Highest level of water that remained after flooding the 3D grid
+  
+    """  
+    
+    total_flooding, max_water_level = 0, 0
+    
+    if isinstance(cube_matrix, (FloodSurface, ColumnStore)):
+        total_flooding, max_water_level = cube_matrix.statistics()
+    elif isinstance(cube_matrix, VoxelStore):
+        # Count water in the whole buffer at once, then find the highest water
+        # cube of each column searching from the top
+        content = cube_matrix.content
+        total_flooding = content.count(CONTENT_WATER)
+        height = cube_matrix.height
+        for offset in range(0, len(content) if total_flooding else 0, height):
+            top = content.rfind(CONTENT_WATER, offset, offset+height)
+            if top >= 0:
+                max_water_level = max(top-offset+1, max_water_level)
+    else:
+        # Crawl through entire 3D matrix, count flooded cells and track max
+        for x in cube_matrix:
+            for y in x:
+                if y is None:
+                    continue
+                for z_index, z in enumerate(y):
+                    if z.content == CONTENT_WATER:
+                        total_flooding +=1
+                        max_water_level = max(z_index+1, max_water_level)
+    
+    # By default, function returns both stats, but either may be selected
+    if request == 'total':
+        return total_flooding
+    elif request == 'maximum level':
+        return max_water_level
+    else:
+        return (total_flooding, max_water_level)
+
+def surface_rows(cube_matrix):
+    """
+    Reads the height of the board and of the water surface of every square
+    of a flooded 3D matrix, or of a FloodSurface, one row at a time, so that
+    they may be streamed out without building a second copy of the grid.
+    The water surface of a dry square is the height of its board, and both
+    are NODATA outside the board.
+
+    Parameters
+    ----------
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects that have been flooded with
+        simulate_flood(), a VoxelStore or ColumnStore, or a FloodSurface
+
+    Yields
+    ------
+    (board_row, water_row) : tuple (list, list)
+        Board height and water surface of the squares of each row, from the
+        row at y = 0 up
+    """
+    if isinstance(cube_matrix, FloodSurface):
+        length = cube_matrix.length
+        for y in range(cube_matrix.width):
+            board_row = list(cube_matrix.heights[y*length:(y+1)*length])
+            water_row = list(cube_matrix.levels[y*length:(y+1)*length])
+            if cube_matrix.nodata is not NODATA:
+                board_row = [NODATA if board == cube_matrix.nodata else board
+                    for board in board_row]
+                water_row = [NODATA if board is NODATA else water
+                    for board, water in zip(board_row, water_row)]
+            yield board_row, water_row
+        return
+
+    length = len(cube_matrix)
+    width = len(cube_matrix[0])
+    height = grid_height(cube_matrix)
+    outside = outside_columns(cube_matrix)
+    water = bytes([CONTENT_WATER])
+    for y in range(width):
+        board_row, water_row = [], []
+        for x in range(length):
+            if outside[x*width+y]:
+                board_top = water_top = NODATA
+            elif isinstance(cube_matrix, ColumnStore):
+                column = x*width+y
+                board_top = cube_matrix.board_top[column]
+                water_top = cube_matrix.water_top[column]
+            elif isinstance(cube_matrix, VoxelStore):
+                # Count the water bytes on top of the board of the column
+                board_top = cube_matrix.column_height(x, y)
+                offset = cube_matrix.index(x, y, 0)
+                cubes = cube_matrix.content[offset+board_top:offset+height]
+                water_top = board_top + len(cubes) - len(cubes.lstrip(water))
+            else:
+                column = cube_matrix[x][y]
+                board_top = 0
+                while board_top < height and \
+                    column[board_top].content == CONTENT_BOARD:
+                    board_top += 1
+                water_top = board_top
+                while water_top < height and \
+                    column[water_top].content == CONTENT_WATER:
+                    water_top += 1
+            board_row.append(board_top)
+            water_row.append(water_top)
+        yield board_row, water_row
+
+def export_flood(path, cube_matrix, raster_format=None, dtype='<f4'):
+    """
+    Writes the result of a flood to a raster file one row at a time, as a
+    compact alternative to the text of print_cube_grid(). A .npz file holds
+    the board and water surfaces as its 'board' and 'water' arrays, and
+    every other format of floodio.write_raster() holds the depth of the
+    water standing on every square. floodio.load_raster() reads them back.
+    Squares outside the board are written as EXPORT_NODATA.
+
+    Parameters
+    ----------
+    path : str
+        Path of the raster file to create
+    cube_matrix : 3D arr / list of lists of lists of TopoCube objects
+        A 3D Python array of TopoCode objects that have been flooded with
+        simulate_flood(), a VoxelStore or ColumnStore, or a FloodSurface
+    raster_format : str, optional
+        'npz', or one of the formats of floodio.write_raster(), overriding
+        the extension of the path
+    dtype : str, optional, default '<f4'
+        NumPy style element type of binary formats
+    """
+    if isinstance(cube_matrix, FloodSurface):
+        length, width = cube_matrix.length, cube_matrix.width
+    else:
+        length, width = len(cube_matrix), len(cube_matrix[0])
+    if raster_format is None:
+        raster_format = os.path.splitext(path)[1].lower().lstrip('.')
+    if raster_format == 'npz':
+        # Each surface is streamed into its own member of the archive
+        floodio.write_npz(path, {
+            'board': ([EXPORT_NODATA if board is NODATA else board 
+                for board in board_row] for board_row, water_row
+                in surface_rows(cube_matrix)),
+            'water': ([EXPORT_NODATA if water is NODATA else water 
+                for water in water_row] for board_row, water_row
+                in surface_rows(cube_matrix)),
+            }, length, width, dtype)
+        return
+    floodio.write_raster(path, ([EXPORT_NODATA if board is NODATA 
+        else water-board for board, water in zip(board_row, water_row)] 
+        for board_row, water_row in surface_rows(cube_matrix)), length, 
+        width, dtype, nodata=EXPORT_NODATA, raster_format=raster_format)
+
+# Edge squares and neighbours of every board shape seen by simulate_many()
+SHAPE_TABLES = {}
+
+def shape_tables(length, width):
+    """
+    Computes, once per board shape, the tables that let simulate_many() flood
+    every board of that shape without any coordinate arithmetic: the edge
+    squares which seed the flood and the neighbours of every square.
+
+    Parameters
+    ----------
+    length : int
+        Length (x axis) of the boards
+    width : int
+        Width (y axis) of the boards
+
+    Returns
+    -------
+    (edges, edge_mask, neighbours) : tuple (list, bytes, list of tuples)
+        Flat positions of the edge squares, a mask flagging them, and the
+        flat positions of the neighbours of every square
+    """
+    if (length, width) not in SHAPE_TABLES:
+        edges, neighbours = [], []
+        edge_mask = bytearray(length*width)
+        for i in range(length*width):
+            y, x = divmod(i, length)
+            if 0 in (x,y) or x == length-1 or y == width-1:
+                edges.append(i)
+                edge_mask[i] = 1
+            neighbours.append(tuple(n for n, inside in ((i-length, y>0), 
+                (i+1, x<length-1), (i+length, y<width-1), (i-1, x>0)) 
+                if inside))
+        SHAPE_TABLES[(length, width)] = (edges, bytes(edge_mask), neighbours)
+    return SHAPE_TABLES[(length, width)]
+
+def flood_board_group(boards, length, width):
+    """
+    Floods a group of groomed boards which all share the same shape with the
+    priority flood, using the tables from shape_tables() for all of them, and
+    collects the statistics while flooding instead of in a second pass.
+
+    Parameters
+    ----------
+    boards : list of 2D arr/list of lists
+        Groomed boards of length x width squares
+    length : int
+        Length (x axis) of the boards
+    width : int
+        Width (y axis) of the boards
+
+    Returns
+    -------
+    results : list of tuples (total_flooding, max_water_level)
+        The flood_statistics() of every board, in order
+    """
+    edges, edge_mask, neighbours = shape_tables(length, width)
+    heappush, heappop = heapq.heappush, heapq.heappop
+    results = []
+    for board in boards:
+        heights = [height for row in board for height in row]
+        if NODATA in heights:
+            # Boards with squares outside them drain around those too
+            drains, resolved = board_drains(heights, length, width)
+        else:
+            drains, resolved = edges, bytearray(edge_mask)
+        heap = [(heights[i], i) for i in drains]
+        heapq.heapify(heap)
+        depths, max_water_level = [], 0
+
+        pit = []
+        while heap or pit:
+            level, i = pit.pop() if pit else heappop(heap)
+            for n in neighbours[i]:
+                if resolved[n]:
+                    continue
+                resolved[n] = 1
+                height = heights[n]
+                if height < level:
+                    depths.append(level-height)
+                    max_water_level = level
+                    pit.append((level, n))
+                elif height == level:
+                    pit.append((level, n))
+                else:
+                    heappush(heap, (height, n))
+
+        # Levels only rise as the flood goes on, so the last water is highest
+        if any(isinstance(depth, float) for depth in depths):
+            results.append((math.fsum(depths), max_water_level))
+        else:
+            results.append((sum(depths), max_water_level))
+    return results
+
+def simulate_board_chunk(boards):
+    """
+    Grooms a chunk of boards, groups them by shape and floods each group with
+    flood_board_group(). This is the unit of work of simulate_many()'s
+    worker processes.
+
+    Parameters
+    ----------
+    boards : list of 2D arr/list of lists
+        Boards of any shapes
+
+    Returns
+    -------
+    results : list of tuples (total_flooding, max_water_level)
+        The flood_statistics() of every board, in order
+    """
+    shapes = {}
+    for position, board in enumerate(boards):
+        board, board_max_height = groom_grid(board)
+        shapes.setdefault((len(board[0]), len(board)), []).append(position)
+
+    results = [None]*len(boards)
+    for (length, width), positions in shapes.items():
+        group = flood_board_group([boards[position] for position in positions],
+            length, width)
+        for position, result in zip(positions, group):
+            results[position] = result
+    return results
+
+def simulate_many(boards, workers=1, chunk_size=DEFAULT_BATCH_CHUNK):
+    """
+    Simulates the flooding of many boards in one call, without printing and
+    without building any cubes, and returns the same statistics as
+    full_simulation() for each of them. Boards of the same shape are flooded
+    together, and chunks of boards are spread over a pool of worker processes.
+
+    Parameters
+    ----------
+    boards : iterable of 2D arr/list of lists
+        Boards of any shapes, which are groomed in place like prepare_grid()
+    workers : int, optional, default 1
+        Number of worker processes
+    chunk_size : int, optional, defaults to DEFAULT_BATCH_CHUNK
+        Number of boards handed to a worker at a time
+
+    Returns
+    -------
+    results : list of tuples (total_flooding, max_water_level)
+        The statistics of every board, in order
+    """
+    return list(iter_simulate_many(boards, workers, chunk_size))
+
+def iter_simulate_many(boards, workers=1, chunk_size=DEFAULT_BATCH_CHUNK):
+    """
+    The streaming version of simulate_many(), which consumes the boards one
+    chunk at a time and yields the statistics of each board in order, so that
+    neither the boards nor the results need to fit in memory at once.
+    """
+    def chunks():
+        chunk = []
+        for board in boards:
+            chunk.append(board)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for results in pool.imap(simulate_board_chunk, chunks()):
+                yield from results
+    else:
+        for chunk in chunks():
+            yield from simulate_board_chunk(chunk)
+
+def run_batch(input_stream, output_stream, workers=1, 
+    chunk_size=DEFAULT_BATCH_CHUNK):
+    """
+    Reads boards as JSON lines and writes their statistics as JSON lines in
+    the same order, as used by the --batch argument. Each input line is either
+    a 2D array of heights or an object with a "grid" array and an optional
+    "id", which is copied to the matching result.
+
+    Parameters
+    ----------
+    input_stream : file object
+        Text stream of JSON lines, one board per line
+    output_stream : file object
+        Text stream receiving one JSON result per board
+    workers : int, optional, default 1
+        Number of worker processes, see simulate_many()
+    chunk_size : int, optional, defaults to DEFAULT_BATCH_CHUNK
+        Number of boards handed to a worker at a time
+    """
+    ids = []
+    def boards():
+        for line in input_stream:
+            if not line.strip():
+                continue
+            board = json.loads(line)
+            if isinstance(board, dict):
+                ids.append(board.get('id'))
+                board = board['grid']
+            else:
+                ids.append(None)
+            yield board
+
+    for position, (total_flooding, max_water_level) in enumerate(
+        iter_simulate_many(boards(), workers, chunk_size)):
+        result = {'total_flooding': total_flooding, 
+            'max_water_level': max_water_level}
+        if ids[position] is not None:
+            result = {'id': ids[position], **result}
+        output_stream.write(json.dumps(result) + '\n')
+        ids[position] = None
+
+def full_simulation(topo_grid=None, length=None, width=None, max_height=None,
+    engine=DEFAULT_ENGINE, storage=DEFAULT_STORAGE, continuous=False, 
+    workers=1, cache=None, profile=False, output=DEFAULT_OUTPUT, stream=None,
+    terrain=floodterrain.DEFAULT_TERRAIN, seed=None, basins=0,
+    checkpoint=None, export=None):
+    """
+    This function wraps all of the function and class calls required for flood 
+    simulation into one function. This function is automatically called when 
+    the script is invoked. It passes all arguments into the prepare_grid()
+    function whether customized or defaulted to None, where they are then 
+    handled appropriately. 
+
+    Parameters
+    ----------
+    topo_grid : 2D arr / list of lists or floodio raster, optional
+        A 2d Python array, square or rectangular, or a raster read by 
+        floodio.open_heights()
+    length : int, optional, defaults to DEFAULT_LENGTH
+        Desired length of a randomized 2D grid
     width : int, optional, defaults to DEFAULT_WIDTH
         Desired width of a randomized 2D grid, 
     max_height : int, optional, defaults to DEFAULT_MAX_HEIGHT
        Maximum values (height) of a randomized 2D grid
+    engine : str, optional, defaults to DEFAULT_ENGINE
+        Flood engine passed to simulate_flood()
+    storage : str, optional, defaults to DEFAULT_STORAGE
+        Cube storage backend passed to MakeCartesianGrid
+    continuous : bool, optional, default False
+        Flood the 2D grid with flood_surface() instead of extruding it into
+        cubes, which accepts float heights and heights of any magnitude
+    workers : int, optional, default 1
+        Number of worker processes flooding tiles of the board in parallel,
+        with the priority_flood engine or in continuous mode
+    cache : floodcache.FloodCache, optional
+        Cache of earlier results, which is consulted before flooding and
+        updated after
+    profile : bool, optional, default False
+        Collect a FloodProfile of the simulation, with the time of each of
+        its phases, which is returned as the profile of the result
+    output : str, optional, defaults to DEFAULT_OUTPUT
+        OUTPUT_FULL prints the grids and the flood statistics, 
+        OUTPUT_SUMMARY only the flood statistics, and OUTPUT_NONE nothing
+        at all, without formatting any of it
+    stream : file object, optional, defaults to sys.stdout
+        Text stream receiving the printed output
+    terrain : str, optional, defaults to floodterrain.DEFAULT_TERRAIN
+        Terrain type of a randomized 2D grid, passed to prepare_grid()
+    seed : int or str, optional
+        Seed of a randomized 2D grid, passed to prepare_grid()
+    basins : int, optional, default 0
+        When above 0, index the basins of the board with 
+        priority_flood_basins(), return the BasinIndex as the basins of the
+        result, and print this many of the largest basins
+    checkpoint : FloodCheckpoint, optional
+        Saves the progress of the pathfinding and level_sweep engines, see 
+        simulate_flood()
+    export : str, optional
+        Path of a raster file receiving the flooded board, see
+        export_flood(), in which case the cache is not consulted
 
     Returns
     -------
-    total_flooding : int, from flood_statistics() 
-        Number of cubes in the 3D grid that retained water
-    max_water_level : int, from flood_statistics()
-        Highest level of water that remained after flooding the 3D grid
+    (total_flooding, max_water_level) : FloodResult
+        total_flooding : int or float, from flood_statistics() 
+            Number of cubes in the 3D grid that retained water, or the volume
+            of water retained in continuous mode
+        max_water_level : int or float, from flood_statistics()
+            Highest level of water that remained after flooding the 3D grid
     """  
     
-    # Send grid (random or custom) through prepare_grid() to groom & normalize
-    groomed_grid, max_height = prepare_grid(topo_grid, length, width, 
-        max_height)
-    # Produce a 3D grid of TopoCubes that tracks contents of each cube
-    cube_grid = MakeCartesianGrid(groomed_grid, max_height)
-    # Now run the resulting 3d grid of cubes throught the flood simulator
-    result = simulate_flood(cube_grid.cubes)
+    if output not in (OUTPUT_NONE, OUTPUT_SUMMARY, OUTPUT_FULL):
+        raise ValueError(f"Unknown output '{output}', expected " +
+            f"'{OUTPUT_NONE}', '{OUTPUT_SUMMARY}' or '{OUTPUT_FULL}'")
+    verbose = output == OUTPUT_FULL
+    stream = sys.stdout if stream is None else stream
+    profile = FloodProfile() if profile else None
+    statistics = None
+    if continuous and checkpoint is not None:
+        raise ValueError("Continuous mode floods every level at once, only " +
+            "the level engines save checkpoints")
+    if continuous and cache is None and not verbose and \
+        isinstance(topo_grid, floodio.RASTER_TYPES):
+        # Continuous mode floods a raster straight from its buffer, without
+        # building a single row of it
+        groomed_grid = topo_grid
+    else:
+        # Send grid (random or custom) through prepare_grid() to groom & 
+        # normalize
+        groomed_grid, max_height = prepare_grid(topo_grid, length, width, 
+            max_height, output, stream, terrain, seed)
+    if profile is not None:
+        profile.lap('prepare')
+    # Boards seen before are answered from the cache without any flooding
+    cached = cache.get(groomed_grid) if cache is not None and export is None \
+        else None
+    if cached is not None:
+        total_flooding, max_water_level = cached
+        if verbose:
+            stream.write("Your topography grid was found in the cache.\n")
+    elif continuous:
+        # Flood the 2D grid directly, whatever the range of its heights, 
+        # indexing the basins on the way when flooding in one process
+        result = flood_surface(groomed_grid, workers, basins and workers == 1)
+        if profile is not None:
+            profile.lap('simulate')
+
+        # Print the final water surface of each square
+        if verbose:
+            stream.write("Your flooded water surface is:\n")
+            print_grid(result.water_surface(), stream)
+    else:
+        # Produce a 3D grid of TopoCubes that tracks contents of each cube
+        cube_grid = MakeCartesianGrid(groomed_grid, max_height, 
+            storage=storage)
+        if profile is not None:
+            profile.lap('extrude')
+        # Now run the resulting 3d grid of cubes throught the flood simulator,
+        # which counts the water as it goes
+        cubes = cube_grid.cubes
+        statistics = FloodStatistics(len(cubes), len(cubes[0]),
+            grid_height(cubes))
+        result = simulate_flood(cubes, engine, workers, profile, checkpoint,
+            statistics)
+        if profile is not None:
+            profile.lap('simulate')
     
-    # Print the final resulting grid with contents of each 3d position
-    print_cube_grid(result)
+        # Print the final resulting grid with contents of each 3d position
+        if verbose:
+            print_cube_grid(result, stream=stream)
+    if profile is not None:
+        profile.lap('cache' if cached is not None else 'print')
+    if export is not None:
+        export_flood(export, result)
+        if profile is not None:
+            profile.lap('export')
     
-    # Get and print the simple flood statistics of the 3D cube grid
-    total_flooding, max_water_level = flood_statistics(result)
-    print(f"Total flooding is {total_flooding} cubes.")
-    print(f"Max water level is {max_water_level}.")
-    return (total_flooding, max_water_level)
+    # Get and print the simple flood statistics of the 3D cube grid, which
+    # the engines already counted
+    if cached is None:
+        if statistics is not None:
+            total_flooding, max_water_level = statistics.total_flooding, \
+                statistics.max_water_level
+        else:
+            total_flooding, max_water_level = flood_statistics(result)
+        if cache is not None:
+            cache.put(groomed_grid, (total_flooding, max_water_level))
+    if profile is not None:
+        profile.lap('statistics')
+    unit = "units of volume" if continuous else "cubes"
+    if output != OUTPUT_NONE:
+        stream.write(f"Total flooding is {total_flooding} {unit}." +
+            f"\nMax water level is {max_water_level}.\n")
+
+    # The other engines and the cache leave the basins to a flood of their own
+    basin_index = None
+    if basins:
+        basin_index = getattr(result, 'basins', None) if cached is None \
+            else None
+        if basin_index is None:
+            basin_index = flood_basins(groomed_grid)
+        if profile is not None:
+            profile.lap('basins')
+        if output != OUTPUT_NONE:
+            for basin in basin_index.largest(basins):
+                x, y = basin.spill_point
+                stream.write(f"Basin {basin.basin_id} holds {basin.volume} " +
+                    f"{unit} over {basin.area} squares, and spills at " +
+                    f"{basin.spill_elevation} over square {x}, {y}.\n")
+    result = FloodResult(total_flooding, max_water_level)
+    result.profile = profile
+    result.basins = basin_index
+    result.statistics = statistics
+    return result
 
 """
 This area automatically triggers the entire full_simulation from the command 
@@ -490,9 +3067,38 @@ script.
 """
 
 if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    # Boards sent to a server are flooded by its warm worker processes, and
+    # floodserver imports this module, so it is only imported here
+    if args.serve is not None:
+        import floodserver
+        floodserver.run_server(args.serve or 
+            floodserver.DEFAULT_SERVE_ADDRESS, args.workers)
+        sys.exit()
+    # Everything but a server runs in a single process by default
+    workers = args.workers or 1
+
+    # Batches of boards are streamed through simulate_many() instead
+    if args.batch:
+        if args.batch == '-':
+            run_batch(sys.stdin, sys.stdout, workers)
+        else:
+            with open(args.batch) as batch_file:
+                run_batch(batch_file, sys.stdout, workers)
+        sys.exit()
     
-    # Check if any of 3 arguments were passed, otherwise pass this grid
-    if not any([args.grid_length, args.grid_width, args.max_height]):
+    # Boards may be read from a file, where -l and -w give the shape of raw 
+    # files without a header
+    if args.input:
+        chessboard = floodio.open_heights(args.input, args.grid_length,
+            args.grid_width, args.dtype)
+        if args.nodata is not None:
+            chessboard.nodata = args.nodata
+    # Check if any random grid arguments were passed, otherwise pass this grid
+    elif not any([args.grid_length, args.grid_width, args.max_height,
+        args.terrain, args.seed is not None]):
         chessboard = [  [0,8,8,7,7,4,4,4],
                         [8,0,0,0,0,0,0,3],
                         [8,0,0,0,0,0,0,3],
@@ -504,8 +3110,36 @@ if __name__ == '__main__':
         ]
     else: 
         chessboard = None
+
+    # Level engines save their progress, and may continue from it, with 
+    # --checkpoint
+    if args.resume and not args.checkpoint:
+        parser.error('--resume continues from the file given by --checkpoint')
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = FloodCheckpoint(args.checkpoint, args.checkpoint_levels,
+            args.checkpoint_seconds, args.resume)
     
     # Execute entire simulation w/ printed results & return variables if needed 
-    full_simulation(chessboard)
+    options = dict(length=args.grid_length, width=args.grid_width, 
+        max_height=args.max_height, engine=args.engine, storage=args.storage,
+        continuous=args.continuous, workers=workers, 
+        profile=args.profile is not None, output=args.output,
+        terrain=args.terrain or floodterrain.DEFAULT_TERRAIN, seed=args.seed,
+        basins=args.basins, checkpoint=checkpoint, export=args.export)
+    if args.cache:
+        with floodcache.FloodCache(path=args.cache) as cache:
+            result = full_simulation(chessboard, cache=cache, **options)
+    else:
+        result = full_simulation(chessboard, **options)
+    if args.input:
+        chessboard.close()
+
+    # Write the timings and counters of the simulation as JSON if requested
+    if args.profile == '-':
+        print(json.dumps(result.profile.as_dict()))
+    elif args.profile:
+        with open(args.profile, 'w') as profile_file:
+            json.dump(result.profile.as_dict(), profile_file, indent=2)
 
     
\ No newline at end of file